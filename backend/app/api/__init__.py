@@ -1,9 +1,10 @@
 """Module API principal"""
 from fastapi import APIRouter
-from app.api.routes import segmentation, health
+from app.api.routes import segmentation, health, admin
 
 api_router = APIRouter()
 
 # Inclure les routes
 api_router.include_router(segmentation.router)
 api_router.include_router(health.router)
+api_router.include_router(admin.router)
@@ -0,0 +1,146 @@
+"""
+Protocole binaire de /api/v3/segment : métadonnées + masques en une seule réponse.
+
+Négociation par l'en-tête Accept :
+- application/x-msgpack : un document msgpack, masques en type 'bin'
+- multipart/mixed       : une partie JSON (métadonnées) puis une partie par masque
+
+Les masques sont encodés depuis les buffers numpy (sans base64 ni fichier
+intermédiaire) en 'rle' (longueurs uint32 LE alternant fond/objet sur toute
+l'image) ou 'packed' (découpe bbox à 1 bit par pixel, MSB en premier).
+"""
+import json
+import logging
+import uuid
+import numpy as np
+from typing import Dict, Iterator, List, Optional
+from fastapi.responses import Response, StreamingResponse
+from app.models.sam3.image_processor import ImageProcessor
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    logger.warning("⚠️ msgpack non disponible (pip install msgpack)")
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+MULTIPART_MEDIA_TYPE = "multipart/mixed"
+
+
+# Types de l'en-tête Accept reconnus -> format de réponse (None = JSON)
+ACCEPTED_MEDIA_TYPES = {
+    MSGPACK_MEDIA_TYPE: "msgpack",
+    "application/msgpack": "msgpack",
+    MULTIPART_MEDIA_TYPE: "multipart",
+    "application/json": None,
+    "*/*": None,
+}
+
+
+def _quality(params: List[str]) -> float:
+    """Poids q= d'un type de l'en-tête Accept (1 par défaut, 0 si invalide)"""
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return min(max(float(value.strip()), 0.0), 1.0)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Retourne 'msgpack', 'multipart' ou None (JSON) selon l'en-tête Accept.
+    Le type reconnu de plus fort poids q= l'emporte (à égalité, le premier
+    listé) ; un type de poids 0 est refusé.
+    """
+    if not accept:
+        return None
+    best, best_quality = None, 0.0
+    for part in accept.split(","):
+        media_type, *params = part.split(";")
+        media_type = media_type.strip().lower()
+        if media_type not in ACCEPTED_MEDIA_TYPES:
+            continue
+        quality = _quality(params)
+        if quality > best_quality:
+            best, best_quality = ACCEPTED_MEDIA_TYPES[media_type], quality
+    return best
+
+
+def _byte_view(array: np.ndarray) -> memoryview:
+    """Vue octet par octet du buffer (len() = nombre d'octets, quel que soit le dtype)"""
+    return memoryview(np.ascontiguousarray(array)).cast("B")
+
+
+def _encode(mask_np: np.ndarray, bbox: Dict, encoding: str) -> memoryview:
+    if encoding == "packed":
+        return _byte_view(ImageProcessor.encode_mask_packed(mask_np, bbox))
+    return _byte_view(ImageProcessor.encode_mask_rle(mask_np))
+
+
+def _header(result: Dict, encoding: str) -> Dict:
+    """Métadonnées JSON-sérialisables (sans les buffers numpy)"""
+    header = {k: v for k, v in result.items() if k not in ("objects", "label_map")}
+    header["mask_encoding"] = encoding
+    header["objects"] = [{k: v for k, v in obj.items() if k != "mask"} for obj in result.get("objects", [])]
+    if result.get("label_map") is not None:
+        header["label_map_dtype"] = "<u2"
+    return header
+
+
+def build_msgpack_response(result: Dict, encoding: str, headers: Dict[str, str]) -> Response:
+    """Sérialise résultat et masques dans un unique document msgpack"""
+    payload = _header(result, encoding)
+    for meta, obj in zip(payload["objects"], result.get("objects", [])):
+        meta["mask"] = _encode(obj["mask"], obj["bbox"], encoding)
+    if result.get("label_map") is not None:
+        payload["label_map"] = _byte_view(result["label_map"].astype("<u2", copy=False))
+
+    return Response(
+        content=msgpack.packb(payload, use_bin_type=True),
+        media_type=MSGPACK_MEDIA_TYPE,
+        headers=headers
+    )
+
+
+def _multipart_parts(result: Dict, encoding: str, boundary: str) -> Iterator[bytes]:
+    # StreamingResponse (Starlette 0.27) n'accepte que des bytes : toute autre valeur est passée à .encode()
+    delimiter = f"--{boundary}\r\n".encode()
+
+    yield delimiter
+    yield b"Content-Type: application/json\r\n\r\n"
+    yield json.dumps(_header(result, encoding)).encode()
+    yield b"\r\n"
+
+    for obj in result.get("objects", []):
+        yield delimiter
+        yield (
+            "Content-Type: application/octet-stream\r\n"
+            f"Content-ID: <mask-{obj['object_id']}>\r\n"
+            f"X-Mask-Encoding: {encoding}\r\n\r\n"
+        ).encode()
+        yield _encode(obj["mask"], obj["bbox"], encoding).tobytes()
+        yield b"\r\n"
+
+    if result.get("label_map") is not None:
+        yield delimiter
+        yield b"Content-Type: application/octet-stream\r\nContent-ID: <label-map>\r\n\r\n"
+        yield result["label_map"].astype("<u2", copy=False).tobytes()
+        yield b"\r\n"
+
+    yield f"--{boundary}--\r\n".encode()
+
+
+def build_multipart_response(result: Dict, encoding: str, headers: Dict[str, str]) -> StreamingResponse:
+    """Réponse multipart/mixed : partie JSON puis une partie binaire par masque"""
+    boundary = f"segma-{uuid.uuid4().hex}"
+    return StreamingResponse(
+        _multipart_parts(result, encoding, boundary),
+        media_type=f"{MULTIPART_MEDIA_TYPE}; boundary={boundary}",
+        headers=headers
+    )
@@ -0,0 +1,13 @@
+"""Dépendances FastAPI partagées par les routes"""
+import hmac
+from typing import Optional
+from fastapi import Header, HTTPException
+from config import settings
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Restreint un endpoint aux porteurs du jeton ADMIN_TOKEN (désactivé si non configuré)"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoints d'administration désactivés (ADMIN_TOKEN absent).")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Jeton d'administration invalide.")
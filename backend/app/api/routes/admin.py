@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+from app.api.schemas import ProfilingRequest, ProfilingStatusResponse
+from app.api.dependencies import require_admin
+from app.services.profiler import profiler
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Toutes les routes d'administration exigent le jeton ADMIN_TOKEN
+router = APIRouter(prefix="/api/v3/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.post("/profiling", response_model=ProfilingStatusResponse)
+async def start_profiling(request: ProfilingRequest):
+    """
+    Arme le profilage pour les N prochaines requêtes et/ou une fenêtre de temps.
+    Chaque requête capturée produit une trace Chrome (torch.profiler) et un profil speedscope.
+    """
+    try:
+        return profiler.arm(requests=request.requests, duration_s=request.duration_s)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/profiling", response_model=ProfilingStatusResponse)
+async def get_profiling_status():
+    """État de la session de profilage et liste des artefacts téléchargeables"""
+    return profiler.status()
+
+
+@router.delete("/profiling", response_model=ProfilingStatusResponse)
+async def stop_profiling():
+    """Désarme la session de profilage en cours"""
+    return profiler.disarm()
+
+
+@router.get("/profiling/{artifact}")
+async def download_profiling_artifact(artifact: str):
+    """Télécharge une trace (.trace.json pour chrome://tracing / Perfetto, .speedscope.json pour speedscope.app)"""
+    path = profiler.artifact_path(artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Artefact introuvable: {artifact}")
+    media_type = "text/plain" if artifact.endswith(".txt") else "application/json"
+    return FileResponse(path, media_type=media_type, filename=artifact)
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 from app.api.schemas import HealthResponse
-from app.models.model_manager import model_manager
+from app.models.model_manager import model_registry
 from config import settings
 import logging
 
@@ -19,7 +19,7 @@ async def health():
     """
     try:
         # Récupération des infos temps réel depuis le manager singleton
-        model_info = model_manager.get_model_info()
+        model_info = model_registry.get_model_info()
         
         return HealthResponse(
             status="healthy",
@@ -1,15 +1,31 @@
-from fastapi import APIRouter, HTTPException, File, UploadFile
+from fastapi import APIRouter, HTTPException, File, UploadFile, Response, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
 from app.api.schemas import (
     SegmentationRequest, SegmentationResponse, ImageUploadResponse,
-    ModelConfigResponse, ModelInfoResponse
+    ModelConfigResponse, ModelInfoResponse, ModelReloadRequest, PersistJobResponse,
+    ArtifactListResponse
 )
+from app.services.mask_writer import mask_writer
+from app.services.artifact_store import artifact_store
+from app.services.profiler import profiler
+from app.api.dependencies import require_admin
+from app.api import binary_protocol
 from app.services.segmentation_service import SegmentationService
-from app.models.image_processor import ImageProcessor
-from app.models.model_manager import model_manager
+from app.models.sam3.image_processor import ImageProcessor
+from app.models.model_manager import model_registry
+from app.services.admission import (
+    admission_controller, estimate_request_memory, ResourceMeter, MB
+)
+from app.exceptions import (
+    AdmissionRejectedException, AdmissionTimeoutException,
+    ModelNotLoadedException, ModelVariantNotFoundException
+)
 from config import settings
+import hashlib
 import logging
 import os
 from pathlib import Path
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
@@ -20,8 +36,16 @@ router = APIRouter(prefix="/api/v3", tags=["segmentation"])
 segmentation_service = SegmentationService()
 
 @router.post("/segment", response_model=SegmentationResponse)
-async def segment_by_prompt(request: SegmentationRequest):
-    """Segmente une image par prompt texte (SAM 3 - Promptable Concept Segmentation)"""
+async def segment_by_prompt(request: SegmentationRequest, response: Response, accept: Optional[str] = Header(None)):
+    """
+    Segmente une image par prompt texte (SAM 3 - Promptable Concept Segmentation).
+
+    Selon l'en-tête Accept, la réponse est du JSON (chemins des .bin) ou un
+    unique payload binaire contenant tous les masques (msgpack ou multipart).
+    """
+    binary_format = binary_protocol.negotiate(accept)
+    if binary_format == "msgpack" and not binary_protocol.MSGPACK_AVAILABLE:
+        raise HTTPException(status_code=406, detail="msgpack non disponible sur ce serveur, utilisez multipart/mixed.")
     
     # Validation du chemin de l'image
     if not request.image_path or not os.path.exists(request.image_path):
@@ -31,26 +55,98 @@ async def segment_by_prompt(request: SegmentationRequest):
     if not request.prompt or len(request.prompt.strip()) < 2:
         raise HTTPException(status_code=400, detail="Le prompt est trop court pour être traité.")
     
+    # Estimation du coût mémoire à partir de l'en-tête de l'image (sans décodage)
     try:
-        # Appel du service (maintenant asynchrone pour ne pas bloquer l'API)
-        result = await segmentation_service.segment_by_prompt(
-            image_path=request.image_path,
-            prompt=request.prompt,
-            confidence_threshold=request.confidence_threshold,
-            save_dir=request.save_dir
-        )
+        width, height = ImageProcessor.get_image_dimensions(request.image_path)
+    except (OSError, ValueError) as e:
+        # Fichier disparu, tronqué ou qui n'est pas une image (PIL.UnidentifiedImageError est un OSError)
+        raise HTTPException(status_code=400, detail=f"Image illisible: {request.image_path} ({e})")
+    cost = estimate_request_memory(width, height, prompts=1 + len(request.additional_prompts))
+    
+    try:
+        async with admission_controller.admit(cost) as queue_time, profiler.capture(f"segment: {request.prompt}"):
+            with ResourceMeter() as meter:
+                # Appel du service (maintenant asynchrone pour ne pas bloquer l'API)
+                result = await segmentation_service.segment_by_prompt(
+                    image_path=request.image_path,
+                    prompt=request.prompt,
+                    confidence_threshold=request.confidence_threshold,
+                    save_dir=request.save_dir,
+                    additional_prompts=request.additional_prompts,
+                    nms_iou_threshold=request.nms_iou_threshold,
+                    labeling=request.labeling,
+                    model_variant=request.model_variant,
+                    persist=request.persist,
+                    return_masks=binary_format is not None,
+                    wait_durable=request.wait_durable
+                )
+        
+        # Comptabilité des ressources de la requête
+        resource_headers = {
+            "X-Segma-Memory-Estimate-MB": f"{cost / MB:.1f}",
+            "X-Segma-Peak-Memory-MB": f"{meter.peak_memory / MB:.1f}",
+            "X-Segma-Peak-Memory-Scope": meter.scope,
+            "X-Segma-Compute-Time-Ms": f"{meter.compute_time * 1000:.0f}",
+            "X-Segma-Queue-Time-Ms": f"{queue_time * 1000:.0f}",
+        }
+        
+        # Réponse binaire : métadonnées + masques en un seul aller-retour
+        if binary_format == "msgpack":
+            return binary_protocol.build_msgpack_response(result, request.mask_encoding, resource_headers)
+        if binary_format == "multipart":
+            return binary_protocol.build_multipart_response(result, request.mask_encoding, resource_headers)
+        
+        response.headers.update(resource_headers)
         
         # Le format de retour est compatible avec SegmentationResponse
         # Note: SegmentationService gère déjà la sauvegarde en .bin
         return result
         
+    except AdmissionRejectedException as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except AdmissionTimeoutException as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ModelVariantNotFoundException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ModelNotLoadedException as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la segmentation SAM 3: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/segment/jobs/{job_id}", response_model=PersistJobResponse)
+async def get_persist_job(job_id: str):
+    """État de durabilité des masques d'une segmentation (écriture différée)"""
+    status = mask_writer.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Job d'écriture inconnu ou expiré: {job_id}")
+    return status
+
+
+@router.get("/artifacts", response_model=ArtifactListResponse)
+async def list_artifacts(
+    image_hash: Optional[str] = None,
+    prompt: Optional[str] = None,
+    image_path: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0)
+):
+    """Résultats de segmentation indexés (filtrables par image, prompt ou chemin), du plus récent au plus ancien"""
+    artifacts = await run_in_threadpool(artifact_store.query, image_hash, prompt, image_path, limit, offset)
+    return {"artifacts": artifacts, "stats": await run_in_threadpool(artifact_store.get_stats)}
+
+
+@router.delete("/artifacts/{artifact_id}", dependencies=[Depends(require_admin)])
+async def delete_artifact(artifact_id: int):
+    """Supprime un résultat indexé et ses fichiers"""
+    if not await run_in_threadpool(artifact_store.delete, artifact_id):
+        raise HTTPException(status_code=404, detail=f"Artefact inconnu: {artifact_id}")
+    return {"deleted": artifact_id}
+
+
 @router.post("/upload", response_model=ImageUploadResponse)
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(file: UploadFile = File(...), x_segma_image_hash: Optional[str] = Header(None)):
     """Télécharge l'image depuis Flutter et renvoie le chemin local pour SAM 3"""
     try:
         # Vérification extension
@@ -64,15 +160,30 @@ async def upload_image(file: UploadFile = File(...)):
         if len(content) > settings.MAX_FILE_SIZE:
             raise HTTPException(status_code=413, detail="L'image est trop lourde.")
         
-        # Sauvegarde
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        file_path = os.path.join(settings.UPLOAD_DIR, file.filename)
+        # Sauvegarde ; derrière la passerelle, le chemin encode la clé de contenu
+        # (deux images homonymes envoyées à des nœuds différents ne se confondent pas)
+        upload_dir = settings.UPLOAD_DIR
+        if x_segma_image_hash:
+            if x_segma_image_hash != hashlib.sha256(content).hexdigest():
+                raise HTTPException(status_code=400, detail="X-Segma-Image-Hash ne correspond pas au contenu reçu.")
+            upload_dir = os.path.join(settings.UPLOAD_DIR, x_segma_image_hash)
+        os.makedirs(upload_dir, exist_ok=True)
+        file_path = os.path.join(upload_dir, os.path.basename(file.filename))
         
         with open(file_path, 'wb') as f:
             f.write(content)
         
         # Extraction des dimensions pour Flutter
-        width, height = ImageProcessor.get_image_dimensions(file_path)
+        try:
+            width, height = ImageProcessor.get_image_dimensions(file_path)
+        except (OSError, ValueError):
+            os.remove(file_path)
+            raise HTTPException(status_code=400, detail="Le fichier n'est pas une image valide.")
+        
+        # Une image qui dépasserait seule le budget mémoire ne pourra jamais être segmentée
+        if estimate_request_memory(width, height) > admission_controller.budget_bytes:
+            os.remove(file_path)
+            raise HTTPException(status_code=413, detail="Résolution trop élevée pour le budget mémoire du serveur.")
         
         return ImageUploadResponse(
             filename=file.filename,
@@ -81,6 +192,8 @@ async def upload_image(file: UploadFile = File(...)):
             height=height,
             size_mb=round(len(content) / (1024 * 1024), 2)
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erreur Upload: {e}")
         raise HTTPException(status_code=500, detail="Échec du téléchargement de l'image.")
@@ -90,7 +203,20 @@ async def upload_image(file: UploadFile = File(...)):
 async def get_model_info():
     """Récupère l'état de santé du modèle SAM 3 et YOLO"""
     try:
-        return model_manager.get_model_info()
+        return model_registry.get_model_info()
     except Exception as e:
         logger.error(f"Erreur Model Info: {e}")
-        raise HTTPException(status_code=500, detail="Impossible de récupérer les infos modèle.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Impossible de récupérer les infos modèle.")
+
+
+@router.post("/model/reload", response_model=ModelInfoResponse, dependencies=[Depends(require_admin)])
+async def reload_model(request: ModelReloadRequest):
+    """Recharge à chaud une variante SAM 3 (nouveau checkpoint/précision) sans interrompre le service"""
+    try:
+        await run_in_threadpool(model_registry.reload, request.variant, request.model_id, request.dtype)
+        return model_registry.get_model_info()
+    except ModelVariantNotFoundException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ModelNotLoadedException as e:
+        # L'ancienne instance reste en service si le nouveau chargement échoue
+        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
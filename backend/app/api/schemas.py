@@ -8,16 +8,33 @@ class SegmentationRequest(BaseModel):
     prompt: str = Field(..., description="Concept textuel à segmenter (ex: 'boulons rouillés')")
     confidence_threshold: float = Field(0.25, ge=0.0, le=1.0, description="Seuil de confiance")
     save_dir: Optional[str] = Field(None, description="Répertoire de destination pour les .bin")
+    additional_prompts: List[str] = Field(
+        default_factory=list,
+        description="Concepts supplémentaires ; les chevauchements sont résolus en carte panoptique"
+    )
+    nms_iou_threshold: Optional[float] = Field(
+        None, ge=0.0, le=1.0, description="Seuil d'IoU pour la fusion des doublons (défaut: config)"
+    )
+    labeling: Optional[str] = Field(
+        None, pattern="^(off|always|generic)$", description="Politique d'étiquetage YOLO (défaut: config)"
+    )
+    model_variant: Optional[str] = Field(None, description="Variante SAM 3 à utiliser (défaut: SAM3_DEFAULT_VARIANT)")
+    persist: bool = Field(True, description="Écrire les masques .bin sur disque")
+    mask_encoding: str = Field(
+        "rle", pattern="^(rle|packed)$", description="Encodage des masques pour les réponses binaires (msgpack/multipart)"
+    )
+    wait_durable: bool = Field(False, description="Attendre que les masques soient écrits et synchronisés sur disque")
 
 
 class SegmentedObject(BaseModel):
     """Métadonnées d'un objet extrait par SAM 3"""
     object_id: int = Field(..., description="Index de l'objet")
     label: str = Field(..., description="Label identifié par YOLO ou prompt")
+    prompt: Optional[str] = Field(None, description="Concept textuel ayant produit le masque")
     confidence: float = Field(..., description="Score de confiance du modèle")
     # Utilisation d'un Dict pour la flexibilité de la BBox {x1, y1, x2, y2}
     bbox: Dict[str, int] = Field(..., description="Boîte englobante en pixels")
-    mask_path: str = Field(..., description="Chemin absolu vers le fichier .bin")
+    mask_path: Optional[str] = Field(None, description="Chemin absolu vers le fichier .bin (absent si persist=false)")
     pixels_count: int = Field(..., description="Surface de l'objet en pixels")
 
 
@@ -27,7 +44,49 @@ class SegmentationResponse(BaseModel):
     resolution: str = Field(..., description="Format 'Largeur x Hauteur'")
     objects_count: int = Field(..., description="Nombre d'objets trouvés")
     objects: List[SegmentedObject] = Field(..., description="Détails de chaque segment")
-    segmentation_dir: str = Field(..., description="Dossier contenant les masques binaires")
+    segmentation_dir: Optional[str] = Field(None, description="Dossier contenant les masques binaires")
+    label_map_path: Optional[str] = Field(
+        None, description="Carte panoptique .bin (uint16, 0 = fond, k = objet k-1) si plusieurs prompts"
+    )
+    persist_job_id: Optional[str] = Field(None, description="Job d'écriture différée (voir /segment/jobs/{id})")
+    durable: bool = Field(False, description="Les masques sont écrits et synchronisés sur disque")
+    artifact_id: Optional[int] = Field(None, description="Entrée du store d'artefacts (absent avec save_dir)")
+    cached: bool = Field(False, description="Résultat relu depuis le store, sans nouvelle inférence")
+
+
+class ArtifactResponse(BaseModel):
+    """Résultat de segmentation indexé dans le store d'artefacts"""
+    id: int
+    image_hash: str = Field(..., description="Empreinte du contenu de l'image")
+    prompt: str
+    params_key: str = Field(..., description="Empreinte des paramètres de segmentation")
+    params: Dict = Field(..., description="Prompts, seuils, étiquetage et variante utilisés")
+    image_path: Optional[str] = None
+    resolution: Optional[str] = None
+    directory: str = Field(..., description="Dossier des masques")
+    label_map_path: Optional[str] = None
+    objects: List[SegmentedObject]
+    size_bytes: int
+    durable: bool
+    created_at: float
+    last_access: float
+
+
+class ArtifactListResponse(BaseModel):
+    """Page de résultats du store d'artefacts"""
+    artifacts: List[ArtifactResponse]
+    stats: Dict = Field(..., description="Nombre d'artefacts, taille totale et quota (Mo)")
+
+
+class PersistJobResponse(BaseModel):
+    """État d'un job d'écriture différée des masques"""
+    job_id: str
+    total: int = Field(..., description="Nombre de fichiers à écrire")
+    written: int = Field(..., description="Fichiers écrits et synchronisés")
+    failed: int = Field(..., description="Écritures en échec")
+    durable: bool = Field(..., description="Tous les fichiers sont durables")
+    finished: bool = Field(..., description="Plus aucune écriture en attente")
+    errors: List[str] = Field(default_factory=list)
 
 
 class ImageUploadResponse(BaseModel):
@@ -57,6 +116,13 @@ class ModelConfigResponse(BaseModel):
     is_loaded: bool
     cuda_available: bool
 
+class ModelReloadRequest(BaseModel):
+    """Rechargement à chaud d'une variante (admin)"""
+    variant: Optional[str] = Field(None, description="Variante à recharger (défaut: variante par défaut)")
+    model_id: Optional[str] = Field(None, description="Nouveau checkpoint (défaut: inchangé)")
+    dtype: Optional[str] = Field(None, pattern="^(float32|float16|bfloat16)$", description="Nouvelle précision")
+
+
 class ModelInfoResponse(BaseModel):
     """Informations détaillées du modèle SAM 3"""
     model_type: str = Field(..., description="Type de modèle")
@@ -65,4 +131,25 @@ class ModelInfoResponse(BaseModel):
     vram_gb: Optional[float] = Field(None, description="VRAM disponible en GB")
     is_loaded: bool = Field(..., description="Indique si le modèle est chargé")
     available_models: List[str] = Field(..., description="Modèles disponibles")
-    cuda_available: bool = Field(..., description="CUDA disponible")
\ No newline at end of file
+    default_variant: Optional[str] = Field(None, description="Variante utilisée par défaut")
+    variants: List[Dict] = Field(default_factory=list, description="État de chaque variante (chargement, mémoire, requêtes en cours)")
+    text_embedding_cache: Optional[Dict] = Field(None, description="Statistiques du cache d'embeddings textuels")
+    runtime_config: Optional[Dict] = Field(None, description="Threads d'inférence et lot texte en vigueur (autotune)")
+    cuda_available: bool = Field(..., description="CUDA disponible")
+
+# --- Schemas d'administration ---
+
+class ProfilingRequest(BaseModel):
+    """Armement du profilage à la demande"""
+    requests: Optional[int] = Field(None, ge=1, description="Nombre de prochaines requêtes à capturer")
+    duration_s: Optional[float] = Field(None, gt=0, description="Fenêtre de capture en secondes")
+
+
+class ProfilingStatusResponse(BaseModel):
+    """État de la session de profilage"""
+    active: bool
+    session_id: Optional[str] = None
+    remaining_requests: Optional[int] = None
+    expires_in_s: Optional[float] = None
+    captured: int = Field(0, description="Requêtes capturées dans la session")
+    artifacts: List[str] = Field(default_factory=list, description="Fichiers téléchargeables")
@@ -13,6 +13,11 @@ class ModelNotLoadedException(SegmaException):
     pass
 
 
+class ModelVariantNotFoundException(SegmaException):
+    """Exception levée quand la variante de modèle demandée n'est pas déclarée"""
+    pass
+
+
 class ImageProcessingException(SegmaException):
     """Exception levée lors d'une erreur de traitement d'image"""
     pass
@@ -26,3 +31,13 @@ class SegmentationException(SegmaException):
 class InvalidCoordinatesException(SegmaException):
     """Exception levée quand les coordonnées sont invalides"""
     pass
+
+
+class AdmissionRejectedException(SegmaException):
+    """Exception levée quand une requête dépasse à elle seule le budget mémoire"""
+    pass
+
+
+class AdmissionTimeoutException(SegmaException):
+    """Exception levée quand une requête attend trop longtemps une place dans le budget mémoire"""
+    pass
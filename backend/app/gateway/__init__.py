@@ -0,0 +1,13 @@
+"""Passerelle de routage par affinité de cache entre nœuds SEGMA"""
+import logging
+import uvicorn
+from config import settings
+
+
+def run_gateway():
+    """Démarre la passerelle (sans charger torch ni les modèles)"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    uvicorn.run("app.gateway.app:app", host=settings.HOST, port=settings.PORT)
@@ -0,0 +1,351 @@
+"""
+Passerelle SEGMA : routage par affinité de cache entre plusieurs nœuds backend.
+
+- /upload : la clé est le hash du contenu de l'image ; la même image atterrit
+  toujours sur le même nœud (hachage cohérent à charge bornée)
+- /segment : envoyé au nœud qui détient `image_path` ; les nœuds rangent ces
+  uploads sous UPLOAD_DIR/<sha256>/, le chemin porte donc la clé de contenu
+- Santé des nœuds vérifiée via /api/v3/health ; l'anneau est recalculé quand
+  un nœud tombe, revient, rejoint ou quitte le pool
+- Ressources propres à un nœud (profilage, index d'artefacts, rechargement) :
+  le nœud est désigné explicitement par l'en-tête X-Segma-Node
+"""
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import httpx
+from fastapi import FastAPI, Request, HTTPException, Depends, Header
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+
+from app.gateway.hash_ring import BoundedLoadRouter
+from config import settings
+
+logger = logging.getLogger("SEGMA.gateway")
+
+# En-têtes hop-by-hop à ne pas relayer
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "host", "content-encoding"}
+
+# Routes dont l'état est local à un nœud : relayées uniquement au nœud désigné par X-Segma-Node
+NODE_LOCAL_PREFIXES = ("admin/", "artifacts", "model/reload")
+
+# Les nœuds rangent les uploads de la passerelle sous UPLOAD_DIR/<sha256 du contenu>/
+IMAGE_KEY_PATTERN = re.compile(r"(?:^|[/\\])([0-9a-f]{64})[/\\][^/\\]+$")
+
+
+def image_key(image_path: str) -> Optional[str]:
+    """Clé de contenu encodée dans un chemin renvoyé par /upload via la passerelle"""
+    match = IMAGE_KEY_PATTERN.search(image_path or "")
+    return match.group(1) if match else None
+
+
+class NodeState:
+    """État de santé d'un nœud backend"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = False
+        self.failures = 0
+        self.last_check = 0.0
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+        }
+
+
+class NodePool:
+    """Nœuds connus, santé et routage"""
+
+    def __init__(self):
+        self.router = BoundedLoadRouter(vnodes=settings.GATEWAY_VNODES, load_factor=settings.GATEWAY_LOAD_FACTOR)
+        self.nodes: Dict[str, NodeState] = {}
+        # image_path (contient la clé de contenu) -> nœud qui détient le fichier
+        self.paths: "OrderedDict[str, str]" = OrderedDict()
+        # job d'écriture différée -> nœud
+        self.jobs: "OrderedDict[str, str]" = OrderedDict()
+        self._round_robin = itertools.count()
+
+    def join(self, url: str):
+        url = url.rstrip("/")
+        if url not in self.nodes:
+            self.nodes[url] = NodeState(url)
+            logger.info(f"➕ Nœud ajouté au pool : {url}")
+
+    def leave(self, url: str):
+        url = url.rstrip("/")
+        if self.nodes.pop(url, None) is not None:
+            self.router.remove_node(url)
+            logger.info(f"➖ Nœud retiré du pool : {url}")
+
+    def healthy_nodes(self):
+        return [n.url for n in self.nodes.values() if n.healthy]
+
+    def _set_health(self, node: NodeState, healthy: bool, error: Optional[str] = None):
+        # Contrôle terminé après un leave() : le nœud retiré ne doit pas revenir dans l'anneau
+        if self.nodes.get(node.url) is not node:
+            return
+        node.last_check = time.time()
+        node.last_error = error
+        if healthy:
+            node.failures = 0
+            if not node.healthy:
+                logger.info(f"✅ Nœud disponible : {node.url}")
+                self.router.add_node(node.url)
+            node.healthy = True
+        else:
+            node.failures += 1
+            if node.healthy and node.failures >= settings.GATEWAY_UNHEALTHY_AFTER:
+                logger.warning(f"⚠️ Nœud indisponible, retiré de l'anneau : {node.url} ({error})")
+                self.router.remove_node(node.url)
+                node.healthy = False
+
+    async def check(self, client: httpx.AsyncClient, node: NodeState):
+        try:
+            response = await client.get(f"{node.url}/api/v3/health", timeout=settings.GATEWAY_HEALTH_TIMEOUT)
+            payload = response.json() if response.status_code == 200 else {}
+            # Un nœud sans modèle chargé se déclare "healthy" mais ne peut pas segmenter
+            healthy = payload.get("status") == "healthy" and payload.get("model_loaded") is True
+            if healthy:
+                error = None
+            elif response.status_code != 200:
+                error = f"HTTP {response.status_code}"
+            else:
+                error = f"status={payload.get('status')}, model_loaded={payload.get('model_loaded')}"
+            self._set_health(node, healthy, error)
+        except Exception as e:
+            self._set_health(node, False, str(e))
+
+    async def check_all(self, client: httpx.AsyncClient):
+        await asyncio.gather(*(self.check(client, node) for node in list(self.nodes.values())))
+
+    def remember_path(self, image_path: str, node: str):
+        self.paths[image_path] = node
+        self.paths.move_to_end(image_path)
+        while len(self.paths) > settings.GATEWAY_PATH_INDEX_SIZE:
+            self.paths.popitem(last=False)
+
+    def remember_job(self, job_id: str, node: str):
+        self.jobs[job_id] = node
+        while len(self.jobs) > settings.GATEWAY_PATH_INDEX_SIZE:
+            self.jobs.popitem(last=False)
+
+    def any_node(self) -> Optional[str]:
+        nodes = self.healthy_nodes()
+        return nodes[next(self._round_robin) % len(nodes)] if nodes else None
+
+
+pool = NodePool()
+client: Optional[httpx.AsyncClient] = None
+
+
+async def _health_loop():
+    while True:
+        await pool.check_all(client)
+        await asyncio.sleep(settings.GATEWAY_HEALTH_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client
+    client = httpx.AsyncClient(timeout=settings.GATEWAY_TIMEOUT)
+    for url in settings.GATEWAY_NODES:
+        pool.join(url)
+    await pool.check_all(client)
+    logger.info(f"🌐 Passerelle SEGMA prête ({len(pool.healthy_nodes())}/{len(pool.nodes)} nœuds disponibles)")
+    health_task = asyncio.create_task(_health_loop())
+
+    yield
+
+    health_task.cancel()
+    await client.aclose()
+
+
+app = FastAPI(
+    title="SEGMA Gateway",
+    description="Routage par affinité de cache (hachage cohérent) entre nœuds SEGMA",
+    version="3.0.0",
+    lifespan=lifespan
+)
+
+
+async def _forward(request: Request, node: str, body: bytes, headers: Optional[Dict] = None) -> Response:
+    """Relaye la requête vers le nœud et renvoie sa réponse telle quelle"""
+    forward_headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+    if headers:
+        forward_headers.update(headers)
+    try:
+        upstream = await client.request(
+            request.method,
+            f"{node}{request.url.path}",
+            params=request.query_params,
+            content=body,
+            headers=forward_headers
+        )
+    except httpx.HTTPError as e:
+        # Le nœud sera retiré par le prochain contrôle de santé s'il reste injoignable
+        logger.error(f"❌ Nœud {node} injoignable : {e}")
+        raise HTTPException(status_code=502, detail=f"Nœud SEGMA injoignable : {node}")
+
+    response_headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS}
+    response_headers["X-Segma-Node"] = node
+    return Response(content=upstream.content, status_code=upstream.status_code, headers=response_headers)
+
+
+@app.post("/api/v3/upload")
+async def upload(request: Request):
+    """Upload routé par hash du contenu : une même image va toujours au même nœud"""
+    body = await request.body()
+    form = await request.form()
+    upload_file = form.get("file")
+    if upload_file is None or not hasattr(upload_file, "read"):
+        raise HTTPException(status_code=400, detail="Champ 'file' manquant.")
+    key = hashlib.sha256(await upload_file.read()).hexdigest()
+
+    node = pool.router.acquire(key)
+    if node is None:
+        raise HTTPException(status_code=503, detail="Aucun nœud SEGMA disponible.")
+    try:
+        response = await _forward(request, node, body, {"X-Segma-Image-Hash": key})
+    finally:
+        pool.router.release(node)
+
+    if response.status_code == 200:
+        image_path = json.loads(response.body).get("image_path")
+        if image_key(image_path) == key:
+            pool.remember_path(image_path, node)
+    response.headers["X-Segma-Image-Hash"] = key
+    return response
+
+
+@app.post("/api/v3/segment")
+async def segment(request: Request):
+    """Segmentation envoyée au nœud qui détient l'image (sinon au propriétaire de la clé)"""
+    body = await request.body()
+    try:
+        image_path = json.loads(body).get("image_path", "")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Corps JSON invalide.")
+
+    key = image_key(image_path)
+    if key is None:
+        raise HTTPException(
+            status_code=400,
+            detail="image_path inconnu de la passerelle : envoyez l'image via /api/v3/upload de la passerelle."
+        )
+    # Nœud qui a reçu le fichier ; à défaut (passerelle redémarrée), propriétaire de la clé sur l'anneau
+    node = pool.paths.get(image_path)
+    if node is not None and node in pool.healthy_nodes():
+        pool.router.acquire_node(node)
+    else:
+        node = pool.router.acquire(key)
+    if node is None:
+        raise HTTPException(status_code=503, detail="Aucun nœud SEGMA disponible.")
+
+    try:
+        response = await _forward(request, node, body)
+    finally:
+        pool.router.release(node)
+
+    if response.status_code == 200 and response.headers.get("content-type", "").startswith("application/json"):
+        job_id = json.loads(response.body).get("persist_job_id")
+        if job_id:
+            pool.remember_job(job_id, node)
+    return response
+
+
+@app.get("/api/v3/segment/jobs/{job_id}")
+async def persist_job(job_id: str, request: Request):
+    """État d'un job d'écriture : relayé au nœud qui a traité la segmentation"""
+    node = pool.jobs.get(job_id)
+    if node is None or node not in pool.healthy_nodes():
+        raise HTTPException(status_code=404, detail=f"Job d'écriture inconnu de la passerelle : {job_id}")
+    return await _forward(request, node, b"")
+
+
+@app.get("/api/v3/health")
+async def health():
+    """Santé agrégée : la passerelle est saine si au moins un nœud l'est"""
+    healthy = pool.healthy_nodes()
+    return {
+        "status": "healthy" if healthy else "unhealthy",
+        "mode": "gateway",
+        "healthy_nodes": len(healthy),
+        "total_nodes": len(pool.nodes),
+    }
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Même contrôle que app.api.dependencies, sans importer la pile modèle (app.api charge YOLO)"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoints d'administration désactivés (ADMIN_TOKEN absent).")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Jeton d'administration invalide.")
+
+
+class NodeRequest(BaseModel):
+    url: str = Field(..., description="URL de base du nœud (ex: http://127.0.0.1:8001)")
+
+
+@app.get("/gateway/nodes", dependencies=[Depends(require_admin)])
+async def list_nodes():
+    """Nœuds connus, santé et charge en cours"""
+    return [
+        {**node.to_dict(), "in_flight": pool.router.loads.get(node.url, 0)}
+        for node in pool.nodes.values()
+    ]
+
+
+@app.post("/gateway/nodes", dependencies=[Depends(require_admin)])
+async def join_node(request: NodeRequest):
+    """Ajoute un nœud ; il rejoint l'anneau dès son premier contrôle de santé réussi"""
+    pool.join(request.url)
+    await pool.check(client, pool.nodes[request.url.rstrip("/")])
+    return await list_nodes()
+
+
+@app.delete("/gateway/nodes", dependencies=[Depends(require_admin)])
+async def leave_node(request: NodeRequest):
+    """Retire un nœud du pool (ses clés sont redistribuées sur l'anneau)"""
+    pool.leave(request.url)
+    return await list_nodes()
+
+
+@app.api_route("/api/v3/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+async def passthrough(path: str, request: Request, x_segma_node: Optional[str] = Header(None)):
+    """
+    Autres routes : relayées au nœud désigné par X-Segma-Node, sinon à un nœud
+    disponible. Les routes dont l'état est local à un nœud (profilage, artefacts,
+    rechargement) exigent X-Segma-Node : réparties en tourniquet, armement,
+    état et téléchargement atterriraient sur des nœuds différents.
+    """
+    if x_segma_node:
+        node = x_segma_node.rstrip("/")
+        if node not in pool.nodes:
+            raise HTTPException(status_code=404, detail=f"Nœud inconnu de la passerelle : {node}")
+        if node not in pool.healthy_nodes():
+            raise HTTPException(status_code=503, detail=f"Nœud SEGMA indisponible : {node}")
+    elif path.startswith(NODE_LOCAL_PREFIXES):
+        raise HTTPException(
+            status_code=400,
+            detail=f"/api/v3/{path} est propre à un nœud : précisez-le avec l'en-tête X-Segma-Node (voir GET /gateway/nodes)."
+        )
+    else:
+        node = pool.any_node()
+        if node is None:
+            raise HTTPException(status_code=503, detail="Aucun nœud SEGMA disponible.")
+    return await _forward(request, node, await request.body())
@@ -0,0 +1,103 @@
+import bisect
+import hashlib
+import math
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing:
+    """
+    Anneau de hachage cohérent avec nœuds virtuels.
+    L'ajout ou le retrait d'un nœud ne déplace qu'environ 1/N des clés.
+    """
+
+    def __init__(self, vnodes: int = 128):
+        self.vnodes = vnodes
+        self._ring: List[Tuple[int, str]] = []
+        self._nodes = set()
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(self._nodes)
+
+    def add(self, node: str):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.vnodes):
+            bisect.insort(self._ring, (_hash(f"{node}#{i}"), node))
+
+    def remove(self, node: str):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._ring = [(h, n) for h, n in self._ring if n != node]
+
+    def candidates(self, key: str) -> Iterator[str]:
+        """Nœuds distincts dans l'ordre de l'anneau à partir de la position de la clé"""
+        if not self._ring:
+            return
+        start = bisect.bisect(self._ring, (_hash(key), ""))
+        seen = set()
+        for i in range(len(self._ring)):
+            node = self._ring[(start + i) % len(self._ring)][1]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self._nodes):
+                    return
+
+
+class BoundedLoadRouter:
+    """
+    Hachage cohérent à charge bornée : une clé va à son nœud propriétaire sauf
+    s'il dépasse `load_factor` x la charge moyenne ; elle glisse alors vers le
+    nœud suivant de l'anneau. Garde l'affinité de cache sans surcharger un nœud.
+    """
+
+    def __init__(self, vnodes: int = 128, load_factor: float = 1.25):
+        self.ring = ConsistentHashRing(vnodes)
+        self.load_factor = load_factor
+        self.loads: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_node(self, node: str):
+        with self._lock:
+            self.ring.add(node)
+            self.loads.setdefault(node, 0)
+
+    def remove_node(self, node: str):
+        with self._lock:
+            self.ring.remove(node)
+
+    def owner(self, key: str) -> Optional[str]:
+        """Nœud propriétaire de la clé, sans tenir compte de la charge"""
+        with self._lock:
+            return next(self.ring.candidates(key), None)
+
+    def acquire(self, key: str) -> Optional[str]:
+        """Choisit un nœud pour la clé et compte la requête en cours"""
+        with self._lock:
+            nodes = self.ring.nodes
+            if not nodes:
+                return None
+            total = sum(self.loads.get(n, 0) for n in nodes) + 1
+            capacity = math.ceil(self.load_factor * total / len(nodes))
+            for node in self.ring.candidates(key):
+                if self.loads.get(node, 0) < capacity:
+                    self.loads[node] = self.loads.get(node, 0) + 1
+                    return node
+            return None
+
+    def acquire_node(self, node: str):
+        """Compte une requête envoyée à un nœud imposé (ex: fichier présent localement)"""
+        with self._lock:
+            self.loads[node] = self.loads.get(node, 0) + 1
+
+    def release(self, node: str):
+        with self._lock:
+            self.loads[node] = max(self.loads.get(node, 0) - 1, 0)
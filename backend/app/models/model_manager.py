@@ -1,83 +1,327 @@
+import gc
 import logging
+import threading
+import time
 import torch
-from typing import Optional, Dict
-from app.models.sam3_wrapper import SAM3Wrapper 
+from contextlib import contextmanager
+from typing import Optional, Dict, List
+from app.models.sam3.sam3_wrapper import SAM3Wrapper
+from app.models.sam3.text_embedding_cache import text_embedding_cache
+from app.services.autotune import runtime_tuner
+from app.exceptions import ModelNotLoadedException, ModelVariantNotFoundException
 from config import settings
 
 logger = logging.getLogger(__name__)
 
-class ModelManager:
-    """Singleton pour gérer le cycle de vie des modèles IA (SAM 3)"""
-    
-    _instance: Optional['ModelManager'] = None
-    
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._initialized = False
-        return cls._instance
-    
+DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+
+def parse_variants(spec: str) -> Dict[str, Dict]:
+    """Parse 'nom=checkpoint[:précision],...' en {nom: {"model_id", "dtype"}}"""
+    variants = {}
+    for item in spec.split(","):
+        if not item.strip() or "=" not in item:
+            continue
+        name, target = item.split("=", 1)
+        model_id, _, dtype = target.strip().partition(":")
+        if dtype and dtype not in DTYPES:
+            raise ValueError(f"Précision inconnue '{dtype}' pour la variante '{name.strip()}'")
+        variants[name.strip()] = {"model_id": model_id, "dtype": dtype or "float32"}
+    return variants
+
+
+class ModelEntry:
+    """État d'une variante de modèle dans le registre"""
+
+    def __init__(self, name: str, model_id: str, dtype: str):
+        self.name = name
+        self.model_id = model_id
+        self.dtype = dtype
+        self.wrapper: Optional[SAM3Wrapper] = None
+        self.memory_bytes = 0
+        self.last_used = 0.0
+        self.error: Optional[str] = None
+        self.failed_at = 0.0
+        # Sérialise le chargement : une variante n'est chargée qu'une fois
+        self.load_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Registre thread-safe des variantes SAM 3 (checkpoints / précisions).
+
+    - Chargement paresseux, une seule fois par variante, sous verrou
+    - Sélection de la variante par requête via `acquire()`
+    - Rechargement à chaud : le nouveau modèle est chargé pendant que l'ancien
+      sert encore, puis l'ancien est libéré une fois ses requêtes terminées
+    - Déchargement LRU des variantes inactives au-delà de MODEL_MEMORY_BUDGET_MB
+    """
+
     def __init__(self):
-        if self._initialized:
-            return
-        
-        self.sam3_model: Optional[SAM3Wrapper] = None
         self.device = self._get_device()
-        self.is_loaded = False
-        
-        # Chargement immédiat au démarrage du serveur
-        self._load_model()
-        self._initialized = True
-    
+        self.default_variant = settings.SAM3_DEFAULT_VARIANT
+        self._entries: Dict[str, ModelEntry] = {
+            name: ModelEntry(name, spec["model_id"], spec["dtype"])
+            for name, spec in parse_variants(settings.SAM3_MODEL_VARIANTS).items()
+        }
+        if self.default_variant not in self._entries:
+            self._entries[self.default_variant] = ModelEntry(self.default_variant, settings.SAM3_MODEL_ID, "float32")
+
+        # Requêtes en cours par instance de modèle (clé: id du wrapper)
+        self._in_flight: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        # Éviction LRU sérialisée, hors du thread qui a demandé le chargement
+        self._evict_lock = threading.Lock()
+        self._eviction: Optional[threading.Thread] = None
+
     def _get_device(self) -> str:
         """Détermine le device à utiliser (cuda ou cpu)"""
         # On priorise le réglage du .env mais on valide la capacité réelle
         req_device = settings.DEVICE.lower()
-        
+
         if req_device == "cuda" and torch.cuda.is_available():
             logger.info(f"✓ CUDA détecté: {torch.cuda.get_device_name(0)}")
             return "cuda"
-        
+
         if req_device == "mps" and torch.backends.mps.is_available():
             logger.info("✓ Apple Silicon GPU (MPS) détecté")
             return "mps"
-            
+
         logger.warning(f"⚠️ {req_device.upper()} non disponible, repli sur CPU")
         return "cpu"
-    
-    def _load_model(self):
-        """Charge le modèle SAM 3 via le wrapper"""
+
+    def _get_entry(self, variant: Optional[str]) -> ModelEntry:
+        name = variant or self.default_variant
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ModelVariantNotFoundException(
+                f"Variante '{name}' inconnue (disponibles: {', '.join(self._entries)})"
+            )
+        return entry
+
+    def _build_wrapper(self, entry: ModelEntry, model_id: str, dtype: str) -> SAM3Wrapper:
+        logger.info(f"📥 Initialisation de SAM 3 [{entry.name}] ({model_id}, {dtype}) sur {self.device}...")
+        wrapper = SAM3Wrapper(device=self.device, model_id=model_id, dtype=DTYPES[dtype])
+        if not wrapper.is_loaded:
+            raise ModelNotLoadedException(f"Échec du chargement de la variante '{entry.name}' ({model_id})")
+        return wrapper
+
+    @staticmethod
+    def _check_failure(entry: ModelEntry):
+        """Échec récent : pas de nouveau chargement de plusieurs Go avant MODEL_LOAD_RETRY_S"""
+        if entry.error is None:
+            return
+        remaining = entry.failed_at + settings.MODEL_LOAD_RETRY_S - time.monotonic()
+        if remaining > 0:
+            raise ModelNotLoadedException(
+                f"Variante '{entry.name}' indisponible ({entry.error}) ; "
+                f"nouvel essai dans {remaining:.0f}s ou via /api/v3/model/reload"
+            )
+
+    def load(self, variant: Optional[str] = None) -> SAM3Wrapper:
+        """Charge la variante si nécessaire (une seule fois, même en concurrence)"""
+        entry = self._get_entry(variant)
+        if entry.wrapper is not None:
+            return entry.wrapper
+        self._check_failure(entry)
+
+        with entry.load_lock:
+            if entry.wrapper is not None:
+                return entry.wrapper
+            # Les requêtes qui attendaient le verrou échouent avec le chargement qu'elles attendaient
+            self._check_failure(entry)
+            try:
+                wrapper = self._build_wrapper(entry, entry.model_id, entry.dtype)
+            except Exception as e:
+                entry.error = str(e)
+                entry.failed_at = time.monotonic()
+                logger.error(f"❌ {e}")
+                raise ModelNotLoadedException(str(e))
+
+            with self._lock:
+                entry.wrapper = wrapper
+                entry.memory_bytes = wrapper.memory_bytes()
+                entry.last_used = time.monotonic()
+                entry.error = None
+            logger.info(f"✅ SAM 3 [{entry.name}] prêt ({entry.memory_bytes / 1024 ** 2:.0f} Mo)")
+
+        self._schedule_budget(keep=entry.name)
+        return entry.wrapper
+
+    def get_model(self, variant: Optional[str] = None) -> SAM3Wrapper:
+        """Retourne le modèle de la variante (chargé à la demande)"""
+        return self.load(variant)
+
+    @contextmanager
+    def acquire(self, variant: Optional[str] = None):
+        """
+        Réserve le modèle de la variante pendant la durée d'une requête.
+        Un rechargement ou déchargement attend la fin des réservations en cours.
+        """
+        entry = self._get_entry(variant)
+        while True:
+            wrapper = self.load(entry.name)
+            with self._lock:
+                # Le modèle a pu être échangé ou déchargé entre le chargement et la réservation
+                if entry.wrapper is wrapper:
+                    self._in_flight[id(wrapper)] = self._in_flight.get(id(wrapper), 0) + 1
+                    entry.last_used = time.monotonic()
+                    break
         try:
-            logger.info(f"📥 Initialisation de SAM 3 sur {self.device}...")
-            # SAM3Wrapper gère déjà son propre try/except interne
-            self.sam3_model = SAM3Wrapper(device=self.device)
-            self.is_loaded = self.sam3_model.is_loaded
-            
-            if self.is_loaded:
-                logger.info("✅ SAM 3 prêt à l'emploi")
-            else:
-                logger.error("❌ Échec de l'initialisation de SAM 3")
-        except Exception as e:
-            logger.error(f"❌ Erreur critique au chargement du manager: {e}")
-            self.is_loaded = False
-    
-    def get_model(self) -> SAM3Wrapper:
-        """Retourne l'instance unique du modèle"""
-        if self.sam3_model is None or not self.is_loaded:
-            self._load_model()
-        return self.sam3_model
-    
+            yield wrapper
+        finally:
+            with self._lock:
+                self._in_flight[id(wrapper)] -= 1
+                if self._in_flight[id(wrapper)] == 0:
+                    del self._in_flight[id(wrapper)]
+                    self._drained.notify_all()
+
+    def _drain_and_free(self, wrapper: SAM3Wrapper, name: str):
+        """Attend la fin des requêtes utilisant `wrapper` puis libère sa mémoire"""
+        with self._lock:
+            drained = self._drained.wait_for(
+                lambda: self._in_flight.get(id(wrapper), 0) == 0,
+                timeout=settings.MODEL_DRAIN_TIMEOUT
+            )
+        if not drained:
+            logger.warning(f"⚠️ [{name}] requêtes toujours en cours après {settings.MODEL_DRAIN_TIMEOUT:.0f}s, libération différée au GC")
+            return
+
+        # Les poids sont détachés explicitement : d'autres références au wrapper peuvent subsister
+        wrapper.model = None
+        wrapper.is_loaded = False
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        logger.info(f"🗑️ Ancienne instance de SAM 3 [{name}] libérée")
+
+    def reload(self, variant: Optional[str] = None, model_id: Optional[str] = None, dtype: Optional[str] = None) -> SAM3Wrapper:
+        """
+        Rechargement à chaud sans interruption : charge le nouveau modèle,
+        l'échange atomiquement, puis libère l'ancien après drainage.
+        Ignore le délai d'attente après un échec de chargement.
+        """
+        entry = self._get_entry(variant)
+        if dtype is not None and dtype not in DTYPES:
+            raise ValueError(f"Précision inconnue '{dtype}'")
+
+        with entry.load_lock:
+            new_model_id = model_id or entry.model_id
+            new_dtype = dtype or entry.dtype
+            wrapper = self._build_wrapper(entry, new_model_id, new_dtype)
+
+            with self._lock:
+                old, entry.wrapper = entry.wrapper, wrapper
+                entry.model_id, entry.dtype = new_model_id, new_dtype
+                entry.memory_bytes = wrapper.memory_bytes()
+                entry.last_used = time.monotonic()
+                entry.error = None
+            logger.info(f"🔄 SAM 3 [{entry.name}] rechargé ({new_model_id}, {new_dtype})")
+
+        # Mêmes identifiant et précision mais poids possiblement différents : embeddings périmés
+        self._clear_text_cache(old, wrapper)
+        if old is not None:
+            self._drain_and_free(old, entry.name)
+            # Entrées recalculées par les requêtes de l'ancien modèle pendant le drainage
+            self._clear_text_cache(old, wrapper)
+        self._schedule_budget(keep=entry.name)
+        return wrapper
+
+    @staticmethod
+    def _clear_text_cache(*wrappers: Optional[SAM3Wrapper]):
+        for cache_key in {w.cache_key for w in wrappers if w is not None}:
+            cleared = text_embedding_cache.clear(cache_key)
+            if cleared:
+                logger.info(f"🧹 {cleared} embeddings textuels invalidés ({cache_key})")
+
+    def unload(self, variant: Optional[str] = None):
+        """Décharge la variante après la fin des requêtes en cours"""
+        entry = self._get_entry(variant)
+        with entry.load_lock:
+            with self._lock:
+                old, entry.wrapper = entry.wrapper, None
+                entry.memory_bytes = 0
+        if old is not None:
+            self._drain_and_free(old, entry.name)
+
+    def _schedule_budget(self, keep: str):
+        """
+        Lance l'éviction en arrière-plan : la requête qui vient de charger une
+        variante n'attend pas le drainage (jusqu'à MODEL_DRAIN_TIMEOUT) d'une autre
+        """
+        if settings.MODEL_MEMORY_BUDGET_MB <= 0:
+            return
+        thread = threading.Thread(target=self._enforce_budget, args=(keep,), name="model-eviction", daemon=True)
+        self._eviction = thread
+        thread.start()
+
+    def _enforce_budget(self, keep: str):
+        """Décharge les variantes inactives les moins récemment utilisées au-delà du budget"""
+        budget = settings.MODEL_MEMORY_BUDGET_MB * 1024 ** 2
+        if budget <= 0:
+            return
+        with self._evict_lock:
+            self._evict_over_budget(budget, keep)
+
+    def _evict_over_budget(self, budget: int, keep: str):
+        while True:
+            with self._lock:
+                loaded = [e for e in self._entries.values() if e.wrapper is not None]
+                if sum(e.memory_bytes for e in loaded) <= budget:
+                    return
+                idle = [
+                    e for e in loaded
+                    if e.name != keep and self._in_flight.get(id(e.wrapper), 0) == 0
+                ]
+                if not idle:
+                    logger.warning("⚠️ Budget mémoire des modèles dépassé mais aucune variante inactive à décharger")
+                    return
+                victim = min(idle, key=lambda e: e.last_used)
+            logger.info(f"📤 Déchargement LRU de la variante '{victim.name}'")
+            self.unload(victim.name)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._get_entry(None).wrapper is not None
+
+    def list_variants(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {
+                    "name": e.name,
+                    "model_id": e.model_id,
+                    "dtype": e.dtype,
+                    "is_loaded": e.wrapper is not None,
+                    "memory_mb": round(e.memory_bytes / 1024 ** 2, 1),
+                    "in_flight": self._in_flight.get(id(e.wrapper), 0) if e.wrapper is not None else 0,
+                    "error": e.error,
+                }
+                for e in self._entries.values()
+            ]
+
     def get_model_info(self) -> Dict:
         """Retourne les métadonnées pour l'endpoint /health"""
+        default = self._get_entry(None)
         return {
-            "model_type": "facebook/sam3",
+            "model_type": default.model_id,
             "device": self.device,
-            "is_loaded": self.is_loaded,
+            "device_name": torch.cuda.get_device_name(0) if self.device == "cuda" else self.device.upper(),
+            "is_loaded": default.wrapper is not None,
             "vram_gb": self._get_gpu_memory_info() if self.device == "cuda" else 0.0,
+            "available_models": list(self._entries),
+            "default_variant": self.default_variant,
+            "variants": self.list_variants(),
+            "text_embedding_cache": text_embedding_cache.get_stats(),
+            "runtime_config": runtime_tuner.status(),
             "cuda_available": torch.cuda.is_available(),
             "api_version": "3.0.0"
         }
-    
+
     def _get_gpu_memory_info(self) -> float:
         """Calcul de la VRAM totale en Go pour monitoring"""
         try:
@@ -89,4 +333,4 @@ class ModelManager:
         return 0.0
 
 # Instance globale pour tout l'import du backend
-model_manager = ModelManager()
\ No newline at end of file
+model_registry = ModelRegistry()
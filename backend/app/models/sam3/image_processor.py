@@ -1,3 +1,4 @@
+import hashlib
 import numpy as np
 import cv2
 from PIL import Image
@@ -22,6 +23,14 @@ class ImageProcessor:
         with Image.open(image_path) as img:
             return img.size  # Retourne (largeur, hauteur)
 
+    @staticmethod
+    def compute_image_hash(image: np.ndarray) -> str:
+        """Empreinte du contenu décodé de l'image (clé de cache indépendante du chemin)"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(image.shape).encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
     @staticmethod
     def tensor_to_mask(mask_tensor) -> np.ndarray:
         """
@@ -29,8 +38,10 @@ class ImageProcessor:
         Le masque est redimensionné automatiquement par SAM 3, 
         on s'assure ici du format uint8 (0 ou 255).
         """
-        # Conversion CPU et extraction numpy
-        mask = mask_tensor.cpu().numpy().squeeze()
+        # Conversion CPU et extraction numpy (les masques post-NMS / panoptiques sont déjà en numpy)
+        if hasattr(mask_tensor, "cpu"):
+            mask_tensor = mask_tensor.cpu().numpy()
+        mask = np.asarray(mask_tensor).squeeze()
         
         # Seuil de binarisation (True/False -> 255/0)
         return (mask > 0).astype(np.uint8) * 255
@@ -48,6 +59,51 @@ class ImageProcessor:
             logger.error(f"Erreur lors de l'écriture du fichier .bin : {e}")
             return False
 
+    @staticmethod
+    def encode_mask_rle(mask_np: np.ndarray) -> np.ndarray:
+        """
+        Encode un masque en RLE non compressé (ordre ligne par ligne).
+        Les longueurs alternent fond / objet en commençant par le fond
+        (la première peut valoir 0). Retourne un tableau uint32 little-endian.
+        """
+        flat = mask_np.ravel() > 0
+        if flat.size == 0:
+            return np.zeros(0, dtype="<u4")
+        changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        bounds = np.concatenate(([0], changes, [flat.size]))
+        counts = np.diff(bounds)
+        if flat[0]:
+            counts = np.concatenate(([0], counts))
+        return counts.astype("<u4")
+
+    @staticmethod
+    def encode_mask_packed(mask_np: np.ndarray, bbox: dict) -> np.ndarray:
+        """
+        Encode la découpe bbox (bornes incluses) du masque à 1 bit par pixel,
+        ordre ligne par ligne, bit de poids fort en premier, sans bourrage entre lignes.
+        """
+        crop = mask_np[bbox["y1"]:bbox["y2"] + 1, bbox["x1"]:bbox["x2"] + 1]
+        return np.packbits(crop.ravel() > 0)
+
+    @staticmethod
+    def encode_mask(mask_np: np.ndarray, format: str = "rle", bbox: dict = None) -> bytes:
+        """Encode un masque pour l'envoi au client ('rle', 'packed', 'bin' ou 'png')"""
+        if format == "rle":
+            return ImageProcessor.encode_mask_rle(mask_np).tobytes()
+        if format == "packed":
+            if bbox is None:
+                h, w = mask_np.shape[:2]
+                bbox = {"x1": 0, "y1": 0, "x2": w - 1, "y2": h - 1}
+            return ImageProcessor.encode_mask_packed(mask_np, bbox).tobytes()
+        if format == "bin":
+            return np.ascontiguousarray(mask_np, dtype=np.uint8).tobytes()
+        if format == "png":
+            ok, buffer = cv2.imencode(".png", mask_np)
+            if not ok:
+                raise ValueError("Échec de l'encodage PNG du masque")
+            return buffer.tobytes()
+        raise ValueError(f"Format de masque inconnu : {format}")
+
     @staticmethod
     def overlay_mask(image_rgb: np.ndarray, mask_np: np.ndarray, alpha: float = 0.5):
         """
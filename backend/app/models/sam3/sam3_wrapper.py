@@ -2,28 +2,90 @@ import logging
 import torch
 import numpy as np
 from PIL import Image
+from typing import List, Tuple
 from transformers import Sam3Processor, Sam3Model
+from app.models.sam3.text_embedding_cache import text_embedding_cache, normalize_prompt
+from app.services.profiler import profiler
 
 logger = logging.getLogger(__name__)
 
 class SAM3Wrapper:
-    def __init__(self, device: str = None):
+    def __init__(self, device: str = None, model_id: str = "facebook/sam3", dtype: torch.dtype = None):
         # Détection automatique du GPU (CUDA est fortement recommandé pour SAM 3)
         if device is None:
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
         else:
             self.device = device
+        self.model_id = model_id
+        self.dtype = dtype
+        # Les embeddings textuels dépendent du checkpoint et de la précision
+        self.cache_key = f"{model_id}@{dtype or torch.float32}"
             
         try:
-            logger.info(f"Chargement de SAM 3 sur {self.device}...")
-            self.processor = Sam3Processor.from_pretrained("facebook/sam3")
-            self.model = Sam3Model.from_pretrained("facebook/sam3").to(self.device)
+            logger.info(f"Chargement de SAM 3 ({model_id}) sur {self.device}...")
+            self.processor = Sam3Processor.from_pretrained(model_id)
+            self.model = Sam3Model.from_pretrained(model_id, torch_dtype=dtype).to(self.device)
+            self.model.eval()
             self.is_loaded = True
             logger.info("✓ SAM 3 opérationnel (Mode PCS activé)")
         except Exception as e:
             logger.error(f"Erreur chargement SAM 3: {e}")
             self.is_loaded = False
 
+    @property
+    def supports_text_cache(self) -> bool:
+        """Le modèle accepte des embeddings textuels précalculés"""
+        return self.is_loaded and hasattr(self.model, "get_text_features")
+
+    def _encode_texts(self, prompts: List[str]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Tokenise et encode un lot de prompts via l'encodeur texte de SAM 3"""
+        text_inputs = self.processor(text=prompts, padding=True, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            embeds = self.model.get_text_features(
+                input_ids=text_inputs["input_ids"],
+                attention_mask=text_inputs["attention_mask"]
+            )
+        if not isinstance(embeds, torch.Tensor):
+            embeds = embeds[0]
+        return embeds, text_inputs["attention_mask"]
+
+    @staticmethod
+    def _unpadded(embeds: torch.Tensor, attention_mask: torch.Tensor, index: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Embedding du prompt `index` d'un lot, sans ses jetons de padding : un prompt
+        encodé seul ou dans un lot de prompts plus longs donne la même entrée de cache
+        """
+        tokens = attention_mask[index].bool()
+        return embeds[index:index + 1, tokens], attention_mask[index:index + 1, tokens]
+
+    def encode_text(self, prompt: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Embedding du prompt (cache partagé entre images), placé sur le device du modèle"""
+        embeds, attention_mask = text_embedding_cache.get_or_compute(
+            self.cache_key, prompt, lambda: self._unpadded(*self._encode_texts([normalize_prompt(prompt)]), 0)
+        )
+        return embeds.to(self.device), attention_mask.to(self.device)
+
+    def warm_up_text(self, prompts: List[str], batch_size: int = 32) -> int:
+        """Précalcule par lots les embeddings des prompts absents du cache ; retourne leur nombre"""
+        if not self.supports_text_cache:
+            return 0
+        missing = text_embedding_cache.missing(self.cache_key, prompts)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            embeds, attention_mask = self._encode_texts(batch)
+            for i, prompt in enumerate(batch):
+                text_embedding_cache.put(self.cache_key, prompt, *self._unpadded(embeds, attention_mask, i))
+        if missing:
+            logger.info(f"🔥 {len(missing)} embeddings textuels précalculés")
+        return len(missing)
+
+    def memory_bytes(self) -> int:
+        """Empreinte mémoire des poids et buffers du modèle (octets)"""
+        if not self.is_loaded:
+            return 0
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
     def _compute_bbox_from_mask(self, mask: np.ndarray) -> dict:
         """Calcule la boîte englobante à partir d'un masque binaire"""
         coords = np.argwhere(mask > 0)
@@ -74,15 +136,30 @@ class SAM3Wrapper:
                 image_pil = image
             
             # Traiter l'image avec le processor (conversion en tenseur + normalisation)
+            # Le texte est encodé séparément via le cache d'embeddings si le modèle le permet
+            use_text_cache = self.supports_text_cache
             inputs = self.processor(
                 images=image_pil, 
-                text=prompt, 
+                text=None if use_text_cache else prompt, 
                 return_tensors="pt"
-            ).to(self.device)
+            )
+            # Les tenseurs flottants suivent la précision de la variante (fp16/bf16)
+            if self.dtype is not None:
+                inputs = inputs.to(self.device, dtype=self.dtype)
+            else:
+                inputs = inputs.to(self.device)
             
             # Inférence du modèle
-            with torch.no_grad():
-                outputs = self.model(**inputs)
+            with torch.no_grad(), profiler.region("sam3.forward"):
+                if use_text_cache:
+                    text_embeds, attention_mask = self.encode_text(prompt)
+                    outputs = self.model(
+                        pixel_values=inputs["pixel_values"],
+                        text_embeds=text_embeds,
+                        attention_mask=attention_mask
+                    )
+                else:
+                    outputs = self.model(**inputs)
             
             # Post-processing pour redimensionner les masques à la taille originale
             masks = self.processor.post_process_masks(
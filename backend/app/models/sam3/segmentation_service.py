@@ -1,17 +1,26 @@
+import asyncio
 import os
 from pathlib import Path
-from app.models.sam3_wrapper import SAM3Wrapper
-from app.models.image_processor import ImageProcessor
+from app.models.model_manager import model_registry
+from app.models.sam3.image_processor import ImageProcessor
 from app.services.object_detector import get_object_detector
 
 class SegmentationService:
     def __init__(self):
-        self.sam3 = SAM3Wrapper()
+        # Le modèle est réservé auprès du registre à chaque appel : un rechargement
+        # à chaud ou un déchargement LRU ne laisse pas ce service sur une instance libérée
         self.detector = get_object_detector()
 
     async def segment_concept(self, image_np, prompt, save_path, format="png"):
         """Pipeline complet : Image -> SAM3 -> YOLO -> Stockage"""
-        raw_results = self.sam3.segment_by_text(image_np, prompt)
+        # Réservation du modèle (chargement, attente d'un rechargement), inférences et
+        # écritures sont bloquantes : exécutées hors de la boucle d'événements
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._segment_concept, image_np, prompt, save_path, format)
+
+    def _segment_concept(self, image_np, prompt, save_path, format):
+        with model_registry.acquire() as sam3:
+            raw_results = sam3.segment_by_text(image_np, prompt)
         
         final_objects = []
         for i, obj in enumerate(raw_results):
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import torch
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Version 2 : embeddings stockés sans jetons de padding
+CACHE_FORMAT_VERSION = 2
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Clé de cache : casse et espaces normalisés ("  Boulons  Rouillés" -> "boulons rouillés")"""
+    return " ".join(prompt.casefold().split())
+
+
+class TextEmbeddingCache:
+    """
+    Cache LRU des embeddings textuels SAM 3, partagé entre toutes les images.
+    Clé : (identifiant du modèle, prompt normalisé). Les tenseurs sont gardés
+    sur CPU et peuvent être persistés sur disque pour redémarrer à chaud.
+    """
+
+    def __init__(self, max_entries: int, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_key: str, prompt: str) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        key = (model_key, normalize_prompt(prompt))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, model_key: str, prompt: str, embeds: torch.Tensor, attention_mask: torch.Tensor):
+        key = (model_key, normalize_prompt(prompt))
+        with self._lock:
+            self._entries[key] = (embeds.detach().cpu(), attention_mask.detach().cpu())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self,
+        model_key: str,
+        prompt: str,
+        compute: Callable[[], Tuple[torch.Tensor, torch.Tensor]]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        entry = self.get(model_key, prompt)
+        if entry is not None:
+            return entry
+        embeds, attention_mask = compute()
+        self.put(model_key, prompt, embeds, attention_mask)
+        return embeds.detach().cpu(), attention_mask.detach().cpu()
+
+    def missing(self, model_key: str, prompts) -> list:
+        """Prompts (normalisés, dédupliqués) absents du cache pour ce modèle"""
+        with self._lock:
+            seen = set()
+            result = []
+            for prompt in prompts:
+                key = normalize_prompt(prompt)
+                if key and key not in seen and (model_key, key) not in self._entries:
+                    seen.add(key)
+                    result.append(key)
+            return result
+
+    def clear(self, model_key: Optional[str] = None) -> int:
+        """Oublie les embeddings d'un modèle (ou tous) ; retourne le nombre d'entrées supprimées"""
+        with self._lock:
+            keys = [key for key in self._entries if model_key is None or key[0] == model_key]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def save(self, path: Optional[str] = None):
+        """Persiste le cache (écriture atomique)"""
+        path = path or self.persist_path
+        if not path:
+            return
+        with self._lock:
+            entries = [(m, p, e, a) for (m, p), (e, a) in self._entries.items()]
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            torch.save({"version": CACHE_FORMAT_VERSION, "entries": entries}, tmp_path)
+            os.replace(tmp_path, path)
+            logger.info(f"💾 {len(entries)} embeddings textuels sauvegardés ({path})")
+        except Exception as e:
+            logger.error(f"❌ Échec de la sauvegarde du cache d'embeddings: {e}")
+
+    def load(self, path: Optional[str] = None):
+        """Recharge le cache persisté (ignoré s'il est absent ou d'un autre format)"""
+        path = path or self.persist_path
+        if not path or not os.path.exists(path):
+            return
+        try:
+            data = torch.load(path, map_location="cpu", weights_only=True)
+            if data.get("version") != CACHE_FORMAT_VERSION:
+                logger.warning(f"⚠️ Cache d'embeddings ignoré (format {data.get('version')})")
+                return
+            for model_key, prompt, embeds, attention_mask in data["entries"]:
+                self.put(model_key, prompt, embeds, attention_mask)
+            logger.info(f"✓ {len(data['entries'])} embeddings textuels rechargés ({path})")
+        except Exception as e:
+            logger.error(f"❌ Cache d'embeddings illisible, ignoré: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+text_embedding_cache = TextEmbeddingCache(
+    max_entries=settings.TEXT_EMBEDDING_CACHE_SIZE,
+    persist_path=settings.TEXT_EMBEDDING_CACHE_PATH
+)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import resource
+import os
+import sys
+import threading
+import time
+import torch
+from contextlib import asynccontextmanager
+from typing import Optional
+from app.exceptions import AdmissionRejectedException, AdmissionTimeoutException
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Taille d'entrée de SAM 3 (image redimensionnée 1008x1008, float32)
+SAM3_INPUT_BYTES = 1008 * 1008 * 3 * 4
+
+# En-têtes de réponse exposés au client (CORS)
+RESOURCE_HEADERS = [
+    "X-Segma-Memory-Estimate-MB",
+    "X-Segma-Peak-Memory-MB",
+    "X-Segma-Peak-Memory-Scope",
+    "X-Segma-Compute-Time-Ms",
+    "X-Segma-Queue-Time-Ms",
+]
+
+
+def estimate_request_memory(width: int, height: int, prompts: int = 1, expected_masks: Optional[int] = None) -> int:
+    """
+    Estime la mémoire (octets) d'une segmentation à partir de la résolution.
+
+    - Image décodée : BGR (OpenCV) + copie RGB, 1 octet par canal
+    - Entrée du modèle : taille fixe
+    - Par masque : logits float32 post-traités + masque binaire + masque 0/255
+    """
+    expected_masks = expected_masks if expected_masks is not None else settings.ADMISSION_EXPECTED_MASKS
+    pixels = width * height
+    image_bytes = pixels * 3 * 2
+    mask_bytes = pixels * (4 + 1 + 1) * expected_masks * max(prompts, 1)
+    return image_bytes + SAM3_INPUT_BYTES + mask_bytes
+
+
+class AdmissionController:
+    """
+    Budget mémoire global pour les segmentations simultanées.
+    Une requête attend qu'assez de budget se libère ; elle est rejetée si elle
+    dépasse le budget à elle seule, si la file est pleine ou si l'attente expire.
+    """
+
+    def __init__(self, budget_bytes: int, queue_timeout: float, max_queue: int):
+        self.budget_bytes = budget_bytes
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.in_use = 0
+        self.waiting = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Créée paresseusement pour être liée à la boucle d'événements du serveur
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @asynccontextmanager
+    async def admit(self, cost: int):
+        """Réserve `cost` octets du budget pendant la durée du bloc ; retourne le temps d'attente (s)"""
+        if cost > self.budget_bytes:
+            raise AdmissionRejectedException(
+                f"Coût estimé {cost / MB:.0f} Mo supérieur au budget {self.budget_bytes / MB:.0f} Mo"
+            )
+        if self.waiting >= self.max_queue:
+            raise AdmissionTimeoutException("File d'attente d'admission pleine")
+
+        condition = self._get_condition()
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            async with condition:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self.in_use + cost <= self.budget_bytes),
+                    timeout=self.queue_timeout
+                )
+                self.in_use += cost
+        except asyncio.TimeoutError:
+            raise AdmissionTimeoutException(
+                f"Budget mémoire saturé depuis plus de {self.queue_timeout:.0f}s"
+            )
+        finally:
+            self.waiting -= 1
+
+        try:
+            yield time.perf_counter() - start
+        finally:
+            async with condition:
+                self.in_use -= cost
+                condition.notify_all()
+
+    def get_stats(self) -> dict:
+        return {
+            "budget_mb": round(self.budget_bytes / MB, 1),
+            "in_use_mb": round(self.in_use / MB, 1),
+            "waiting": self.waiting,
+        }
+
+
+class ResourceMeter:
+    """
+    Mesure le temps de calcul et le pic mémoire d'une requête.
+
+    Un thread échantillonne la mémoire (RSS via /proc/self/statm sur CPU,
+    allocations CUDA sur GPU) pendant la requête : le pic est relatif à son
+    début, et non le pic de toute la vie du processus. Les compteurs restant
+    globaux au processus, la mesure n'est propre à la requête que si elle a
+    tourné seule (`scope == "request"`) ; sinon (`scope == "process"`) c'est
+    le pic absolu du processus pendant la requête. Sur GPU, une requête seule
+    utilise le pic exact de CUDA (réinitialisé uniquement dans ce cas).
+    """
+
+    _lock = threading.Lock()
+    _active = set()
+
+    def __init__(self):
+        self.compute_time = 0.0
+        self.peak_memory = 0
+        self.scope = "request"
+        self._use_cuda = torch.cuda.is_available()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._sampled_peak = 0
+        self._cuda_reset = False
+
+    @staticmethod
+    def _current_rss() -> Optional[int]:
+        """RSS courant (octets) ; None hors Linux"""
+        try:
+            with open("/proc/self/statm", "rb") as f:
+                return int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            return None
+
+    @staticmethod
+    def _max_rss() -> int:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss est en Ko sous Linux, en octets sous macOS
+        return rss if sys.platform == "darwin" else rss * 1024
+
+    def _read_memory(self) -> Optional[int]:
+        return torch.cuda.memory_allocated() if self._use_cuda else self._current_rss()
+
+    def _sample(self, interval: float):
+        while not self._stop.wait(interval):
+            self._sampled_peak = max(self._sampled_peak, self._read_memory() or 0)
+
+    def __enter__(self):
+        with ResourceMeter._lock:
+            # Une requête déjà en cours partage les compteurs : les deux mesures deviennent globales
+            for other in ResourceMeter._active:
+                other.scope = "process"
+            if ResourceMeter._active:
+                self.scope = "process"
+            elif self._use_cuda:
+                # Réinitialiser le pic CUDA fausserait la mesure d'une requête concurrente
+                torch.cuda.reset_peak_memory_stats()
+                self._cuda_reset = True
+            ResourceMeter._active.add(self)
+
+        self._start_memory = self._read_memory()
+        if self._start_memory is None:
+            # Pas de RSS courant (macOS...) : seul le pic de vie du processus est disponible
+            self._start_memory = self._max_rss()
+            self.scope = "process"
+        else:
+            self._sampled_peak = self._start_memory
+            self._sampler = threading.Thread(
+                target=self._sample, args=(settings.RESOURCE_SAMPLE_INTERVAL_MS / 1000,),
+                name="resource-meter", daemon=True
+            )
+            self._sampler.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.compute_time = time.perf_counter() - self._start
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampled_peak = max(self._sampled_peak, self._read_memory() or 0)
+        with ResourceMeter._lock:
+            ResourceMeter._active.discard(self)
+            if self._sampler is None:
+                self.peak_memory = self._max_rss()
+            elif self.scope == "process":
+                self.peak_memory = self._sampled_peak
+            elif self._cuda_reset:
+                self.peak_memory = max(torch.cuda.max_memory_allocated() - self._start_memory, 0)
+            else:
+                self.peak_memory = max(self._sampled_peak - self._start_memory, 0)
+        return False
+
+
+admission_controller = AdmissionController(
+    budget_bytes=settings.ADMISSION_MEMORY_BUDGET_MB * MB,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    max_queue=settings.ADMISSION_MAX_QUEUE
+)
@@ -0,0 +1,348 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from typing import Dict, List, Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_hash TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    params_key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    image_path TEXT,
+    resolution TEXT,
+    directory TEXT NOT NULL,
+    label_map_path TEXT,
+    objects TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL DEFAULT 0,
+    durable INTEGER NOT NULL DEFAULT 0,
+    generation TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    UNIQUE (image_hash, prompt, params_key)
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_last_access ON artifacts (last_access);
+CREATE INDEX IF NOT EXISTS idx_artifacts_image_hash ON artifacts (image_hash);
+"""
+
+ArtifactKey = Tuple[str, str, str]
+
+
+def prompt_slug(prompt: str) -> str:
+    """Nom de dossier lisible dérivé du prompt ("Boulons rouillés" -> "boulons-rouilles")"""
+    ascii_prompt = unicodedata.normalize("NFKD", prompt).encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", ascii_prompt.lower()).strip("-")
+    return slug[:40] or "prompt"
+
+
+def compute_params_key(params: Dict) -> str:
+    """Empreinte des paramètres qui changent le résultat (prompts, seuils, étiquetage, variante)"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class ArtifactStore:
+    """
+    Index SQLite des résultats de segmentation.
+
+    Chaque résultat est rangé sous OUTPUT_DIR/<hash[:2]>/<hash>/<prompt>-<params>-<génération>/ :
+    deux prompts, deux jeux de paramètres ou deux calculs successifs de la même
+    clé ne partagent jamais un dossier. Les rappels de fin d'écriture, les
+    suppressions et le ramasse-miettes ne touchent donc que leur génération.
+    L'index conserve les métadonnées des objets, les chemins et tailles des
+    fichiers : une requête déjà servie est relue depuis l'index sans inférence
+    ni parcours du disque. Un thread de fond supprime les résultats trop
+    anciens puis les moins récemment consultés au-delà du quota.
+    """
+
+    def __init__(
+        self, root: str, index_path: str, max_age_s: float, quota_bytes: int, gc_interval: float, gc_grace_s: float = 60
+    ):
+        self.root = root
+        self.index_path = index_path
+        self.max_age_s = max_age_s
+        self.quota_bytes = quota_bytes
+        self.gc_interval = gc_interval
+        self.gc_grace_s = gc_grace_s
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._gc_thread: Optional[threading.Thread] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(artifacts)")}
+            if "generation" not in columns:
+                conn.execute("ALTER TABLE artifacts ADD COLUMN generation TEXT NOT NULL DEFAULT ''")
+            self._conn = conn
+        return self._conn
+
+    # --- Emplacements ---
+
+    @staticmethod
+    def new_generation() -> str:
+        """Jeton propre à un calcul : son dossier et son entrée d'index"""
+        return uuid.uuid4().hex[:8]
+
+    def artifact_dir(self, key: ArtifactKey, generation: str) -> str:
+        image_hash, prompt, params_key = key
+        return os.path.join(
+            self.root, image_hash[:2], image_hash, f"{prompt_slug(prompt)}-{params_key}-{generation}"
+        )
+
+    # --- Lecture ---
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        entry = dict(row)
+        entry["objects"] = json.loads(entry["objects"])
+        entry["params"] = json.loads(entry["params"])
+        entry["durable"] = bool(entry["durable"])
+        return entry
+
+    def lookup(self, key: ArtifactKey) -> Optional[Dict]:
+        """Résultat durable déjà calculé pour (image, prompt, paramètres) ; met à jour le dernier accès"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM artifacts WHERE image_hash = ? AND prompt = ? AND params_key = ? AND durable = 1",
+                key
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE artifacts SET last_access = ? WHERE id = ?", (time.time(), row["id"]))
+            self.conn.commit()
+        return self._row_to_dict(row)
+
+    def query(
+        self,
+        image_hash: Optional[str] = None,
+        prompt: Optional[str] = None,
+        image_path: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0
+    ) -> List[Dict]:
+        """Résultats indexés, du plus récemment consulté au plus ancien"""
+        clauses, values = [], []
+        for column, value in (("image_hash", image_hash), ("prompt", prompt), ("image_path", image_path)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                values.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM artifacts {where} ORDER BY last_access DESC LIMIT ? OFFSET ?",
+                (*values, limit, offset)
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            count, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM artifacts"
+            ).fetchone()
+        return {"artifacts": count, "size_mb": round(size / (1024 * 1024), 2), "quota_mb": self.quota_bytes // (1024 * 1024)}
+
+    # --- Écriture ---
+
+    def record(
+        self,
+        key: ArtifactKey,
+        generation: str,
+        params: Dict,
+        image_path: str,
+        resolution: str,
+        label_map_path: Optional[str],
+        objects: List[Dict],
+        size_bytes: int,
+        durable: bool
+    ) -> int:
+        """Indexe le résultat d'une segmentation ; remplace (et supprime) la génération précédente de la clé"""
+        now = time.time()
+        with self._lock:
+            previous = self.conn.execute(
+                "SELECT directory, generation, durable FROM artifacts WHERE image_hash = ? AND prompt = ? AND params_key = ?",
+                key
+            ).fetchone()
+            self.conn.execute(
+                """
+                INSERT INTO artifacts (image_hash, prompt, params_key, params, image_path, resolution, directory,
+                                       label_map_path, objects, size_bytes, durable, generation, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (image_hash, prompt, params_key) DO UPDATE SET
+                    params = excluded.params, image_path = excluded.image_path, resolution = excluded.resolution,
+                    directory = excluded.directory, label_map_path = excluded.label_map_path,
+                    objects = excluded.objects, size_bytes = excluded.size_bytes, durable = excluded.durable,
+                    generation = excluded.generation, created_at = excluded.created_at, last_access = excluded.last_access
+                """,
+                (*key, json.dumps(params), image_path, resolution, self.artifact_dir(key, generation), label_map_path,
+                 json.dumps(objects), size_bytes, int(durable), generation, now, now)
+            )
+            self.conn.commit()
+            # lastrowid n'est pas fiable quand l'upsert met à jour une ligne existante
+            artifact_id = self.conn.execute(
+                "SELECT id FROM artifacts WHERE image_hash = ? AND prompt = ? AND params_key = ?", key
+            ).fetchone()[0]
+        # Une génération précédente encore en écriture est nettoyée par son propre rappel
+        if previous is not None and previous["generation"] != generation and previous["durable"]:
+            self._remove_files(previous["directory"])
+        return artifact_id
+
+    def on_job_complete(self, key: ArtifactKey, generation: str):
+        """
+        Rappel de fin d'écriture différée : l'entrée de cette génération devient
+        servable, ou est retirée si une écriture a échoué. Une génération plus
+        récente de la même clé n'est jamais touchée.
+        """
+        def callback(job):
+            if job.failed == 0:
+                with self._lock:
+                    current = self.conn.execute(
+                        "UPDATE artifacts SET durable = 1 "
+                        "WHERE image_hash = ? AND prompt = ? AND params_key = ? AND generation = ?",
+                        (*key, generation)
+                    ).rowcount
+                    self.conn.commit()
+                if current:
+                    return
+            # Écriture échouée, ou génération remplacée entre-temps : ses fichiers ne sont plus indexés
+            self.discard(key, generation)
+        return callback
+
+    # --- Suppression ---
+
+    def _remove_files(self, directory: str):
+        # Garde-fou : on ne supprime que sous la racine du store
+        root = os.path.abspath(self.root)
+        directory = os.path.abspath(directory)
+        if os.path.commonpath([root, directory]) != root or directory == root:
+            return
+        shutil.rmtree(directory, ignore_errors=True)
+        # Dossiers de l'image puis du préfixe de hash, s'ils sont devenus vides
+        parent = os.path.dirname(directory)
+        for _ in range(2):
+            if parent == root:
+                break
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    def discard(self, key: ArtifactKey, generation: str):
+        """Retire une génération (entrée d'index si elle est encore la courante, et son dossier)"""
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM artifacts WHERE image_hash = ? AND prompt = ? AND params_key = ? AND generation = ?",
+                (*key, generation)
+            )
+            self.conn.commit()
+        self._remove_files(self.artifact_dir(key, generation))
+
+    def delete(self, artifact_id: int) -> bool:
+        with self._lock:
+            row = self.conn.execute("SELECT directory FROM artifacts WHERE id = ?", (artifact_id,)).fetchone()
+            if row is None:
+                return False
+            self.conn.execute("DELETE FROM artifacts WHERE id = ?", (artifact_id,))
+            self.conn.commit()
+        self._remove_files(row["directory"])
+        return True
+
+    # --- Ramasse-miettes ---
+
+    def collect(self) -> Dict:
+        """
+        Supprime les résultats expirés, puis les moins récemment consultés jusqu'à
+        revenir sous le quota. Un résultat consulté il y a moins de `gc_grace_s`
+        secondes est épargné : une lecture servie par `lookup` peut encore relire ses fichiers.
+        """
+        expired, evicted, freed = [], [], 0
+        now = time.time()
+        with self._lock:
+            if self.max_age_s > 0:
+                expired = self.conn.execute(
+                    "SELECT id, directory, size_bytes FROM artifacts WHERE last_access < ?",
+                    (now - max(self.max_age_s, self.gc_grace_s),)
+                ).fetchall()
+            if self.quota_bytes > 0:
+                expired_ids = {row["id"] for row in expired}
+                total = self.conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM artifacts").fetchone()[0]
+                total -= sum(row["size_bytes"] for row in expired)
+                # Les résultats en cours d'écriture ne sont jamais évincés
+                for row in self.conn.execute(
+                    "SELECT id, directory, size_bytes FROM artifacts "
+                    "WHERE durable = 1 AND last_access < ? ORDER BY last_access ASC",
+                    (now - self.gc_grace_s,)
+                ):
+                    if total <= self.quota_bytes:
+                        break
+                    if row["id"] in expired_ids:
+                        continue
+                    evicted.append(row)
+                    total -= row["size_bytes"]
+            removed = expired + evicted
+            if removed:
+                self.conn.executemany("DELETE FROM artifacts WHERE id = ?", [(row["id"],) for row in removed])
+                self.conn.commit()
+
+        for row in removed:
+            self._remove_files(row["directory"])
+            freed += row["size_bytes"]
+        if removed:
+            logger.info(
+                f"🧹 Artefacts supprimés : {len(expired)} expirés, {len(evicted)} hors quota "
+                f"({freed / (1024 * 1024):.1f} Mo libérés)"
+            )
+        return {"expired": len(expired), "evicted": len(evicted), "freed_bytes": freed}
+
+    def _run_gc(self):
+        while not self._stop.wait(self.gc_interval):
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error(f"❌ Échec du ramasse-miettes des artefacts: {e}")
+
+    def start(self):
+        if self._gc_thread is not None or self.gc_interval <= 0:
+            return
+        self._stop.clear()
+        self._gc_thread = threading.Thread(target=self._run_gc, name="artifact-gc", daemon=True)
+        self._gc_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._gc_thread is not None:
+            self._gc_thread.join()
+            self._gc_thread = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+artifact_store = ArtifactStore(
+    root=settings.OUTPUT_DIR,
+    index_path=settings.ARTIFACT_INDEX_PATH,
+    max_age_s=settings.ARTIFACT_MAX_AGE_DAYS * 86400,
+    quota_bytes=settings.ARTIFACT_QUOTA_MB * 1024 * 1024,
+    gc_interval=settings.ARTIFACT_GC_INTERVAL,
+    gc_grace_s=settings.ARTIFACT_GC_GRACE_S
+)
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# Prompts synthétiques pour mesurer l'encodage texte par lots (hors cache partagé)
+BENCHMARK_PROMPTS = [f"objet de test {i}" for i in range(64)]
+
+
+def cpu_model() -> str:
+    """Modèle du CPU (/proc/cpuinfo sous Linux, où platform.processor() est souvent vide)"""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_fingerprint() -> Dict:
+    """
+    Caractéristiques qui invalident un réglage : système, modèle de CPU, cœurs,
+    GPU et version de torch. Ni la version du noyau ni celle de Python n'en font
+    partie : une mise à jour de sécurité ne doit pas relancer l'autotune.
+    """
+    return {
+        "os": platform.system(),
+        "cpu": cpu_model(),
+        "cpu_count": os.cpu_count() or 1,
+        "gpu": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "torch": torch.__version__,
+    }
+
+
+def fingerprint_id(fingerprint: Dict) -> str:
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def thread_candidates(cpu_count: int) -> List[int]:
+    """Nombre de threads intra-op testés : tous les cœurs, puis moitiés successives"""
+    if settings.AUTOTUNE_THREADS:
+        return settings.AUTOTUNE_THREADS
+    candidates = []
+    threads = cpu_count
+    while threads >= 1:
+        candidates.append(threads)
+        threads //= 2
+    return candidates
+
+
+def cv2_threads_for(cpu_count: int, intra_op_threads: int) -> int:
+    """OpenCV (prétraitement YOLO) prend les cœurs laissés libres par torch"""
+    return max(1, cpu_count - intra_op_threads)
+
+
+def synthetic_image(size: int) -> np.ndarray:
+    """Image RGB déterministe (fond bruité + formes) pour des mesures reproductibles"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 64, (size, size, 3), dtype=np.uint8)
+    step = size // 4
+    for i in range(3):
+        y, x = step * i + step // 4, step * (i + 1)
+        image[y:y + step, x - step // 2:x + step // 2] = rng.integers(128, 255, 3, dtype=np.uint8)
+    return image
+
+
+class RuntimeTuner:
+    """
+    Réglage des threads d'inférence par machine.
+
+    SAM 3, YOLO et OpenCV partagent le même processus : laissés aux valeurs par
+    défaut, chacun lance autant de threads que de cœurs et ils se disputent le
+    CPU quand ils tournent ensemble. Le tuner mesure SAM 3 + YOLO en parallèle
+    sur une image synthétique pour chaque nombre de threads intra-op, puis la
+    taille de lot de l'encodage texte, et persiste le meilleur réglage par
+    empreinte machine. Au démarrage, le réglage connu est appliqué avant le
+    chargement des modèles.
+    """
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self.fingerprint = machine_fingerprint()
+        self.fingerprint_id = fingerprint_id(self.fingerprint)
+        self.config: Optional[Dict] = None
+        self.source = "default"
+
+    # --- Persistance ---
+
+    def _read_cache(self) -> Dict:
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Réglages d'autotune illisibles, ignorés: {e}")
+            return {}
+
+    def _write_cache(self, entry: Dict):
+        data = self._read_cache()
+        data[self.fingerprint_id] = entry
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def saved_config(self) -> Optional[Dict]:
+        entry = self._read_cache().get(self.fingerprint_id)
+        return entry["config"] if entry else None
+
+    # --- Application ---
+
+    def apply(self, config: Dict, source: str):
+        """Applique threads torch / OpenCV ; le pool inter-op n'est réglable qu'une fois par processus"""
+        torch.set_num_threads(config["intra_op_threads"])
+        try:
+            torch.set_num_interop_threads(config["inter_op_threads"])
+        except RuntimeError:
+            config = {**config, "inter_op_threads": torch.get_num_interop_threads()}
+        if CV2_AVAILABLE:
+            cv2.setNumThreads(config["cv2_threads"])
+        self.config = config
+        self.source = source
+        logger.info(
+            f"⚙️ Threads d'inférence ({source}) : intra-op={config['intra_op_threads']}, "
+            f"inter-op={config['inter_op_threads']}, opencv={config['cv2_threads']}, "
+            f"lot texte={config['text_batch_size']}"
+        )
+
+    def apply_saved(self) -> bool:
+        """Applique le réglage persisté pour cette machine, s'il existe"""
+        config = self.saved_config()
+        if config is None:
+            return False
+        self.apply(config, "cache")
+        return True
+
+    @property
+    def text_batch_size(self) -> int:
+        if self.config:
+            return self.config["text_batch_size"]
+        return settings.TEXT_WARMUP_BATCH_SIZE
+
+    # --- Mesures ---
+
+    @staticmethod
+    def _median_ms(run, repeats: int) -> float:
+        run()  # première passe (allocations, caches) non comptée
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def _benchmark_threads(self, wrapper, detector, image: np.ndarray, threads: int, pool: ThreadPoolExecutor) -> float:
+        torch.set_num_threads(threads)
+        if CV2_AVAILABLE:
+            cv2.setNumThreads(cv2_threads_for(self.fingerprint["cpu_count"], threads))
+
+        def run():
+            # Même schéma qu'en production : SAM 3 et YOLO sur deux threads de l'exécuteur
+            futures = [pool.submit(wrapper.segment_by_text, image, settings.AUTOTUNE_PROMPT)]
+            if detector.available:
+                futures.append(pool.submit(detector.detect, image))
+            for future in futures:
+                future.result()
+
+        return self._median_ms(run, settings.AUTOTUNE_REPEATS)
+
+    def _benchmark_text_batch(self, wrapper, batch_size: int) -> float:
+        """Temps moyen par prompt (ms) de l'encodage texte par lots"""
+        prompts = BENCHMARK_PROMPTS
+
+        def run():
+            for start in range(0, len(prompts), batch_size):
+                wrapper._encode_texts(prompts[start:start + batch_size])
+
+        return self._median_ms(run, settings.AUTOTUNE_REPEATS) / len(prompts)
+
+    def tune(self, wrapper, detector) -> Dict:
+        """
+        Recherche en deux temps : threads intra-op (SAM 3 + YOLO concurrents),
+        puis taille de lot texte avec les threads retenus. Persiste et applique le résultat.
+        """
+        cpu_count = self.fingerprint["cpu_count"]
+        image = synthetic_image(settings.AUTOTUNE_IMAGE_SIZE)
+        logger.info(f"⏱️ Autotune des threads d'inférence (machine {self.fingerprint_id}, {cpu_count} cœurs)...")
+
+        results = []
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for threads in thread_candidates(cpu_count):
+                latency = self._benchmark_threads(wrapper, detector, image, threads, pool)
+                results.append({"intra_op_threads": threads, "latency_ms": round(latency, 1)})
+                logger.info(f"   threads={threads:<3} SAM 3 + YOLO : {latency:.0f} ms")
+        best = min(results, key=lambda r: r["latency_ms"])
+        torch.set_num_threads(best["intra_op_threads"])
+
+        batch_results = []
+        if wrapper.supports_text_cache:
+            for batch_size in settings.AUTOTUNE_BATCH_SIZES:
+                per_prompt = self._benchmark_text_batch(wrapper, batch_size)
+                batch_results.append({"text_batch_size": batch_size, "ms_per_prompt": round(per_prompt, 2)})
+                logger.info(f"   lot texte={batch_size:<3} : {per_prompt:.1f} ms/prompt")
+        text_batch_size = (
+            min(batch_results, key=lambda r: r["ms_per_prompt"])["text_batch_size"]
+            if batch_results else settings.TEXT_WARMUP_BATCH_SIZE
+        )
+
+        config = {
+            "intra_op_threads": best["intra_op_threads"],
+            # SAM 3 et YOLO tournent déjà sur deux threads de l'exécuteur
+            "inter_op_threads": min(2, cpu_count),
+            "cv2_threads": cv2_threads_for(cpu_count, best["intra_op_threads"]),
+            "text_batch_size": text_batch_size,
+            "latency_ms": best["latency_ms"],
+            "tuned_at": time.time(),
+        }
+        try:
+            self._write_cache({
+                "fingerprint": self.fingerprint,
+                "config": config,
+                "threads": results,
+                "text_batches": batch_results,
+            })
+        except OSError as e:
+            logger.error(f"❌ Échec de la sauvegarde de l'autotune: {e}")
+        self.apply(config, "autotune")
+        return config
+
+    def status(self) -> Dict:
+        """Réglage en vigueur, pour /api/v3/model/info"""
+        return {
+            "source": self.source,
+            "fingerprint": self.fingerprint_id,
+            "intra_op_threads": torch.get_num_threads(),
+            "inter_op_threads": torch.get_num_interop_threads(),
+            "cv2_threads": cv2.getNumThreads() if CV2_AVAILABLE else None,
+            "text_batch_size": self.text_batch_size,
+            "latency_ms": self.config.get("latency_ms") if self.config else None,
+            "tuned_at": self.config.get("tuned_at") if self.config else None,
+        }
+
+
+runtime_tuner = RuntimeTuner(settings.AUTOTUNE_CACHE_PATH)
+
+
+def main():
+    """CLI : `python main.py --autotune` ou `python -m app.services.autotune` (mesure forcée)"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from app.models.model_manager import model_registry
+    from app.services.object_detector import get_object_detector
+
+    model_registry.load()
+    if not model_registry.is_loaded:
+        logger.error("❌ SAM 3 non chargé : autotune impossible")
+        sys.exit(1)
+    config = runtime_tuner.tune(model_registry.get_model(), get_object_detector())
+    print(json.dumps({"fingerprint": runtime_tuner.fingerprint, "config": config}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import logging
+import numpy as np
+from typing import List, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _bbox_array(objects: List[Dict]) -> np.ndarray:
+    """Convertit les bbox {x1, y1, x2, y2} (bornes incluses) en tableau (N, 4)"""
+    return np.array(
+        [[o["bbox"]["x1"], o["bbox"]["y1"], o["bbox"]["x2"], o["bbox"]["y2"]] for o in objects],
+        dtype=np.int64
+    ).reshape(-1, 4)
+
+
+def bbox_iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    IoU vectorisée entre deux ensembles de boîtes (N, 4) et (M, 4).
+    Les bornes sont inclusives (convention de SAM3Wrapper._compute_bbox_from_mask).
+    """
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+
+    inter = np.clip(x2 - x1 + 1, 0, None) * np.clip(y2 - y1 + 1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0] + 1) * (boxes_a[:, 3] - boxes_a[:, 1] + 1)
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0] + 1) * (boxes_b[:, 3] - boxes_b[:, 1] + 1)
+    union = area_a[:, None] + area_b[None, :] - inter
+
+    return np.where(union > 0, inter / np.maximum(union, 1), 0.0)
+
+
+def _mask_iou_against(
+    ref_idx: int,
+    candidates: np.ndarray,
+    masks: List[np.ndarray],
+    boxes: np.ndarray,
+    areas: np.ndarray
+) -> np.ndarray:
+    """
+    IoU exacte entre le masque de référence et un lot de candidats.
+    L'intersection ne peut exister que dans la bbox de référence : on empile
+    uniquement cette découpe pour tous les candidats et on calcule en une passe.
+    """
+    x1, y1, x2, y2 = boxes[ref_idx]
+    ref_crop = masks[ref_idx][y1:y2 + 1, x1:x2 + 1]
+    stack = np.stack([masks[j][y1:y2 + 1, x1:x2 + 1] for j in candidates])
+
+    inter = np.logical_and(stack, ref_crop[None, ...]).sum(axis=(1, 2))
+    union = areas[ref_idx] + areas[candidates] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1), 0.0)
+
+
+def mask_nms(objects: List[Dict], iou_threshold: float = 0.7) -> List[Dict]:
+    """
+    Suppression des masques quasi-dupliqués (NMS sur masques).
+
+    Les objets sont triés par score décroissant ; un masque est supprimé s'il
+    recouvre un masque déjà retenu au-delà de `iou_threshold`.
+    Pré-filtrage : recouvrement des bbox et borne min(aire)/max(aire) avant
+    de calculer l'IoU exacte sur les découpes.
+
+    Args:
+        objects: Sortie de SAM3Wrapper.segment_by_text ({"mask", "score", "bbox"})
+        iou_threshold: Seuil d'IoU au-delà duquel deux masques sont fusionnés
+
+    Returns:
+        Sous-liste des objets retenus, triée par score décroissant
+    """
+    if len(objects) < 2:
+        return list(objects)
+
+    order = sorted(range(len(objects)), key=lambda i: objects[i]["score"], reverse=True)
+    ordered = [objects[i] for i in order]
+
+    masks = [np.asarray(o["mask"]) > 0 for o in ordered]
+    boxes = _bbox_array(ordered)
+    areas = np.array([np.count_nonzero(m) for m in masks], dtype=np.int64)
+    box_iou = bbox_iou_matrix(boxes, boxes)
+
+    suppressed = np.zeros(len(ordered), dtype=bool)
+    for i in range(len(ordered)):
+        if suppressed[i]:
+            continue
+
+        rest = np.arange(i + 1, len(ordered))
+        rest = rest[~suppressed[rest] & (box_iou[i, rest] > 0)]
+        if len(rest) == 0:
+            continue
+
+        # Borne supérieure de l'IoU des masques : min(aire) / max(aire)
+        bound = np.minimum(areas[i], areas[rest]) / np.maximum(np.maximum(areas[i], areas[rest]), 1)
+        rest = rest[bound > iou_threshold]
+        if len(rest) == 0:
+            continue
+
+        ious = _mask_iou_against(i, rest, masks, boxes, areas)
+        suppressed[rest[ious > iou_threshold]] = True
+
+    kept = [o for o, s in zip(ordered, suppressed) if not s]
+    if len(kept) < len(objects):
+        logger.info(f"🧹 NMS masques : {len(objects) - len(kept)} doublon(s) supprimé(s)")
+    return kept
+
+
+def resolve_panoptic(
+    objects: List[Dict],
+    shape: Tuple[int, int],
+    min_pixels: int = 0
+) -> Tuple[np.ndarray, List[Dict]]:
+    """
+    Résout les chevauchements entre objets (éventuellement issus de prompts
+    différents) en une carte de labels sans recouvrement, style panoptique.
+
+    Chaque pixel est attribué à l'objet de plus haut score qui le couvre.
+    Les masques des objets sont remplacés par leur région exclusive et les
+    objets dont la région devient inférieure à `min_pixels` sont écartés.
+
+    Args:
+        objects: Objets {"mask", "score", "bbox", ...}
+        shape: (H, W) de l'image
+        min_pixels: Surface minimale d'une région conservée
+
+    Returns:
+        (label_map uint16 (H, W) où 0 = fond et k = k-ième objet retourné, objets)
+    """
+    label_map = np.zeros(shape, dtype=np.uint16)
+    ordered = sorted(objects, key=lambda o: o["score"], reverse=True)
+
+    resolved = []
+    for obj in ordered:
+        x1, y1, x2, y2 = obj["bbox"]["x1"], obj["bbox"]["y1"], obj["bbox"]["x2"], obj["bbox"]["y2"]
+        label_crop = label_map[y1:y2 + 1, x1:x2 + 1]
+        region = (np.asarray(obj["mask"])[y1:y2 + 1, x1:x2 + 1] > 0) & (label_crop == 0)
+
+        if np.count_nonzero(region) <= max(min_pixels - 1, 0):
+            continue
+
+        label_id = len(resolved) + 1
+        label_crop[region] = label_id
+
+        mask = np.zeros(shape, dtype=np.uint8)
+        mask[y1:y2 + 1, x1:x2 + 1] = region
+
+        # La région exclusive peut être plus petite que le masque d'origine
+        coords = np.argwhere(region)
+        (ry1, rx1), (ry2, rx2) = coords.min(axis=0), coords.max(axis=0)
+        bbox = {"x1": int(x1 + rx1), "y1": int(y1 + ry1), "x2": int(x1 + rx2), "y2": int(y1 + ry2)}
+
+        resolved.append({**obj, "mask": mask, "bbox": bbox})
+
+    return label_map, resolved
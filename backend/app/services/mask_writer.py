@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class WriteJob:
+    """Suivi de durabilité des masques d'une requête"""
+
+    def __init__(self, job_id: str, on_complete: Optional[Callable[["WriteJob"], None]] = None):
+        self.job_id = job_id
+        self.on_complete = on_complete
+        self.total = 0
+        self.written = 0
+        self.failed = 0
+        self.errors: List[str] = []
+        self.sealed = False
+        self.created_at = time.time()
+        self.done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.sealed and self.written + self.failed >= self.total
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "total": self.total,
+            "written": self.written,
+            "failed": self.failed,
+            "durable": self.finished and self.failed == 0,
+            "finished": self.finished,
+            "errors": self.errors[:10],
+        }
+
+
+class MaskWriter:
+    """
+    Persistance différée (write-behind) des masques.
+
+    Les buffers numpy sont mis en file et écrits par un pool de threads :
+    écriture dans un fichier temporaire, fsync groupé par lot, renommage
+    atomique puis fsync unique par dossier. La file est bornée en octets :
+    quand les écrivains prennent du retard, `submit` attend (contre-pression)
+    au lieu de laisser la mémoire croître.
+    """
+
+    def __init__(self, workers: int, max_pending_bytes: int, fsync_batch: int, job_history: int = 1024, job_ttl: float = 3600):
+        self.workers = workers
+        self.max_pending_bytes = max_pending_bytes
+        self.fsync_batch = fsync_batch
+        self.job_history = job_history
+        self.job_ttl = job_ttl
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pending_bytes = 0
+        self._space = threading.Condition()
+        self._jobs: "OrderedDict[str, WriteJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"mask-writer-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"✓ Écrivain de masques démarré ({self.workers} threads)")
+
+    def stop(self, timeout: float = 30.0):
+        """Vide la file puis arrête les threads"""
+        with self._start_lock:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join(timeout=timeout)
+            self._threads = []
+
+    # --- Suivi des jobs ---
+
+    def create_job(self, on_complete: Optional[Callable[[WriteJob], None]] = None) -> str:
+        """Nouveau job ; `on_complete(job)` est appelé une fois toutes ses écritures terminées"""
+        job = WriteJob(uuid.uuid4().hex, on_complete)
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+            # Historique borné : on oublie les jobs terminés les plus anciens. Un job jamais
+            # scellé (client parti, erreur avant seal) ne bloque pas la purge et est
+            # oublié après job_ttl secondes
+            excess = len(self._jobs) - self.job_history
+            if excess > 0:
+                expired_before = time.time() - self.job_ttl
+                for old_id, old in list(self._jobs.items()):
+                    if excess <= 0:
+                        break
+                    if old is not job and (old.finished or old.created_at < expired_before):
+                        del self._jobs[old_id]
+                        excess -= 1
+        return job.job_id
+
+    def seal(self, job_id: str):
+        """Indique qu'aucun autre masque ne sera ajouté au job"""
+        with self._jobs_lock:
+            job = self._jobs[job_id]
+            job.sealed = True
+            finished = job.finished
+        if finished:
+            self._complete(job)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        job = self._jobs.get(job_id)
+        return job.done.wait(timeout) if job else False
+
+    async def wait_async(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.wait, job_id, timeout)
+
+    @staticmethod
+    def _complete(job: WriteJob):
+        """Rappel de fin (hors verrou) puis réveil des attentes"""
+        if job.on_complete is not None:
+            try:
+                job.on_complete(job)
+            except Exception as e:
+                logger.error(f"❌ Rappel de fin d'écriture en échec ({job.job_id}): {e}")
+        job.done.set()
+
+    # --- Soumission ---
+
+    def _reserve(self, size: int, block: bool) -> bool:
+        with self._space:
+            # Un buffer plus gros que la borne passe seul quand la file est vide
+            fits = lambda: self._pending_bytes == 0 or self._pending_bytes + size <= self.max_pending_bytes
+            if not fits():
+                if not block:
+                    return False
+                self._space.wait_for(fits)
+            self._pending_bytes += size
+            return True
+
+    def _enqueue(self, job_id: str, path: str, buffer: np.ndarray):
+        with self._jobs_lock:
+            self._jobs[job_id].total += 1
+        self._queue.put((job_id, path, buffer))
+
+    def submit(self, job_id: str, path: str, buffer: np.ndarray):
+        """Met un buffer en file d'écriture (bloque si la file est pleine)"""
+        self.start()
+        self._reserve(buffer.nbytes, block=True)
+        self._enqueue(job_id, path, buffer)
+
+    async def submit_async(self, job_id: str, path: str, buffer: np.ndarray):
+        """Variante asynchrone : l'attente de contre-pression ne bloque pas la boucle d'événements"""
+        self.start()
+        if not self._reserve(buffer.nbytes, block=False):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._reserve, buffer.nbytes, True)
+        self._enqueue(job_id, path, buffer)
+
+    # --- Écriture ---
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            # Regroupe les écritures disponibles pour mutualiser les fsync
+            while len(batch) < self.fsync_batch:
+                try:
+                    extra = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if extra is None:
+                    stop = True
+                    break
+                batch.append(extra)
+
+            self._write_batch(batch)
+            if stop:
+                return
+
+    @staticmethod
+    def _discard(fd: Optional[int], tmp_path: str):
+        """Ferme le descripteur et supprime le fichier temporaire d'une écriture ratée"""
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    def _write_files(self, batch: List) -> List:
+        """Écrit (job_id, chemin, buffer) : fichier temporaire, fsync, renommage, fsync des dossiers"""
+        results = []
+        opened = []
+        for job_id, path, buffer in batch:
+            tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            fd = None
+            try:
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                with os.fdopen(fd, "wb", closefd=False) as f:
+                    f.write(memoryview(np.ascontiguousarray(buffer)).cast("B"))
+                opened.append((fd, job_id, path, tmp_path, buffer.nbytes))
+            except Exception as e:
+                self._discard(fd, tmp_path)
+                results.append((job_id, buffer.nbytes, f"{path}: {e}"))
+
+        # fsync groupé, puis renommage atomique
+        directories = set()
+        for fd, job_id, path, tmp_path, size in opened:
+            try:
+                os.fsync(fd)
+                # Un descripteur fermé (même en échec) peut être réattribué à un autre
+                # écrivain : il n'est plus jamais transmis à _discard
+                closing, fd = fd, None
+                os.close(closing)
+                os.replace(tmp_path, path)
+                directories.add(os.path.dirname(path) or ".")
+                results.append((job_id, size, None))
+            except Exception as e:
+                self._discard(fd, tmp_path)
+                results.append((job_id, size, f"{path}: {e}"))
+
+        # Un seul fsync par dossier pour rendre les renommages durables
+        for directory in directories:
+            try:
+                dir_fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError:
+                pass
+        return results
+
+    def write_now(self, items: List):
+        """
+        Écriture synchrone et durable de (chemin, buffer), mêmes garanties que la
+        file (MASK_WRITE_BEHIND=False) ; lève OSError si une écriture échoue
+        """
+        results = self._write_files([(None, path, buffer) for path, buffer in items])
+        errors = [error for _, _, error in results if error]
+        if errors:
+            raise OSError(f"Écriture des masques échouée: {'; '.join(errors)}")
+
+    def _write_batch(self, batch: List):
+        results = self._write_files(batch)
+
+        released = 0
+        completed = []
+        with self._jobs_lock:
+            for job_id, size, error in results:
+                released += size
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if error:
+                    job.failed += 1
+                    job.errors.append(error)
+                    logger.error(f"❌ Écriture du masque échouée: {error}")
+                else:
+                    job.written += 1
+                if job.finished and job not in completed:
+                    completed.append(job)
+        for job in completed:
+            self._complete(job)
+
+        with self._space:
+            self._pending_bytes -= released
+            self._space.notify_all()
+
+    def get_stats(self) -> Dict:
+        return {
+            "pending_bytes": self._pending_bytes,
+            "queued": self._queue.qsize(),
+            "workers": len(self._threads),
+        }
+
+
+mask_writer = MaskWriter(
+    workers=settings.MASK_WRITER_WORKERS,
+    max_pending_bytes=settings.MASK_WRITER_MAX_PENDING_MB * 1024 * 1024,
+    fsync_batch=settings.MASK_WRITER_FSYNC_BATCH,
+    job_ttl=settings.MASK_WRITER_JOB_TTL
+)
@@ -1,6 +1,10 @@
 import logging
+import threading
 import numpy as np
+from collections import OrderedDict
 from pathlib import Path
+from typing import Optional, Tuple
+from app.services.profiler import profiler
 from config import settings
 
 logger = logging.getLogger(__name__)
@@ -12,24 +16,48 @@ except ImportError:
     YOLO_AVAILABLE = False
     logger.warning("⚠️ YOLO non disponible (pip install ultralytics)")
 
+
+def should_label(prompt: str, policy: Optional[str] = None) -> bool:
+    """
+    Indique si l'étiquetage YOLO est utile pour ce prompt.
+    'generic' : seulement si le prompt ne nomme pas déjà un concept précis.
+    """
+    policy = (policy or settings.YOLO_LABELING).lower()
+    if policy == "always":
+        return True
+    if policy == "generic":
+        normalized = " ".join(prompt.lower().split())
+        return normalized in settings.YOLO_GENERIC_PROMPTS
+    return False
+
+
 class ObjectDetector:
     """Détecteur singleton YOLOv8 pour l'étiquetage des masques SAM 3"""
     
     _instance = None
     
-    def __new__(cls):
+    def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._initialized = False
         return cls._instance
     
     def __init__(self):
+        # Singleton partagé : seuil et taille d'entrée viennent de la configuration
         if self._initialized:
             return
         
         self.model = None
         self.available = False
         self.class_names = {}
+        self.conf = settings.YOLO_CONFIDENCE
+        self.imgsz = settings.YOLO_IMGSZ
+        
+        # Cache des détections par hash d'image (LRU)
+        self._cache: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Le prédicteur ultralytics n'est pas thread-safe : une inférence à la fois
+        self._inference_lock = threading.Lock()
         
         if YOLO_AVAILABLE:
             try:
@@ -46,43 +74,77 @@ class ObjectDetector:
         
         self._initialized = True
 
-    def detect_labels(self, image: np.ndarray, bboxes: list) -> dict:
+    def detect(self, image: np.ndarray, image_hash: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Associe un label textuel à chaque bounding box de SAM 3 via l'IoU.
-        bboxes: [{'x1', 'y1', 'x2', 'y2'}, ...]
+        Inférence YOLO sur toute l'image.
+        Retourne (boxes xyxy (N, 4), classes (N,)) ; mis en cache si image_hash est fourni.
         """
-        labels = {}
-        if not self.available or not bboxes:
-            return {i: "object" for i in range(len(bboxes))}
+        empty = (np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32))
+        if not self.available:
+            return empty
+
+        if image_hash is not None:
+            with self._cache_lock:
+                if image_hash in self._cache:
+                    self._cache.move_to_end(image_hash)
+                    return self._cache[image_hash]
 
         try:
-            # Inférence YOLO sur toute l'image
-            results = self.model(image, verbose=False, conf=0.2)
+            with self._inference_lock, profiler.region("yolo.detect"):
+                results = self.model(image, verbose=False, conf=self.conf, imgsz=self.imgsz)
             if not results or not results[0].boxes:
-                return {i: "object" for i in range(len(bboxes))}
+                detections = empty
+            else:
+                detections = (
+                    results[0].boxes.xyxy.cpu().numpy(),
+                    results[0].boxes.cls.cpu().numpy()
+                )
+        except Exception as e:
+            logger.error(f"Erreur lors de l'inférence YOLO: {e}")
+            return empty
+
+        if image_hash is not None:
+            with self._cache_lock:
+                self._cache[image_hash] = detections
+                while len(self._cache) > settings.YOLO_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+
+        return detections
 
-            yolo_boxes = results[0].boxes.xyxy.cpu().numpy()
-            yolo_classes = results[0].boxes.cls.cpu().numpy()
+    def match_labels(self, bboxes: list, detections: Tuple[np.ndarray, np.ndarray]) -> dict:
+        """
+        Associe un label textuel à chaque bounding box de SAM 3 via l'IoU.
+        bboxes: [{'x1', 'y1', 'x2', 'y2'}, ...]
+        """
+        yolo_boxes, yolo_classes = detections
+        if not self.available or len(yolo_boxes) == 0:
+            return {i: "object" for i in range(len(bboxes))}
 
-            for i, seg_bbox in enumerate(bboxes):
-                best_iou = 0.0
-                best_label = "object"
+        labels = {}
+        for i, seg_bbox in enumerate(bboxes):
+            best_iou = 0.0
+            best_label = "object"
 
-                for j, y_box in enumerate(yolo_boxes):
-                    iou = self._compute_iou(seg_bbox, y_box)
-                    if iou > best_iou:
-                        best_iou = iou
-                        class_id = int(yolo_classes[j])
-                        best_label = self.class_names.get(class_id, "object")
+            for j, y_box in enumerate(yolo_boxes):
+                iou = self._compute_iou(seg_bbox, y_box)
+                if iou > best_iou:
+                    best_iou = iou
+                    class_id = int(yolo_classes[j])
+                    best_label = self.class_names.get(class_id, "object")
 
-                # On n'attribue le label que si la correspondance est décente (IoU > 30%)
-                labels[i] = best_label if best_iou > 0.3 else "unidentified"
-            
-            return labels
+            # On n'attribue le label que si la correspondance est décente (IoU > 30%)
+            labels[i] = best_label if best_iou > 0.3 else "unidentified"
+        
+        return labels
 
-        except Exception as e:
-            logger.error(f"Erreur lors de l'étiquetage YOLO: {e}")
+    def detect_labels(self, image: np.ndarray, bboxes: list, image_hash: Optional[str] = None) -> dict:
+        """
+        Associe un label textuel à chaque bounding box de SAM 3 via l'IoU.
+        bboxes: [{'x1', 'y1', 'x2', 'y2'}, ...]
+        """
+        if not self.available or not bboxes:
             return {i: "object" for i in range(len(bboxes))}
+        return self.match_labels(bboxes, self.detect(image, image_hash))
 
     @staticmethod
     def _compute_iou(bbox1: dict, bbox2: np.ndarray) -> float:
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Dict, List, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import torch
+    from torch.profiler import profile, ProfilerActivity, record_function
+    TORCH_PROFILER_AVAILABLE = True
+except ImportError:
+    TORCH_PROFILER_AVAILABLE = False
+    logger.warning("⚠️ torch.profiler non disponible, seul l'échantillonnage Python sera capturé")
+
+_NULL_CONTEXT = nullcontext()
+
+# Échantillonneur de la requête capturée, visible uniquement dans la tâche de cette requête
+_current_capture: ContextVar[Optional["PythonSampler"]] = ContextVar("segma_profiling_capture", default=None)
+
+
+class PythonSampler:
+    """
+    Échantillonneur de piles Python : relève périodiquement la pile des threads
+    suivis (ceux qui exécutent le pipeline) via sys._current_frames().
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread_ids = set()
+        self.samples: List[tuple] = []  # (thread_id, pile racine -> feuille)
+        self.torch_profiler = None  # profileur torch du thread d'inférence, une fois arrêté
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.ended_at = 0.0
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="segma-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.ended_at = time.perf_counter()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                if stack:
+                    self.samples.append((thread_id, tuple(reversed(stack))))
+
+    def to_speedscope(self, name: str) -> Dict:
+        """Export au format speedscope (profil 'sampled', un profil par thread)"""
+        frames: List[Dict] = []
+        frame_index: Dict[tuple, int] = {}
+        per_thread: Dict[int, List[List[int]]] = {}
+
+        for thread_id, stack in self.samples:
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_index[frame])
+            per_thread.setdefault(thread_id, []).append(indices)
+
+        duration = self.ended_at - self.started_at
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "segma",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": f"thread {thread_id}",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": duration,
+                    "samples": samples,
+                    "weights": [self.interval] * len(samples),
+                }
+                for thread_id, samples in per_thread.items()
+            ],
+        }
+
+
+class ProfilingSession:
+    """
+    Profilage à la demande d'un serveur en production.
+
+    Armé par un administrateur pour les N prochaines requêtes ou une fenêtre
+    de temps bornée. Chaque requête capturée produit une trace Chrome
+    (torch.profiler : temps CPU et mémoire par opérateur) et un profil
+    speedscope (échantillonnage des piles Python du pipeline).
+
+    Inactif, le coût se limite à la lecture d'un booléen. Une seule capture
+    à la fois : les requêtes concurrentes ne sont pas profilées.
+
+    Les rappels de torch.profiler sont propres au thread qui le démarre et un
+    seul profileur peut être actif par processus : le profileur torch est donc
+    démarré par `track_thread` dans le thread d'exécution qui porte toute
+    l'inférence de la requête capturée.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.active = False
+        self.session_id: Optional[str] = None
+        self.remaining_requests: Optional[int] = None
+        self.deadline: Optional[float] = None
+        self.captured = 0
+        self._current: Optional[PythonSampler] = None
+        self._lock = threading.Lock()
+
+    # --- Pilotage (admin) ---
+
+    def arm(self, requests: Optional[int] = None, duration_s: Optional[float] = None) -> Dict:
+        """Active la capture pour `requests` requêtes et/ou `duration_s` secondes (bornés par la config)"""
+        with self._lock:
+            if self.active:
+                raise RuntimeError(f"Session de profilage {self.session_id} déjà active")
+            if requests is None and duration_s is None:
+                requests = 1
+            self.session_id = uuid.uuid4().hex[:12]
+            self.remaining_requests = min(requests, settings.PROFILING_MAX_REQUESTS) if requests else None
+            duration_s = min(duration_s or settings.PROFILING_MAX_DURATION, settings.PROFILING_MAX_DURATION)
+            self.deadline = time.monotonic() + duration_s
+            self.captured = 0
+            self.active = True
+        logger.info(f"🔬 Profilage armé (session {self.session_id}, requêtes={self.remaining_requests}, durée={duration_s:.0f}s)")
+        return self.status()
+
+    def disarm(self) -> Dict:
+        with self._lock:
+            self.active = False
+            self.remaining_requests = None
+            self.deadline = None
+        return self.status()
+
+    def status(self) -> Dict:
+        return {
+            "active": self.active,
+            "session_id": self.session_id,
+            "remaining_requests": self.remaining_requests,
+            "expires_in_s": round(max(self.deadline - time.monotonic(), 0), 1) if self.active and self.deadline else None,
+            "captured": self.captured,
+            "artifacts": self.list_artifacts(),
+        }
+
+    def _claim(self) -> Optional[int]:
+        """Réserve une capture si la session est active et qu'aucune autre n'est en cours"""
+        with self._lock:
+            if not self.active:
+                return None
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                self.active = False
+                return None
+            if self._current is not None:
+                return None
+            if self.remaining_requests is not None:
+                self.remaining_requests -= 1
+                if self.remaining_requests <= 0:
+                    self.active = False
+            self.captured += 1
+            self._current = PythonSampler(settings.PROFILING_SAMPLE_INTERVAL_MS / 1000)
+            return self.captured
+
+    # --- Points d'instrumentation ---
+
+    @asynccontextmanager
+    async def capture(self, label: str):
+        """Capture la requête englobée si une session est armée"""
+        if not self.active:
+            yield
+            return
+        index = self._claim()
+        if index is None:
+            yield
+            return
+
+        sampler = self._current
+        sampler.thread_ids.add(threading.get_ident())
+        token = _current_capture.set(sampler)
+        sampler.start()
+        try:
+            yield
+        finally:
+            _current_capture.reset(token)
+            sampler.stop()
+            with self._lock:
+                self._current = None
+            # L'export peut être lent : hors de la boucle d'événements
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._export, index, label, sampler)
+
+    @staticmethod
+    def current_capture() -> Optional[PythonSampler]:
+        """Capture de la requête en cours (à lire dans sa tâche, avant de passer à l'exécuteur)"""
+        return _current_capture.get()
+
+    @contextmanager
+    def track_thread(self, capture: Optional[PythonSampler]):
+        """
+        Profile le thread courant (exécuteur) pour la capture donnée : échantillonnage
+        Python et torch.profiler, démarré ici car ses rappels sont locaux au thread.
+        """
+        if capture is None:
+            yield
+            return
+        thread_id = threading.get_ident()
+        capture.thread_ids.add(thread_id)
+        # Le contexte de la requête n'est pas propagé par run_in_executor
+        token = _current_capture.set(capture)
+        torch_profiler = None
+        if TORCH_PROFILER_AVAILABLE:
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            torch_profiler = profile(activities=activities, profile_memory=True, record_shapes=True)
+            torch_profiler.__enter__()
+        try:
+            yield
+        finally:
+            if torch_profiler is not None:
+                torch_profiler.__exit__(None, None, None)
+                capture.torch_profiler = torch_profiler
+            capture.thread_ids.discard(thread_id)
+            _current_capture.reset(token)
+
+    def region(self, name: str):
+        """Région nommée dans la trace torch (contexte nul hors de la requête capturée)"""
+        if _current_capture.get() is None or not TORCH_PROFILER_AVAILABLE:
+            return _NULL_CONTEXT
+        return record_function(name)
+
+    # --- Artefacts ---
+
+    def _export(self, index: int, label: str, sampler: PythonSampler):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.session_id}_{index:03d}")
+        torch_profiler = sampler.torch_profiler
+        try:
+            if torch_profiler is not None:
+                torch_profiler.export_chrome_trace(f"{base}.trace.json")
+                with open(f"{base}.operators.txt", "w", encoding="utf-8") as f:
+                    f.write(torch_profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+            with open(f"{base}.speedscope.json", "w", encoding="utf-8") as f:
+                json.dump(sampler.to_speedscope(label), f)
+            logger.info(f"🔬 Profil capturé : {base}.*")
+        except Exception as e:
+            logger.error(f"❌ Échec de l'export du profil: {e}")
+        self._prune()
+
+    def _prune(self):
+        """Ne garde que les PROFILING_MAX_ARTIFACTS fichiers les plus récents"""
+        paths = sorted(
+            (os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir)),
+            key=os.path.getmtime
+        )
+        for path in paths[:-settings.PROFILING_MAX_ARTIFACTS]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def list_artifacts(self) -> List[str]:
+        if not os.path.isdir(self.output_dir):
+            return []
+        return sorted(os.listdir(self.output_dir))
+
+    def artifact_path(self, name: str) -> Optional[str]:
+        """Chemin d'un artefact, en refusant toute sortie du dossier de profils"""
+        if os.path.basename(name) != name or name not in self.list_artifacts():
+            return None
+        return os.path.join(self.output_dir, name)
+
+
+profiler = ProfilingSession(settings.PROFILING_DIR)
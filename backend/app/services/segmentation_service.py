@@ -1,99 +1,343 @@
+import asyncio
 import logging
 import numpy as np
 import os
 from pathlib import Path
-from app.exceptions import SegmentationException, ImageProcessingException
-from app.models.image_processor import ImageProcessor
-from app.services.object_detector import get_object_detector
-from app.models.model_manager import model_manager
+from typing import List, Optional
+from app.exceptions import (
+    SegmentationException, ImageProcessingException,
+    ModelNotLoadedException, ModelVariantNotFoundException
+)
+from app.models.sam3.image_processor import ImageProcessor
+from app.services.object_detector import get_object_detector, should_label
+from app.services.mask_nms import mask_nms, resolve_panoptic
+from app.services.mask_writer import mask_writer
+from app.services.artifact_store import artifact_store, compute_params_key
+from app.services.profiler import profiler
+from app.models.model_manager import model_registry
+from app.models.sam3.text_embedding_cache import normalize_prompt
+from config import settings
 
 logger = logging.getLogger(__name__)
 
+
+def unique_prompts(prompt: str, additional_prompts: Optional[List[str]] = None) -> List[str]:
+    """
+    Prompt principal suivi des prompts supplémentaires distincts. Les doublons à la
+    casse ou aux espaces près ("Voiture ", "voiture") sont écartés : ils relanceraient
+    SAM 3 pour des masques identiques et fausseraient la clé du store d'artefacts.
+    """
+    seen = {normalize_prompt(prompt)}
+    prompts = [prompt]
+    for extra in additional_prompts or []:
+        key = normalize_prompt(extra) if extra else ""
+        if key and key not in seen:
+            seen.add(key)
+            prompts.append(extra)
+    return prompts
+
+
 class SegmentationService:
     """Service orchestrateur pour la segmentation SAM 3 et l'étiquetage YOLO"""
     
     def __init__(self):
-        # On récupère le wrapper SAM 3 via le manager singleton
-        self.sam3_wrapper = model_manager.get_model()
+        # Le wrapper SAM 3 est réservé par requête auprès du registre (variante sélectionnable)
         self.detector = get_object_detector()
 
+    def _segment_concepts(
+        self,
+        image: np.ndarray,
+        prompts: List[str],
+        confidence_threshold: float,
+        iou_threshold: float,
+        model_variant: Optional[str] = None
+    ) -> List[dict]:
+        """Inférence SAM 3 pour chaque concept puis NMS des masques par concept"""
+        raw_masks = []
+        with model_registry.acquire(model_variant) as sam3_wrapper:
+            for concept in prompts:
+                concept_masks = sam3_wrapper.segment_by_text(image, concept, threshold=confidence_threshold)
+                for obj in mask_nms(concept_masks, iou_threshold):
+                    raw_masks.append({**obj, "prompt": concept})
+        return raw_masks
+
+    def _detect_objects(self, image: np.ndarray, image_hash: str):
+        """Inférence YOLO (exécutée en parallèle de SAM 3)"""
+        return self.detector.detect(image, image_hash)
+
+    def _run_profiled(self, capture, image: np.ndarray, image_hash: Optional[str], *concept_args):
+        """
+        Requête profilée : SAM 3 puis YOLO dans un même thread, celui qui porte le
+        profileur torch (un seul profileur actif par processus, rappels locaux au thread)
+        """
+        with profiler.track_thread(capture):
+            raw_masks = self._segment_concepts(image, *concept_args)
+            detections = self._detect_objects(image, image_hash) if image_hash is not None else None
+        return raw_masks, detections
+
+    @staticmethod
+    def _load_image(image_path: str):
+        """Décodage et empreinte de l'image (hors de la boucle d'événements)"""
+        image = ImageProcessor.load_image(image_path)
+        return image, ImageProcessor.compute_image_hash(image)
+
+    @staticmethod
+    def _result_from_artifact(entry: dict, image_path: str, return_masks: bool) -> dict:
+        """Résultat reconstruit depuis l'index (masques relus seulement pour une réponse binaire)"""
+        objects = entry["objects"]
+        result = {
+            "image_path": image_path,
+            "resolution": entry["resolution"],
+            "objects_count": len(objects),
+            "objects": objects,
+            "segmentation_dir": entry["directory"],
+            "label_map_path": entry["label_map_path"],
+            "persist_job_id": None,
+            "durable": True,
+            "artifact_id": entry["id"],
+            "cached": True
+        }
+        if return_masks:
+            width, height = (int(v) for v in entry["resolution"].split("x"))
+            for obj in objects:
+                obj["mask"] = np.fromfile(obj["mask_path"], dtype=np.uint8).reshape(height, width)
+            if entry["label_map_path"]:
+                result["label_map"] = np.fromfile(entry["label_map_path"], dtype=np.uint16).reshape(height, width)
+        return result
+
     async def segment_by_prompt(
         self,
         image_path: str,
         prompt: str,
         confidence_threshold: float = 0.25,
-        save_dir: str = None
+        save_dir: str = None,
+        additional_prompts: Optional[List[str]] = None,
+        nms_iou_threshold: Optional[float] = None,
+        labeling: Optional[str] = None,
+        model_variant: Optional[str] = None,
+        persist: bool = True,
+        return_masks: bool = False,
+        wait_durable: bool = False
     ) -> dict:
         """
         Pipeline complet : Charge l'image -> Segment avec SAM 3 -> 
-        Étiquette avec YOLO -> Sauvegarde en .bin
+        NMS des masques -> Étiquette avec YOLO -> Sauvegarde en .bin
+
+        Avec plusieurs prompts, les chevauchements entre concepts sont résolus
+        en une carte de labels panoptique (chaque pixel appartient à un seul objet).
+
+        L'étiquetage YOLO suit la politique `labeling` ('off', 'always', 'generic') ;
+        lorsqu'il est actif, YOLO tourne en parallèle de SAM 3.
+
+        `persist=False` n'écrit rien sur disque ; `return_masks=True` joint les
+        masques numpy (clé "mask") et la carte panoptique ("label_map") au résultat
+        pour une réponse binaire.
+
+        Avec MASK_WRITE_BEHIND, les masques sont seulement mis en file d'écriture :
+        le résultat contient `persist_job_id` et `durable` (True une fois fsync fait,
+        ou immédiatement si `wait_durable`).
+
+        Sans `save_dir`, les résultats sont rangés et indexés par le store
+        d'artefacts (image, prompt, paramètres) : une requête identique déjà
+        servie est relue depuis l'index, sans inférence.
+
+        Les appels bloquants (décodage, hash, SQLite, disque) passent par
+        l'exécuteur pour ne pas bloquer la boucle d'événements.
         """
+        job_id = None
+        artifact_key = None
+        generation = None
+        loop = asyncio.get_running_loop()
         try:
             logger.info(f"🚀 Démarrage Pipeline SAM 3 pour: {image_path} (Prompt: '{prompt}')")
             
             # 1. Chargement de l'image via ImageProcessor
-            image = ImageProcessor.load_image(image_path)
+            image, image_hash = await loop.run_in_executor(None, self._load_image, image_path)
             height, width = image.shape[:2]
 
-            # 2. Détermination du répertoire de stockage (Contrainte client)
+            iou_threshold = nms_iou_threshold if nms_iou_threshold is not None else settings.MASK_NMS_IOU_THRESHOLD
+            prompts = unique_prompts(prompt, additional_prompts)
+
+            # 2. Store d'artefacts : un résultat identique déjà indexé est servi sans inférence
             if not save_dir:
-                image_name = Path(image_path).stem
-                # On crée un dossier dédié par image pour ne pas mélanger les .bin
-                seg_dir = Path(image_path).parent / f".segmentation_{image_name}"
+                params = {
+                    "prompts": prompts,
+                    "confidence_threshold": confidence_threshold,
+                    "nms_iou_threshold": iou_threshold,
+                    "labeling": (labeling or settings.YOLO_LABELING).lower(),
+                    "model_variant": model_variant or settings.SAM3_DEFAULT_VARIANT,
+                    "min_pixels": settings.MASK_MIN_PIXELS,
+                }
+                artifact_key = (image_hash, prompt, compute_params_key(params))
+                cached = await loop.run_in_executor(None, artifact_store.lookup, artifact_key)
+                if cached is not None:
+                    try:
+                        logger.info(f"♻️ Résultat déjà indexé pour '{prompt}' (artefact {cached['id']})")
+                        return await loop.run_in_executor(
+                            None, self._result_from_artifact, cached, image_path, return_masks
+                        )
+                    except OSError as e:
+                        # Fichiers supprimés hors du store : l'entrée est retirée et recalculée
+                        logger.warning(f"⚠️ Artefact {cached['id']} illisible, recalcul: {e}")
+                        await loop.run_in_executor(None, artifact_store.discard, artifact_key, cached["generation"])
+
+            # 3. Détermination du répertoire de stockage (save_dir client prioritaire, hors index)
+            seg_dir = None
+            if persist:
+                if save_dir:
+                    seg_dir = Path(save_dir)
+                else:
+                    # Dossier propre à ce calcul : un calcul concurrent de la même clé ne le partage pas
+                    generation = artifact_store.new_generation()
+                    seg_dir = Path(artifact_store.artifact_dir(artifact_key, generation))
+                seg_dir.mkdir(parents=True, exist_ok=True)
+
+            # 4. Inférence SAM 3 (Promptable Concept Segmentation) + NMS par prompt
+            # Les doublons sont éliminés avant YOLO et l'écriture disque ;
+            # YOLO n'est lancé que si au moins un prompt en a besoin, en parallèle de SAM 3
+            labeled_prompts = {p for p in prompts if should_label(p, labeling)}
+            concept_args = (prompts, confidence_threshold, iou_threshold, model_variant)
+            capture = profiler.current_capture()
+            if capture is not None:
+                raw_masks, detections = await loop.run_in_executor(
+                    None, self._run_profiled, capture, image, image_hash if labeled_prompts else None, *concept_args
+                )
             else:
-                seg_dir = Path(save_dir)
-            
-            seg_dir.mkdir(parents=True, exist_ok=True)
+                yolo_task = None
+                if labeled_prompts:
+                    yolo_task = loop.run_in_executor(None, self._detect_objects, image, image_hash)
 
-            # 3. Inférence SAM 3 (Promptable Concept Segmentation)
-            # Utilise la méthode native du wrapper harmonisé
-            raw_masks = self.sam3_wrapper.segment_by_text(image, prompt, threshold=confidence_threshold)
+                raw_masks = await loop.run_in_executor(None, self._segment_concepts, image, *concept_args)
+                detections = await yolo_task if yolo_task is not None else None
             
+            result = {
+                "image_path": image_path,
+                "resolution": f"{width}x{height}",
+                "objects_count": 0,
+                "objects": [],
+                "segmentation_dir": str(seg_dir.absolute()) if seg_dir else None,
+                "label_map_path": None,
+                "persist_job_id": None,
+                "durable": seg_dir is not None,
+                "artifact_id": None,
+                "cached": False
+            }
+            # Seuls les résultats rangés par le store sont indexés (pas les save_dir clients)
+            indexed = artifact_key is not None and seg_dir is not None
+
             if not raw_masks:
                 logger.warning(f"Aucun objet trouvé pour le concept '{prompt}'")
-                return {"objects": [], "count": 0}
+                if indexed:
+                    result["artifact_id"] = await loop.run_in_executor(
+                        None, artifact_store.record,
+                        artifact_key, generation, params, image_path, result["resolution"], None, [], 0, True
+                    )
+                return result
 
-            # 4. Traitement et enrichissement avec YOLO
-            objects_data = []
-            
-            # On extrait les bboxes pour YOLO d'un coup pour optimiser les performances
-            bboxes_for_yolo = [obj["bbox"] for obj in raw_masks]
-            labels_map = self.detector.detect_labels(image, bboxes_for_yolo)
+            # Écriture différée : les buffers partent en file, la réponse n'attend pas le disque
+            if seg_dir is not None and settings.MASK_WRITE_BEHIND:
+                # L'entrée d'index ne devient servable qu'une fois les fichiers durables
+                job_id = mask_writer.create_job(
+                    on_complete=artifact_store.on_job_complete(artifact_key, generation) if indexed else None
+                )
+                result["persist_job_id"] = job_id
+                result["durable"] = False
 
-            for idx, obj in enumerate(raw_masks):
+            # 5. Résolution des chevauchements entre concepts (carte panoptique)
+            stored_bytes = 0
+            # Sans écriture différée : écrites et synchronisées ensemble avant de répondre durable
+            sync_writes = []
+            if len(prompts) > 1:
+                label_map, raw_masks = resolve_panoptic(
+                    raw_masks, (height, width), min_pixels=settings.MASK_MIN_PIXELS
+                )
+                if seg_dir is not None:
+                    label_map_file = seg_dir / "label_map.bin"
+                    if job_id is not None:
+                        await mask_writer.submit_async(job_id, str(label_map_file), label_map)
+                    else:
+                        sync_writes.append((str(label_map_file), label_map))
+                    result["label_map_path"] = str(label_map_file.absolute())
+                    stored_bytes += label_map.nbytes
+                if return_masks:
+                    result["label_map"] = label_map
+
+            # 6. Filtrage du bruit avant l'étiquetage YOLO
+            kept_masks = []
+            for obj in raw_masks:
                 # Conversion du tenseur en numpy binaire (0 ou 255)
                 mask_np = ImageProcessor.tensor_to_mask(obj["mask"])
                 
                 # Calcul des pixels pour filtrer le bruit
                 pixel_count = np.count_nonzero(mask_np)
-                if pixel_count < 100: # Seuil de bruit
+                if pixel_count < settings.MASK_MIN_PIXELS:
                     continue
+                kept_masks.append((obj, mask_np, pixel_count))
 
-                # Sauvegarde au format .bin (Brut / Même taille que l'originale)
-                mask_filename = f"mask_{idx}.bin"
-                mask_path = seg_dir / mask_filename
-                
-                # Écriture binaire directe
-                mask_np.tofile(str(mask_path))
+            # 7. Traitement et enrichissement avec YOLO (détections déjà calculées)
+            objects_data = []
+            
+            labels_map = {}
+            if detections is not None:
+                bboxes_for_yolo = [obj["bbox"] for obj, _, _ in kept_masks]
+                labels_map = self.detector.match_labels(bboxes_for_yolo, detections)
+
+            for idx, (obj, mask_np, pixel_count) in enumerate(kept_masks):
+                mask_path = None
+                if seg_dir is not None:
+                    # Sauvegarde au format .bin (Brut / Même taille que l'originale)
+                    mask_path = seg_dir / f"mask_{idx}.bin"
+                    
+                    if job_id is not None:
+                        await mask_writer.submit_async(job_id, str(mask_path), mask_np)
+                    else:
+                        sync_writes.append((str(mask_path), mask_np))
+                    stored_bytes += mask_np.nbytes
 
                 # Construction de l'objet de retour
-                objects_data.append({
+                object_data = {
                     "object_id": idx,
-                    "label": labels_map.get(idx, prompt), # Priorité au label YOLO
+                    # Priorité au label YOLO si le prompt le demande, sinon le concept lui-même
+                    "label": labels_map.get(idx, obj["prompt"]) if obj["prompt"] in labeled_prompts else obj["prompt"],
+                    "prompt": obj["prompt"],
                     "confidence": float(obj["score"]),
                     "bbox": obj["bbox"],
-                    "mask_path": str(mask_path.absolute()),
+                    "mask_path": str(mask_path.absolute()) if mask_path else None,
                     "pixels_count": int(pixel_count)
-                })
+                }
+                if return_masks:
+                    object_data["mask"] = mask_np
+                objects_data.append(object_data)
 
-            return {
-                "image_path": image_path,
-                "resolution": f"{width}x{height}",
-                "objects_count": len(objects_data),
-                "objects": objects_data,
-                "segmentation_dir": str(seg_dir.absolute())
-            }
+            result["objects_count"] = len(objects_data)
+            result["objects"] = objects_data
+
+            if sync_writes:
+                await loop.run_in_executor(None, mask_writer.write_now, sync_writes)
+
+            if indexed:
+                result["artifact_id"] = await loop.run_in_executor(
+                    None, artifact_store.record,
+                    artifact_key, generation, params, image_path, result["resolution"], result["label_map_path"],
+                    [{k: v for k, v in obj.items() if k != "mask"} for obj in objects_data],
+                    stored_bytes, job_id is None  # durable
+                )
+
+            if job_id is not None:
+                mask_writer.seal(job_id)
+                if wait_durable:
+                    await mask_writer.wait_async(job_id)
+                    result["durable"] = mask_writer.status(job_id)["durable"]
+            return result
 
         except Exception as e:
+            if job_id is not None:
+                mask_writer.seal(job_id)
+            if generation is not None and job_id is None:
+                # Résultat partiel : ni servi ni laissé sur disque hors index
+                # (avec écriture différée, le rappel du job scellé s'en charge)
+                await loop.run_in_executor(None, artifact_store.discard, artifact_key, generation)
+            if isinstance(e, (ModelNotLoadedException, ModelVariantNotFoundException)):
+                raise
             logger.error(f"❌ Erreur critique SegmentationService: {e}", exc_info=True)
             raise SegmentationException(f"Échec de la segmentation : {str(e)}")
\ No newline at end of file
@@ -5,6 +5,15 @@ from dotenv import load_dotenv
 # Charger le fichier .env s'il existe
 load_dotenv()
 
+def _load_vocabulary() -> list:
+    """Vocabulaire de prompts connu : PROMPT_VOCABULARY (virgules) + PROMPT_VOCABULARY_FILE (une ligne par prompt)"""
+    prompts = [p.strip() for p in os.getenv("PROMPT_VOCABULARY", "").split(",") if p.strip()]
+    vocabulary_file = os.getenv("PROMPT_VOCABULARY_FILE")
+    if vocabulary_file and os.path.exists(vocabulary_file):
+        with open(vocabulary_file, encoding="utf-8") as f:
+            prompts += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return prompts
+
 class Settings:
     """Configuration globale de l'application SEGMA"""
     
@@ -23,20 +32,129 @@ class Settings:
     # On laisse le choix du device (cpu, cuda, mps pour Mac)
     SAM3_MODEL_ID = os.getenv("SAM3_MODEL_ID", "facebook/sam3")
     DEVICE = os.getenv("DEVICE", "cuda") # Par défaut cuda en 2026 pour SAM 3
+    # Variantes chargeables simultanément, format 'nom=checkpoint[:précision]' séparé par des virgules
+    # (ex: "default=facebook/sam3,fp16=facebook/sam3:float16")
+    SAM3_MODEL_VARIANTS = os.getenv("SAM3_MODEL_VARIANTS", f"default={SAM3_MODEL_ID}")
+    SAM3_DEFAULT_VARIANT = os.getenv("SAM3_DEFAULT_VARIANT", "default")
+    # Budget mémoire des poids chargés (Mo) ; au-delà, les variantes inactives les moins
+    # récemment utilisées sont déchargées. 0 = illimité
+    MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", 0))
+    # Attente maximale (secondes) de la fin des requêtes en cours avant libération d'un modèle
+    MODEL_DRAIN_TIMEOUT = float(os.getenv("MODEL_DRAIN_TIMEOUT", 60))
+    # Délai (secondes) avant une nouvelle tentative après un échec de chargement ;
+    # entre-temps les requêtes échouent immédiatement (rechargement admin possible)
+    MODEL_LOAD_RETRY_S = float(os.getenv("MODEL_LOAD_RETRY_S", 300))
+    
+    # --- Cache des embeddings textuels ---
+    TEXT_EMBEDDING_CACHE_SIZE = int(os.getenv("TEXT_EMBEDDING_CACHE_SIZE", 2048))
+    # Prompts précalculés au démarrage (vocabulaire d'inspection connu)
+    PROMPT_VOCABULARY = _load_vocabulary()
+    TEXT_WARMUP_BATCH_SIZE = int(os.getenv("TEXT_WARMUP_BATCH_SIZE", 32))
     
     # --- YOLO Configuration ---
     YOLO_MODEL = os.getenv("YOLO_MODEL", "yolov8n.pt")
+    YOLO_CONFIDENCE = float(os.getenv("YOLO_CONFIDENCE", 0.2))
+    YOLO_IMGSZ = int(os.getenv("YOLO_IMGSZ", 640))
+    # Politique d'étiquetage : 'off', 'always' ou 'generic' (seulement si le prompt est générique)
+    YOLO_LABELING = os.getenv("YOLO_LABELING", "generic").lower()
+    YOLO_GENERIC_PROMPTS = [
+        p.strip().lower() for p in os.getenv(
+            "YOLO_GENERIC_PROMPTS",
+            "object,objects,objet,objets,thing,things,everything,all,tout,tous les objets,all objects"
+        ).split(",") if p.strip()
+    ]
+    # Nombre d'images dont les détections YOLO sont gardées en cache (clé: hash de l'image)
+    YOLO_CACHE_SIZE = int(os.getenv("YOLO_CACHE_SIZE", 64))
+    
+    # --- Post-traitement des masques ---
+    # Seuil d'IoU au-delà duquel deux masques sont considérés comme doublons
+    MASK_NMS_IOU_THRESHOLD = float(os.getenv("MASK_NMS_IOU_THRESHOLD", 0.7))
+    # Surface minimale (pixels) d'un masque conservé (filtrage du bruit)
+    MASK_MIN_PIXELS = int(os.getenv("MASK_MIN_PIXELS", 100))
     
     # --- File Handling ---
     MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 100 * 1024 * 1024))  # Augmenté à 100MB
+    
+    # --- Contrôle d'admission (mémoire estimée par requête) ---
+    # Budget mémoire global partagé par les requêtes de segmentation en cours
+    ADMISSION_MEMORY_BUDGET_MB = int(os.getenv("ADMISSION_MEMORY_BUDGET_MB", 4096))
+    # Nombre de masques attendus par prompt pour l'estimation du coût
+    ADMISSION_EXPECTED_MASKS = int(os.getenv("ADMISSION_EXPECTED_MASKS", 16))
+    # Attente maximale (secondes) d'une requête en file avant rejet (503)
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 32))
+    # Période d'échantillonnage (ms) de la mémoire pendant une requête (X-Segma-Peak-Memory-MB)
+    RESOURCE_SAMPLE_INTERVAL_MS = float(os.getenv("RESOURCE_SAMPLE_INTERVAL_MS", 10))
     BASE_DIR = Path(__file__).resolve().parent.parent
     UPLOAD_DIR = os.getenv("UPLOAD_DIR", str(BASE_DIR / "data" / "uploads"))
     OUTPUT_DIR = os.getenv("OUTPUT_DIR", str(BASE_DIR / "data" / "masks"))
+    CACHE_DIR = os.getenv("CACHE_DIR", str(BASE_DIR / "data" / "cache"))
+    # Persistance du cache d'embeddings entre redémarrages (vide = désactivée)
+    TEXT_EMBEDDING_CACHE_PATH = os.getenv(
+        "TEXT_EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "text_embeddings.pt")
+    )
+    
+    # --- Autotune des threads d'inférence (CPU) ---
+    # Réglage persisté par empreinte machine, appliqué au démarrage avant le chargement des modèles
+    AUTOTUNE_ENABLED = os.getenv("AUTOTUNE_ENABLED", "True").lower() == "true"
+    # Mesure au démarrage si aucun réglage n'existe pour cette machine (sinon : python main.py --autotune)
+    AUTOTUNE_ON_STARTUP = os.getenv("AUTOTUNE_ON_STARTUP", "False").lower() == "true"
+    AUTOTUNE_CACHE_PATH = os.getenv("AUTOTUNE_CACHE_PATH", os.path.join(CACHE_DIR, "autotune.json"))
+    # Nombres de threads testés (vide = tous les cœurs puis moitiés successives)
+    AUTOTUNE_THREADS = [int(t) for t in os.getenv("AUTOTUNE_THREADS", "").split(",") if t.strip()]
+    AUTOTUNE_BATCH_SIZES = [int(b) for b in os.getenv("AUTOTUNE_BATCH_SIZES", "1,8,16,32,64").split(",") if b.strip()]
+    AUTOTUNE_IMAGE_SIZE = int(os.getenv("AUTOTUNE_IMAGE_SIZE", 1024))
+    AUTOTUNE_PROMPT = os.getenv("AUTOTUNE_PROMPT", "objet")
+    AUTOTUNE_REPEATS = int(os.getenv("AUTOTUNE_REPEATS", 3))
+    
+    # Persistance différée des masques (write-behind) : la réponse n'attend pas le disque
+    MASK_WRITE_BEHIND = os.getenv("MASK_WRITE_BEHIND", "True").lower() == "true"
+    MASK_WRITER_WORKERS = int(os.getenv("MASK_WRITER_WORKERS", 2))
+    # Octets de masques en attente d'écriture au-delà desquels l'admission ralentit
+    MASK_WRITER_MAX_PENDING_MB = int(os.getenv("MASK_WRITER_MAX_PENDING_MB", 512))
+    # Nombre maximal de fichiers regroupés par vague de fsync
+    MASK_WRITER_FSYNC_BATCH = int(os.getenv("MASK_WRITER_FSYNC_BATCH", 32))
+    # Durée (secondes) après laquelle un job jamais scellé est oublié de l'historique
+    MASK_WRITER_JOB_TTL = float(os.getenv("MASK_WRITER_JOB_TTL", 3600))
+    
+    # Store d'artefacts : résultats rangés sous OUTPUT_DIR et indexés en SQLite
+    ARTIFACT_INDEX_PATH = os.getenv("ARTIFACT_INDEX_PATH", os.path.join(OUTPUT_DIR, "index.sqlite3"))
+    # Rétention : âge maximal depuis le dernier accès (jours) et quota disque (Mo) ; 0 = illimité
+    ARTIFACT_MAX_AGE_DAYS = float(os.getenv("ARTIFACT_MAX_AGE_DAYS", 30))
+    ARTIFACT_QUOTA_MB = int(os.getenv("ARTIFACT_QUOTA_MB", 10240))
+    # Période du ramasse-miettes en secondes (0 = désactivé)
+    ARTIFACT_GC_INTERVAL = float(os.getenv("ARTIFACT_GC_INTERVAL", 600))
+    # Un résultat consulté depuis moins de N secondes n'est jamais supprimé (lecture en cours)
+    ARTIFACT_GC_GRACE_S = float(os.getenv("ARTIFACT_GC_GRACE_S", 60))
     
     # Création automatique des dossiers si absents
-    for path in [UPLOAD_DIR, OUTPUT_DIR]:
+    for path in [UPLOAD_DIR, OUTPUT_DIR, CACHE_DIR]:
         os.makedirs(path, exist_ok=True)
     
+    # --- Administration ---
+    # Jeton requis (en-tête X-Admin-Token) pour les endpoints d'administration ; vide = désactivés
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    
+    # --- Profilage à la demande (admin) ---
+    PROFILING_DIR = os.getenv("PROFILING_DIR", str(BASE_DIR / "data" / "profiles"))
+    PROFILING_MAX_REQUESTS = int(os.getenv("PROFILING_MAX_REQUESTS", 20))
+    PROFILING_MAX_DURATION = float(os.getenv("PROFILING_MAX_DURATION", 300))
+    PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", 5))
+    PROFILING_MAX_ARTIFACTS = int(os.getenv("PROFILING_MAX_ARTIFACTS", 60))
+    
+    # --- Passerelle (mode --gateway) ---
+    # Répartit uploads et segmentations entre plusieurs nœuds SEGMA par hachage cohérent
+    GATEWAY_MODE = os.getenv("GATEWAY_MODE", "False").lower() == "true"
+    GATEWAY_NODES = [n.strip() for n in os.getenv("GATEWAY_NODES", "").split(",") if n.strip()]
+    GATEWAY_VNODES = int(os.getenv("GATEWAY_VNODES", 128))
+    # Charge maximale d'un nœud = facteur x charge moyenne (au-delà, débordement vers le nœud suivant)
+    GATEWAY_LOAD_FACTOR = float(os.getenv("GATEWAY_LOAD_FACTOR", 1.25))
+    GATEWAY_HEALTH_INTERVAL = float(os.getenv("GATEWAY_HEALTH_INTERVAL", 5))
+    GATEWAY_HEALTH_TIMEOUT = float(os.getenv("GATEWAY_HEALTH_TIMEOUT", 2))
+    GATEWAY_UNHEALTHY_AFTER = int(os.getenv("GATEWAY_UNHEALTHY_AFTER", 2))
+    GATEWAY_TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT", 300))
+    GATEWAY_PATH_INDEX_SIZE = int(os.getenv("GATEWAY_PATH_INDEX_SIZE", 100000))
+    
     # --- CORS ---
     # Autoriser localhost pour Flutter Web et l'IP du serveur pour Flutter Mobile
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:8080,*").split(",")
@@ -1,4 +1,13 @@
 import os
+import sys
+from config import settings
+
+# Mode passerelle : aucun modèle chargé, on relaie vers les nœuds SEGMA
+if __name__ == "__main__" and (settings.GATEWAY_MODE or "--gateway" in sys.argv):
+    from app.gateway import run_gateway
+    run_gateway()
+    sys.exit(0)
+
 import torch
 import logging
 import uvicorn
@@ -15,9 +24,14 @@ else:
     device_status = f"🎮 GPU: {torch.cuda.get_device_name(0)}"
 
 # Import local de tes modules harmonisés
-from app.models.model_manager import model_manager
+from app.models.model_manager import model_registry
+from app.models.sam3.text_embedding_cache import text_embedding_cache
+from app.services.autotune import runtime_tuner
+from app.services.object_detector import get_object_detector
+from app.services.mask_writer import mask_writer
+from app.services.artifact_store import artifact_store
 from app.api.endpoints import segment_router # Ton futur fichier de routes
-from config import settings
+from app.services.admission import RESOURCE_HEADERS
 
 # Configuration du logging
 logging.basicConfig(
@@ -35,14 +49,42 @@ async def lifespan(app: FastAPI):
     
     # Pré-chargement du modèle SAM 3 via le manager pour éviter la latence à la 1ère requête
     logger.info(f"Système détecté : {device_status}")
+    # Threads d'inférence réglés pour cette machine, avant tout calcul torch
+    tuned = settings.AUTOTUNE_ENABLED and runtime_tuner.apply_saved()
     try:
-        model_info = model_manager.get_model_info()
+        model_registry.load()
+        model_info = model_registry.get_model_info()
         logger.info(f"✓ Modèle {model_info['model_type']} prêt sur {model_info['device']}")
     except Exception as e:
         logger.error(f"❌ Échec de l'initialisation du modèle : {e}")
 
+    if settings.AUTOTUNE_ENABLED and settings.AUTOTUNE_ON_STARTUP and not tuned and model_registry.is_loaded:
+        try:
+            runtime_tuner.tune(model_registry.get_model(), get_object_detector())
+        except Exception as e:
+            logger.error(f"❌ Échec de l'autotune : {e}")
+
+    # Cache des embeddings textuels : rechargement + précalcul du vocabulaire connu
+    text_embedding_cache.load()
+    if settings.PROMPT_VOCABULARY and model_registry.is_loaded:
+        try:
+            computed = model_registry.get_model().warm_up_text(
+                settings.PROMPT_VOCABULARY, batch_size=runtime_tuner.text_batch_size
+            )
+            if computed:
+                text_embedding_cache.save()
+        except Exception as e:
+            logger.error(f"❌ Échec du précalcul des embeddings textuels : {e}")
+
+    # Rétention des résultats indexés (âge + quota) en tâche de fond
+    artifact_store.start()
+
     yield
     
+    text_embedding_cache.save()
+    # Vidage de la file d'écriture des masques avant l'arrêt
+    mask_writer.stop()
+    artifact_store.stop()
     logger.info("🛑 Arrêt du serveur SEGMA...")
 
 app = FastAPI(
@@ -59,6 +101,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=RESOURCE_HEADERS,
 )
 
 # Inclusion des routes
@@ -82,6 +125,10 @@ async def generic_exception_handler(request, exc):
     )
 
 if __name__ == "__main__":
+    if "--autotune" in sys.argv:
+        from app.services.autotune import main as autotune_main
+        autotune_main()
+        sys.exit(0)
     uvicorn.run(
         "main:app",
         host=settings.HOST,
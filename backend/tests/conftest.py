@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Les tests importent les modules du backend comme main.py (racine = backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,123 @@
+"""Contrôle d'admission : modèle de coût, décisions 413/503, mesure du pic mémoire par requête"""
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from app.exceptions import AdmissionRejectedException, AdmissionTimeoutException
+from app.services.admission import (
+    MB, SAM3_INPUT_BYTES, AdmissionController, ResourceMeter, estimate_request_memory
+)
+
+
+def test_estimate_request_memory():
+    pixels = 1000 * 500
+    assert estimate_request_memory(1000, 500, prompts=1, expected_masks=0) == pixels * 6 + SAM3_INPUT_BYTES
+    one = estimate_request_memory(1000, 500, prompts=1, expected_masks=4)
+    two = estimate_request_memory(1000, 500, prompts=2, expected_masks=4)
+    assert one == pixels * 6 + SAM3_INPUT_BYTES + pixels * 6 * 4
+    assert two - one == pixels * 6 * 4
+    # Zéro prompt supplémentaire compte comme un prompt
+    assert estimate_request_memory(1000, 500, prompts=0, expected_masks=4) == one
+
+
+def test_admit_rejects_request_larger_than_budget():
+    controller = AdmissionController(budget_bytes=100 * MB, queue_timeout=1, max_queue=4)
+
+    async def run():
+        async with controller.admit(101 * MB):
+            pass
+
+    with pytest.raises(AdmissionRejectedException):
+        asyncio.run(run())
+    assert controller.in_use == 0
+
+
+def test_admit_waits_for_budget_then_releases():
+    controller = AdmissionController(budget_bytes=100 * MB, queue_timeout=2, max_queue=4)
+    order = []
+
+    async def request(name, cost, hold):
+        async with controller.admit(cost) as queue_time:
+            order.append((name, round(queue_time, 1)))
+            await asyncio.sleep(hold)
+
+    async def run():
+        first = asyncio.create_task(request("first", 80 * MB, 0.2))
+        await asyncio.sleep(0.05)
+        assert controller.in_use == 80 * MB
+        await request("second", 50 * MB, 0)
+        await first
+
+    asyncio.run(run())
+    assert [name for name, _ in order] == ["first", "second"]
+    assert order[1][1] >= 0.1  # a attendu la libération du premier
+    assert controller.in_use == 0 and controller.waiting == 0
+
+
+def test_admit_times_out_when_budget_stays_saturated():
+    controller = AdmissionController(budget_bytes=100 * MB, queue_timeout=0.1, max_queue=4)
+
+    async def run():
+        async with controller.admit(90 * MB):
+            with pytest.raises(AdmissionTimeoutException):
+                async with controller.admit(20 * MB):
+                    pass
+            assert controller.waiting == 0
+
+    asyncio.run(run())
+    assert controller.in_use == 0
+
+
+def test_admit_rejects_when_queue_is_full():
+    controller = AdmissionController(budget_bytes=100 * MB, queue_timeout=1, max_queue=1)
+
+    async def waiter():
+        async with controller.admit(50 * MB):
+            pass
+
+    async def run():
+        async with controller.admit(100 * MB):
+            queued = asyncio.create_task(waiter())
+            await asyncio.sleep(0.05)
+            assert controller.waiting == 1
+            with pytest.raises(AdmissionTimeoutException, match="pleine"):
+                async with controller.admit(10 * MB):
+                    pass
+        await queued
+
+    asyncio.run(run())
+    assert controller.get_stats() == {"budget_mb": 100.0, "in_use_mb": 0.0, "waiting": 0}
+
+
+@pytest.mark.skipif(ResourceMeter._current_rss() is None, reason="RSS courant indisponible (/proc)")
+def test_resource_meter_reports_request_peak_not_lifetime_peak():
+    # Pic antérieur plus élevé : ru_maxrss le garderait, l'échantillonnage non
+    big = np.ones(256 * MB // 8)
+    del big
+
+    with ResourceMeter() as meter:
+        buffer = np.ones(64 * MB // 8)
+        time.sleep(0.05)
+        del buffer
+
+    assert meter.scope == "request"
+    assert 48 * MB <= meter.peak_memory < 200 * MB
+    assert meter.compute_time >= 0.05
+    assert not ResourceMeter._active
+
+
+@pytest.mark.skipif(ResourceMeter._current_rss() is None, reason="RSS courant indisponible (/proc)")
+def test_resource_meter_marks_overlapping_requests_as_process_scope():
+    first = ResourceMeter().__enter__()
+    second = ResourceMeter().__enter__()
+    second.__exit__(None, None, None)
+    first.__exit__(None, None, None)
+    assert first.scope == second.scope == "process"
+
+    with ResourceMeter() as alone:
+        pass
+    assert alone.scope == "request"
@@ -0,0 +1,183 @@
+"""Store d'artefacts : index SQLite, générations, rappels d'écriture et ramasse-miettes"""
+import os
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.artifact_store import ArtifactStore, compute_params_key, prompt_slug
+
+KEY = ("ab" * 32, "Boulons rouillés", compute_params_key({"prompts": ["Boulons rouillés"]}))
+OTHER_KEY = ("cd" * 32, "voiture", compute_params_key({"prompts": ["voiture"]}))
+OBJECTS = [{"object_id": 0, "label": "boulon", "mask_path": "mask_0.bin"}]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ArtifactStore(
+        root=str(tmp_path / "masks"), index_path=str(tmp_path / "masks" / "index.sqlite3"),
+        max_age_s=3600, quota_bytes=0, gc_interval=0, gc_grace_s=0
+    )
+    yield store
+    store.stop()
+
+
+def _write(store, key, size=10, durable=True, generation=None):
+    """Simule un calcul : dossier de la génération, fichier de masque puis indexation"""
+    generation = generation or store.new_generation()
+    directory = store.artifact_dir(key, generation)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "mask_0.bin"), "wb") as f:
+        f.write(b"\xff" * size)
+    artifact_id = store.record(key, generation, {"p": 1}, "/tmp/a.png", "4x4", None, OBJECTS, size, durable)
+    return generation, directory, artifact_id
+
+
+def _age(store, key, seconds):
+    with store._lock:
+        store.conn.execute(
+            "UPDATE artifacts SET last_access = last_access - ? WHERE image_hash = ? AND prompt = ? AND params_key = ?",
+            (seconds, *key)
+        )
+        store.conn.commit()
+
+
+def test_prompt_slug_and_params_key():
+    assert prompt_slug("Boulons rouillés") == "boulons-rouilles"
+    assert prompt_slug("???") == "prompt"
+    assert compute_params_key({"a": 1, "b": 2}) == compute_params_key({"b": 2, "a": 1})
+    assert compute_params_key({"a": 1}) != compute_params_key({"a": 2})
+
+
+def test_lookup_serves_only_durable_entries(store):
+    assert store.lookup(KEY) is None
+    generation, directory, artifact_id = _write(store, KEY, durable=False)
+    assert store.lookup(KEY) is None
+
+    store.on_job_complete(KEY, generation)(SimpleNamespace(failed=0))
+    entry = store.lookup(KEY)
+    assert entry["id"] == artifact_id
+    assert entry["directory"] == directory
+    assert entry["objects"] == OBJECTS and entry["durable"] is True
+    assert os.path.basename(directory) == f"boulons-rouilles-{KEY[2]}-{generation}"
+
+
+def test_lookup_refreshes_last_access(store):
+    _write(store, KEY)
+    _age(store, KEY, 100)
+    before = store.query()[0]["last_access"]
+    store.lookup(KEY)
+    assert store.query()[0]["last_access"] > before
+
+
+def test_upsert_replaces_generation_and_removes_previous_files(store):
+    first_gen, first_dir, first_id = _write(store, KEY)
+    second_gen, second_dir, second_id = _write(store, KEY, size=20)
+
+    assert second_id == first_id
+    assert not os.path.exists(first_dir)
+    entry = store.lookup(KEY)
+    assert entry["generation"] == second_gen and entry["size_bytes"] == 20
+    assert store.get_stats()["artifacts"] == 1
+
+
+def test_stale_failure_callback_keeps_newer_generation(store):
+    old_gen, old_dir, _ = _write(store, KEY, durable=False)
+    new_gen, new_dir, _ = _write(store, KEY, durable=True)
+
+    store.on_job_complete(KEY, old_gen)(SimpleNamespace(failed=1))
+    entry = store.lookup(KEY)
+    assert entry is not None and entry["generation"] == new_gen
+    assert os.path.exists(os.path.join(new_dir, "mask_0.bin"))
+    assert not os.path.exists(old_dir)
+
+
+def test_stale_success_callback_does_not_mark_pending_generation(store):
+    old_gen, old_dir, _ = _write(store, KEY, durable=False)
+    new_gen, new_dir, _ = _write(store, KEY, durable=False)
+
+    store.on_job_complete(KEY, old_gen)(SimpleNamespace(failed=0))
+    assert store.lookup(KEY) is None  # la génération courante est toujours en écriture
+    assert not os.path.exists(old_dir)
+    assert os.path.exists(new_dir)
+
+    store.on_job_complete(KEY, new_gen)(SimpleNamespace(failed=0))
+    assert store.lookup(KEY)["generation"] == new_gen
+
+
+def test_failure_callback_discards_current_generation(store):
+    generation, directory, _ = _write(store, KEY, durable=False)
+    store.on_job_complete(KEY, generation)(SimpleNamespace(failed=1))
+    assert store.query() == []
+    # Les dossiers de l'image et du préfixe, devenus vides, sont retirés aussi
+    assert not os.path.exists(os.path.join(store.root, KEY[0][:2]))
+
+
+def test_delete_by_id(store):
+    _, directory, artifact_id = _write(store, KEY)
+    assert store.delete(artifact_id)
+    assert not store.delete(artifact_id)
+    assert not os.path.exists(directory)
+
+
+def test_collect_expires_old_entries(store):
+    _, old_dir, _ = _write(store, KEY)
+    _, fresh_dir, _ = _write(store, OTHER_KEY)
+    _age(store, KEY, store.max_age_s + 1)
+
+    assert store.collect() == {"expired": 1, "evicted": 0, "freed_bytes": 10}
+    assert not os.path.exists(old_dir) and os.path.exists(fresh_dir)
+
+
+def test_collect_evicts_least_recently_used_over_quota(store):
+    store.quota_bytes = 25
+    _, lru_dir, _ = _write(store, KEY, size=20)
+    _, mru_dir, _ = _write(store, OTHER_KEY, size=20)
+    _age(store, KEY, 20)
+    _age(store, OTHER_KEY, 10)
+
+    result = store.collect()
+    assert result["evicted"] == 1
+    assert not os.path.exists(lru_dir) and os.path.exists(mru_dir)
+
+
+def test_collect_spares_pending_and_recently_read_entries(store):
+    store.quota_bytes = 1
+    store.gc_grace_s = 60
+    _write(store, KEY, size=20, durable=False)
+    _, read_dir, _ = _write(store, OTHER_KEY, size=20)
+    _age(store, OTHER_KEY, 120)
+    store.lookup(OTHER_KEY)  # lecture en cours : protégée par la période de grâce
+
+    assert store.collect()["evicted"] == 0
+    assert os.path.exists(read_dir)
+
+
+def test_existing_index_without_generation_is_migrated(tmp_path):
+    index_path = tmp_path / "index.sqlite3"
+    conn = sqlite3.connect(index_path)
+    conn.execute(
+        "CREATE TABLE artifacts (id INTEGER PRIMARY KEY AUTOINCREMENT, image_hash TEXT NOT NULL, "
+        "prompt TEXT NOT NULL, params_key TEXT NOT NULL, params TEXT NOT NULL, image_path TEXT, resolution TEXT, "
+        "directory TEXT NOT NULL, label_map_path TEXT, objects TEXT NOT NULL, size_bytes INTEGER NOT NULL DEFAULT 0, "
+        "durable INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, last_access REAL NOT NULL, "
+        "UNIQUE (image_hash, prompt, params_key))"
+    )
+    conn.commit()
+    conn.close()
+
+    store = ArtifactStore(str(tmp_path), str(index_path), 0, 0, 0)
+    try:
+        _write(store, KEY)
+        assert store.lookup(KEY)["generation"]
+    finally:
+        store.stop()
+
+
+def test_gc_thread_start_stop(store):
+    store.gc_interval = 0.01
+    store.start()
+    time.sleep(0.05)
+    store.stop()
+    assert store._gc_thread is None
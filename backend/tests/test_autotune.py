@@ -0,0 +1,83 @@
+"""Autotune des threads : candidats, empreinte machine stable, persistance et réapplication du réglage"""
+import json
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.services import autotune
+from app.services.autotune import RuntimeTuner, cv2_threads_for, fingerprint_id, thread_candidates
+from config import settings
+
+
+@pytest.fixture
+def restore_threads():
+    threads = torch.get_num_threads()
+    yield
+    torch.set_num_threads(threads)
+
+
+def test_thread_candidates_halve_down_to_one(monkeypatch):
+    monkeypatch.setattr(settings, "AUTOTUNE_THREADS", [])
+    assert thread_candidates(16) == [16, 8, 4, 2, 1]
+    assert thread_candidates(6) == [6, 3, 1]
+    assert thread_candidates(1) == [1]
+
+
+def test_thread_candidates_from_config(monkeypatch):
+    monkeypatch.setattr(settings, "AUTOTUNE_THREADS", [12, 4])
+    assert thread_candidates(16) == [12, 4]
+
+
+def test_cv2_threads_take_the_remaining_cores():
+    assert cv2_threads_for(8, 6) == 2
+    assert cv2_threads_for(8, 8) == 1
+
+
+def test_fingerprint_ignores_kernel_and_python_versions(monkeypatch):
+    before = fingerprint_id(autotune.machine_fingerprint())
+    monkeypatch.setattr(autotune.platform, "platform", lambda *args, **kwargs: "Linux-6.99.1-patched")
+    monkeypatch.setattr(autotune.platform, "python_version", lambda: "3.99.0")
+    assert fingerprint_id(autotune.machine_fingerprint()) == before
+
+    monkeypatch.setattr(autotune, "cpu_model", lambda: "Autre CPU")
+    assert fingerprint_id(autotune.machine_fingerprint()) != before
+
+
+def test_saved_config_round_trip(tmp_path, restore_threads):
+    cache_path = str(tmp_path / "autotune" / "autotune.json")
+    config = {
+        "intra_op_threads": 2,
+        "inter_op_threads": 1,
+        "cv2_threads": 1,
+        "text_batch_size": 16,
+        "latency_ms": 120.0,
+        "tuned_at": 0.0,
+    }
+    tuner = RuntimeTuner(cache_path)
+    assert tuner.saved_config() is None and not tuner.apply_saved()
+    tuner._write_cache({"fingerprint": tuner.fingerprint, "config": config})
+
+    # Nouveau processus sur la même machine : le réglage est retrouvé et appliqué
+    restarted = RuntimeTuner(cache_path)
+    assert restarted.saved_config() == config
+    assert restarted.apply_saved()
+    assert restarted.source == "cache"
+    assert torch.get_num_threads() == 2
+    assert restarted.text_batch_size == 16
+    assert restarted.status()["fingerprint"] == tuner.fingerprint_id
+
+
+def test_saved_config_of_another_machine_is_ignored(tmp_path):
+    cache_path = tmp_path / "autotune.json"
+    cache_path.write_text(json.dumps({"0123456789abcdef": {"config": {"intra_op_threads": 64}}}))
+    tuner = RuntimeTuner(str(cache_path))
+    assert not tuner.apply_saved()
+    assert tuner.source == "default"
+    assert tuner.text_batch_size == settings.TEXT_WARMUP_BATCH_SIZE
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    cache_path = tmp_path / "autotune.json"
+    cache_path.write_text("{ tronqué")
+    assert RuntimeTuner(str(cache_path)).saved_config() is None
@@ -0,0 +1,161 @@
+"""Aller-retour des réponses binaires de /segment (multipart et msgpack)"""
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("cv2")
+
+
+def _load_binary_protocol():
+    # Chargé par son chemin : importer app.api chargerait SAM 3 et YOLO via les routes
+    path = Path(__file__).resolve().parent.parent / "app" / "api" / "binary_protocol.py"
+    spec = importlib.util.spec_from_file_location("binary_protocol", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+binary_protocol = _load_binary_protocol()
+
+HEIGHT, WIDTH = 6, 9
+
+
+def _result():
+    first = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    first[1:4, 2:6] = 255
+    second = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    second[0, 0] = 255
+    second[3:6, 5:9] = 255
+    label_map = np.zeros((HEIGHT, WIDTH), dtype=np.uint16)
+    label_map[first > 0] = 1
+    label_map[second > 0] = 300  # > 255 : vérifie l'ordre des octets
+    objects = []
+    for idx, (mask, bbox) in enumerate([
+        (first, {"x1": 2, "y1": 1, "x2": 5, "y2": 3}),
+        (second, {"x1": 0, "y1": 0, "x2": 8, "y2": 5}),
+    ]):
+        objects.append({
+            "object_id": idx, "label": "objet", "prompt": "objet", "confidence": 0.9,
+            "bbox": bbox, "mask_path": None, "pixels_count": int(np.count_nonzero(mask)), "mask": mask,
+        })
+    return {
+        "image_path": "/tmp/image.png", "resolution": f"{WIDTH}x{HEIGHT}",
+        "objects_count": len(objects), "objects": objects, "label_map": label_map,
+    }
+
+
+def _decode_rle(payload: bytes) -> np.ndarray:
+    counts = np.frombuffer(payload, dtype="<u4")
+    values = np.arange(len(counts)) % 2
+    return np.repeat(values, counts).astype(bool).reshape(HEIGHT, WIDTH)
+
+
+def _decode_packed(payload: bytes, bbox: dict) -> np.ndarray:
+    h, w = bbox["y2"] - bbox["y1"] + 1, bbox["x2"] - bbox["x1"] + 1
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))[:h * w]
+    return bits.astype(bool).reshape(h, w)
+
+
+def _parse_multipart(body: bytes, boundary: str):
+    closing = f"--{boundary}--\r\n".encode()
+    assert body.endswith(closing)
+    parts = []
+    for part in body[:-len(closing)].split(f"--{boundary}\r\n".encode())[1:]:
+        head, _, payload = part.partition(b"\r\n\r\n")
+        assert payload.endswith(b"\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        parts.append((headers, payload[:-2]))
+    return parts
+
+
+def _check_masks(result, header, payloads, encoding):
+    assert header["mask_encoding"] == encoding
+    assert [obj["object_id"] for obj in header["objects"]] == [0, 1]
+    for obj, payload in zip(result["objects"], payloads):
+        if encoding == "rle":
+            np.testing.assert_array_equal(_decode_rle(payload), obj["mask"] > 0)
+        else:
+            bbox = obj["bbox"]
+            crop = obj["mask"][bbox["y1"]:bbox["y2"] + 1, bbox["x1"]:bbox["x2"] + 1]
+            np.testing.assert_array_equal(_decode_packed(payload, bbox), crop > 0)
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("application/json", None),
+    ("application/x-msgpack", "msgpack"),
+    ("application/msgpack, multipart/mixed", "msgpack"),
+    ("multipart/mixed;q=0.9, application/x-msgpack", "msgpack"),
+    ("application/x-msgpack;q=0.5, multipart/mixed", "multipart"),
+    ("application/x-msgpack;q=0.5, multipart/mixed;q=0.5", "msgpack"),
+    ("application/json;q=0.1, MULTIPART/MIXED; q=0.8", "multipart"),
+    ("application/x-msgpack;q=0, */*", None),
+    ("application/x-msgpack;q=0", None),
+    ("application/x-msgpack;q=abc, multipart/mixed;q=0.2", "multipart"),
+    ("text/html, image/png", None),
+])
+def test_negotiate_honors_q_values(accept, expected):
+    assert binary_protocol.negotiate(accept) == expected
+
+
+@pytest.mark.parametrize("encoding", ["rle", "packed"])
+def test_multipart_parts_are_bytes_and_round_trip(encoding):
+    import json
+
+    result = _result()
+    boundary = "segma-test"
+    chunks = list(binary_protocol._multipart_parts(result, encoding, boundary))
+    # Starlette 0.27 appelle .encode() sur tout morceau qui n'est pas bytes
+    assert all(type(chunk) is bytes for chunk in chunks)
+
+    parts = _parse_multipart(b"".join(chunks), boundary)
+    (json_headers, json_payload), *mask_parts, (map_headers, map_payload) = parts
+    assert json_headers["Content-Type"] == "application/json"
+    header = json.loads(json_payload)
+    assert header["label_map_dtype"] == "<u2"
+    assert all("mask" not in obj for obj in header["objects"])
+
+    assert [h["Content-ID"] for h, _ in mask_parts] == ["<mask-0>", "<mask-1>"]
+    assert all(h["X-Mask-Encoding"] == encoding for h, _ in mask_parts)
+    _check_masks(result, header, [payload for _, payload in mask_parts], encoding)
+
+    assert map_headers["Content-ID"] == "<label-map>"
+    label_map = np.frombuffer(map_payload, dtype="<u2").reshape(HEIGHT, WIDTH)
+    np.testing.assert_array_equal(label_map, result["label_map"])
+
+
+def test_multipart_response_streams_through_starlette():
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    result = _result()
+    app = FastAPI()
+
+    @app.get("/segment")
+    def segment():
+        return binary_protocol.build_multipart_response(result, "rle", {"X-Segma-Queue-Time-Ms": "0"})
+
+    response = TestClient(app).get("/segment")
+    assert response.status_code == 200
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/mixed; boundary=")
+    parts = _parse_multipart(response.content, content_type.split("boundary=", 1)[1])
+    assert len(parts) == 1 + len(result["objects"]) + 1
+    np.testing.assert_array_equal(_decode_rle(parts[1][1]), result["objects"][0]["mask"] > 0)
+
+
+@pytest.mark.parametrize("encoding", ["rle", "packed"])
+def test_msgpack_round_trip(encoding):
+    msgpack = pytest.importorskip("msgpack")
+
+    result = _result()
+    response = binary_protocol.build_msgpack_response(result, encoding, {})
+    payload = msgpack.unpackb(response.body, raw=False)
+
+    _check_masks(result, payload, [obj["mask"] for obj in payload["objects"]], encoding)
+    label_map = np.frombuffer(payload["label_map"], dtype="<u2").reshape(HEIGHT, WIDTH)
+    np.testing.assert_array_equal(label_map, result["label_map"])
@@ -0,0 +1,141 @@
+"""Passerelle : affinité upload -> segment, routes propres à un nœud, santé (nœuds simulés par httpx.MockTransport)"""
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("fastapi")
+
+from fastapi.testclient import TestClient
+
+from app.gateway import app as gateway
+from config import settings
+
+NODES = [f"http://node-{name}:8000" for name in "abc"]
+ADMIN = {"X-Admin-Token": "secret"}
+
+
+class FakeNodes:
+    """Nœuds SEGMA simulés : chaque requête est journalisée avec le nœud qui la reçoit"""
+
+    def __init__(self):
+        self.calls = []
+        self.health = {node: {"status": "healthy", "model_loaded": True} for node in NODES}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        node = f"{request.url.scheme}://{request.url.host}:{request.url.port}"
+        path = request.url.path
+        self.calls.append((node, request.method, path))
+        if path == "/api/v3/health":
+            return httpx.Response(200, json=self.health[node])
+        if path == "/api/v3/upload":
+            key = request.headers["X-Segma-Image-Hash"]
+            return httpx.Response(200, json={"image_path": f"/srv/uploads/{key}/photo.png"})
+        if path == "/api/v3/segment":
+            return httpx.Response(200, json={"objects": [], "served_by": node})
+        return httpx.Response(200, json={"node": node, "path": path})
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    fake = FakeNodes()
+    monkeypatch.setattr(gateway, "pool", gateway.NodePool())
+    monkeypatch.setattr(gateway, "client", httpx.AsyncClient(transport=httpx.MockTransport(fake)))
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    for node in NODES:
+        gateway.pool.join(node)
+    asyncio.run(gateway.pool.check_all(gateway.client))
+    return fake
+
+
+@pytest.fixture
+def api(nodes):
+    # Sans `with` : pas de lifespan, le client httpx simulé reste en place
+    return TestClient(gateway.app)
+
+
+def _upload(api, content: bytes, name="photo.png"):
+    return api.post("/api/v3/upload", files={"file": (name, content, "image/png")})
+
+
+def test_image_key_from_upload_path():
+    key = "f" * 64
+    assert gateway.image_key(f"/srv/uploads/{key}/photo.png") == key
+    assert gateway.image_key(f"C:\\uploads\\{key}\\photo.png") == key
+    assert gateway.image_key("/srv/uploads/photo.png") is None
+    assert gateway.image_key(None) is None
+
+
+def test_upload_then_segment_stick_to_the_same_node(api, nodes):
+    for i in range(10):
+        content = f"image {i}".encode()
+        upload = _upload(api, content)
+        assert upload.status_code == 200
+        key = hashlib.sha256(content).hexdigest()
+        assert upload.headers["X-Segma-Image-Hash"] == key
+        node = upload.headers["X-Segma-Node"]
+        assert node == gateway.pool.router.owner(key)
+
+        image_path = upload.json()["image_path"]
+        segment = api.post("/api/v3/segment", json={"image_path": image_path, "prompt": "objet"})
+        assert segment.status_code == 200
+        assert segment.json()["served_by"] == node == segment.headers["X-Segma-Node"]
+
+        # Passerelle redémarrée (index des chemins perdu) : la clé du chemin suffit
+        gateway.pool.paths.clear()
+        segment = api.post("/api/v3/segment", json={"image_path": image_path, "prompt": "objet"})
+        assert segment.json()["served_by"] == node
+
+
+def test_same_image_always_goes_to_the_same_node(api):
+    nodes = {_upload(api, b"same bytes", name=f"copy-{i}.png").headers["X-Segma-Node"] for i in range(5)}
+    assert len(nodes) == 1
+
+
+def test_segment_rejects_paths_not_uploaded_through_gateway(api):
+    response = api.post("/api/v3/segment", json={"image_path": "/srv/uploads/photo.png", "prompt": "objet"})
+    assert response.status_code == 400
+
+
+def test_node_local_routes_require_explicit_node(api, nodes):
+    assert api.get("/api/v3/admin/profiling").status_code == 400
+    assert api.get("/api/v3/artifacts").status_code == 400
+
+    for _ in range(3):
+        response = api.get("/api/v3/admin/profiling", headers={"X-Segma-Node": NODES[1]})
+        assert response.status_code == 200
+        assert response.json()["node"] == NODES[1]
+
+    assert api.get("/api/v3/admin/profiling", headers={"X-Segma-Node": "http://unknown:1"}).status_code == 404
+    # Les autres routes restent réparties entre les nœuds disponibles
+    assert api.get("/api/v3/model/info").status_code == 200
+
+
+def test_list_nodes_requires_admin(api):
+    assert api.get("/gateway/nodes").status_code == 401
+    response = api.get("/gateway/nodes", headers=ADMIN)
+    assert response.status_code == 200
+    assert sorted(node["url"] for node in response.json()) == NODES
+
+
+def test_node_without_model_leaves_the_ring(nodes, monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_UNHEALTHY_AFTER", 1)
+    nodes.health[NODES[0]] = {"status": "healthy", "model_loaded": False}
+    asyncio.run(gateway.pool.check_all(gateway.client))
+
+    assert NODES[0] not in gateway.pool.healthy_nodes()
+    assert NODES[0] not in gateway.pool.router.ring.nodes
+    assert "model_loaded=False" in gateway.pool.nodes[NODES[0]].last_error
+
+
+def test_health_check_finishing_after_leave_does_not_readd_node(nodes):
+    pool = gateway.pool
+    departed = pool.nodes[NODES[0]]
+    pool.leave(NODES[0])
+    departed.healthy = False  # le contrôle en vol voit le nœud comme « revenu »
+
+    asyncio.run(pool.check(gateway.client, departed))
+    assert NODES[0] not in pool.router.ring.nodes
+    assert NODES[0] not in pool.nodes
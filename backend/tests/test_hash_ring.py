@@ -0,0 +1,94 @@
+"""Hachage cohérent de la passerelle : stabilité de l'anneau et charge bornée"""
+import math
+
+from app.gateway.hash_ring import BoundedLoadRouter, ConsistentHashRing
+
+NODES = [f"http://127.0.0.1:800{i}" for i in range(1, 5)]
+KEYS = [f"image-{i}" for i in range(2000)]
+
+
+def _owners(ring):
+    return {key: next(ring.candidates(key)) for key in KEYS}
+
+
+def _ring(nodes=NODES):
+    ring = ConsistentHashRing(vnodes=128)
+    for node in nodes:
+        ring.add(node)
+    return ring
+
+
+def test_owner_is_deterministic_and_balanced():
+    owners = _owners(_ring())
+    assert owners == _owners(_ring(reversed(NODES)))
+    counts = [list(owners.values()).count(node) for node in NODES]
+    # 128 nœuds virtuels : chaque nœud reçoit entre la moitié et le double de sa part
+    assert all(len(KEYS) / 8 < count < len(KEYS) / 2 for count in counts)
+
+
+def test_join_only_moves_keys_to_the_new_node():
+    ring = _ring()
+    before = _owners(ring)
+    ring.add("http://127.0.0.1:8005")
+    after = _owners(ring)
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "http://127.0.0.1:8005" for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.3  # ~1/5
+
+
+def test_leave_only_moves_keys_of_the_departed_node():
+    ring = _ring()
+    before = _owners(ring)
+    ring.remove(NODES[0])
+    after = _owners(ring)
+
+    for key in KEYS:
+        if before[key] != NODES[0]:
+            assert after[key] == before[key]
+        else:
+            assert after[key] != NODES[0]
+
+    ring.add(NODES[0])
+    assert _owners(ring) == before
+
+
+def test_candidates_lists_each_node_once():
+    ring = _ring()
+    assert sorted(ring.candidates("image-1")) == sorted(NODES)
+    assert list(ConsistentHashRing().candidates("image-1")) == []
+
+
+def test_router_prefers_owner_when_idle():
+    router = BoundedLoadRouter(vnodes=64, load_factor=1.25)
+    for node in NODES:
+        router.add_node(node)
+    for key in KEYS[:50]:
+        node = router.acquire(key)
+        assert node == router.owner(key)
+        router.release(node)
+    assert all(load == 0 for load in router.loads.values())
+
+
+def test_router_caps_load_of_a_hot_key():
+    router = BoundedLoadRouter(vnodes=64, load_factor=1.25)
+    for node in NODES:
+        router.add_node(node)
+
+    owner = router.owner("hot")
+    chosen = [router.acquire("hot") for _ in range(40)]
+    total = len(chosen)
+    cap = math.ceil(1.25 * total / len(NODES))
+    assert all(load <= cap for load in router.loads.values())
+    assert chosen.count(owner) == cap - 1 or chosen.count(owner) == cap
+    # Les débordements suivent l'ordre de l'anneau à partir de la clé
+    assert set(chosen) == set(NODES)
+
+
+def test_router_without_nodes_and_removed_node():
+    router = BoundedLoadRouter()
+    assert router.acquire("image") is None
+    router.add_node(NODES[0])
+    router.add_node(NODES[1])
+    router.remove_node(NODES[0])
+    assert all(router.acquire(key) == NODES[1] for key in KEYS[:20])
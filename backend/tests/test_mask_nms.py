@@ -0,0 +1,115 @@
+"""NMS sur masques et résolution panoptique : ordre de suppression, pré-filtrage bbox, surface minimale"""
+import numpy as np
+import pytest
+
+from app.services import mask_nms as nms_module
+from app.services.mask_nms import bbox_iou_matrix, mask_nms, resolve_panoptic
+
+SHAPE = (40, 40)
+
+
+def _obj(score, x1, y1, x2, y2, shape=SHAPE, name=None):
+    """Objet rectangulaire (bornes incluses, comme SAM3Wrapper._compute_bbox_from_mask)"""
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[y1:y2 + 1, x1:x2 + 1] = 1
+    return {"mask": mask, "score": score, "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}, "name": name}
+
+
+def test_bbox_iou_matrix_inclusive_bounds():
+    boxes = np.array([[0, 0, 9, 9], [5, 0, 14, 9], [20, 20, 29, 29]])
+    iou = bbox_iou_matrix(boxes, boxes)
+    assert np.allclose(np.diag(iou), 1.0)
+    assert iou[0, 1] == pytest.approx(50 / 150)
+    assert iou[0, 2] == 0
+
+
+def test_higher_score_survives_regardless_of_input_order():
+    low = _obj(0.5, 0, 0, 9, 9, name="low")
+    high = _obj(0.9, 0, 0, 9, 10, name="high")
+    for objects in ([low, high], [high, low]):
+        kept = mask_nms(objects, iou_threshold=0.7)
+        assert [o["name"] for o in kept] == ["high"]
+
+
+def test_suppression_is_not_transitive():
+    # b recouvre a et c, mais a et c sont distincts : b supprimé par a, c conservé
+    a = _obj(0.9, 0, 0, 19, 9, name="a")
+    b = _obj(0.8, 1, 0, 20, 9, name="b")  # IoU(a, b) = IoU(b, c) = 19/21
+    c = _obj(0.7, 2, 0, 21, 9, name="c")  # IoU(a, c) = 18/22
+    kept = mask_nms([c, b, a], iou_threshold=0.85)
+    assert [o["name"] for o in kept] == ["a", "c"]
+
+
+def test_overlap_below_threshold_is_kept():
+    a = _obj(0.9, 0, 0, 9, 9, name="a")
+    b = _obj(0.8, 5, 0, 14, 9, name="b")  # IoU = 50/150
+    assert len(mask_nms([a, b], iou_threshold=0.4)) == 2
+    assert [o["name"] for o in mask_nms([a, b], iou_threshold=0.3)] == ["a"]
+
+
+def test_prefilter_skips_exact_iou_for_disjoint_boxes_and_unequal_areas(monkeypatch):
+    calls = []
+    exact = nms_module._mask_iou_against
+
+    def counting(ref_idx, candidates, *args):
+        calls.append((ref_idx, list(candidates)))
+        return exact(ref_idx, candidates, *args)
+
+    monkeypatch.setattr(nms_module, "_mask_iou_against", counting)
+    objects = [
+        _obj(0.9, 0, 0, 9, 9, name="a"),
+        _obj(0.8, 30, 30, 39, 39, name="disjoint"),   # bbox sans recouvrement
+        _obj(0.7, 0, 0, 1, 1, name="tiny"),           # aire 4 / 100 < seuil
+        _obj(0.6, 0, 0, 9, 8, name="near"),           # seul candidat réel
+    ]
+    kept = mask_nms(objects, iou_threshold=0.7)
+
+    assert calls == [(0, [3])]
+    assert [o["name"] for o in kept] == ["a", "disjoint", "tiny"]
+
+
+def test_single_object_is_returned_unchanged():
+    obj = _obj(0.9, 0, 0, 9, 9)
+    assert mask_nms([obj]) == [obj]
+    assert mask_nms([]) == []
+
+
+def test_panoptic_assigns_overlap_to_highest_score():
+    low = _obj(0.5, 0, 0, 19, 9, name="low")
+    high = _obj(0.9, 10, 0, 29, 9, name="high")
+    label_map, resolved = resolve_panoptic([low, high], SHAPE)
+
+    assert [o["name"] for o in resolved] == ["high", "low"]
+    assert (label_map[0:10, 10:30] == 1).all()
+    assert (label_map[0:10, 0:10] == 2).all()
+    assert np.count_nonzero(label_map) == 10 * 30
+    # Bbox et masque réduits à la région exclusive
+    assert resolved[1]["bbox"] == {"x1": 0, "y1": 0, "x2": 9, "y2": 9}
+    assert resolved[1]["mask"].sum() == 100
+    assert not np.logical_and(resolved[0]["mask"], resolved[1]["mask"]).any()
+
+
+def test_panoptic_drops_regions_below_min_pixels():
+    big = _obj(0.9, 0, 0, 9, 9, name="big")
+    shadowed = _obj(0.8, 0, 0, 10, 9, name="shadowed")  # 10 pixels exclusifs
+    _, resolved = resolve_panoptic([big, shadowed], SHAPE, min_pixels=10)
+    assert [o["name"] for o in resolved] == ["big", "shadowed"]
+
+    label_map, resolved = resolve_panoptic([big, shadowed], SHAPE, min_pixels=11)
+    assert [o["name"] for o in resolved] == ["big"]
+    assert set(np.unique(label_map)) == {0, 1}
+
+    # Entièrement recouvert : écarté même sans surface minimale
+    _, resolved = resolve_panoptic([big, _obj(0.1, 2, 2, 5, 5)], SHAPE)
+    assert len(resolved) == 1
+
+
+def test_panoptic_labels_beyond_uint8():
+    shape = (1, 600)
+    objects = [_obj(1.0 - i / 1000, i, 0, i, 0, shape=shape) for i in range(300)]
+    label_map, resolved = resolve_panoptic(objects, shape)
+
+    assert label_map.dtype == np.uint16
+    assert len(resolved) == 300
+    assert label_map.max() == 300
+    assert label_map[0, 299] == 300 and label_map[0, 300] == 0
@@ -0,0 +1,77 @@
+"""Écriture différée des masques : fichiers durables, historique des jobs, erreurs"""
+import os
+
+import numpy as np
+import pytest
+
+from app.services.mask_writer import MaskWriter
+
+
+@pytest.fixture
+def writer():
+    writer = MaskWriter(workers=1, max_pending_bytes=1024 * 1024, fsync_batch=4, job_history=2, job_ttl=60)
+    yield writer
+    writer.stop()
+
+
+def test_job_writes_files_and_calls_on_complete(writer, tmp_path):
+    completed = []
+    job_id = writer.create_job(on_complete=completed.append)
+    masks = [np.full((3, 4), i, dtype=np.uint8) for i in range(3)]
+    for i, mask in enumerate(masks):
+        writer.submit(job_id, str(tmp_path / f"mask_{i}.bin"), mask)
+    writer.seal(job_id)
+
+    assert writer.wait(job_id, timeout=5)
+    assert writer.status(job_id)["durable"]
+    assert [job.job_id for job in completed] == [job_id]
+    for i, mask in enumerate(masks):
+        np.testing.assert_array_equal(np.fromfile(tmp_path / f"mask_{i}.bin", dtype=np.uint8), mask.ravel())
+    # Aucun fichier temporaire ne subsiste après le renommage
+    assert sorted(os.listdir(tmp_path)) == ["mask_0.bin", "mask_1.bin", "mask_2.bin"]
+
+
+def test_failed_rename_is_reported_without_leaking_temp_files(writer, tmp_path):
+    # Le chemin final est un dossier : os.replace échoue après fsync/close
+    (tmp_path / "mask_0.bin").mkdir()
+    (tmp_path / "mask_0.bin" / "occupied").write_bytes(b"")
+    job_id = writer.create_job()
+    writer.submit(job_id, str(tmp_path / "mask_0.bin"), np.zeros(8, dtype=np.uint8))
+    writer.seal(job_id)
+
+    assert writer.wait(job_id, timeout=5)
+    status = writer.status(job_id)
+    assert status["failed"] == 1 and not status["durable"]
+    assert os.listdir(tmp_path) == ["mask_0.bin"]
+
+
+def test_unsealed_job_does_not_block_history_trim(writer):
+    abandoned = writer.create_job()  # jamais scellé (client parti)
+    finished = []
+    for _ in range(5):
+        job_id = writer.create_job()
+        writer.seal(job_id)
+        finished.append(job_id)
+
+    assert len(writer._jobs) == writer.job_history
+    assert writer.status(abandoned) is not None
+    assert writer.status(finished[-1]) is not None
+    assert writer.status(finished[0]) is None
+
+
+def test_unsealed_jobs_expire_after_ttl(writer):
+    stale = [writer.create_job() for _ in range(3)]
+    for job_id in stale:
+        writer._jobs[job_id].created_at -= writer.job_ttl + 1
+    writer.create_job()
+
+    assert len(writer._jobs) == writer.job_history
+
+
+def test_write_now_is_synchronous_and_raises_on_error(writer, tmp_path):
+    label_map = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    writer.write_now([(str(tmp_path / "label_map.bin"), label_map)])
+    np.testing.assert_array_equal(np.fromfile(tmp_path / "label_map.bin", dtype=np.uint16), label_map.ravel())
+
+    with pytest.raises(OSError):
+        writer.write_now([(str(tmp_path / "absent" / "mask_0.bin"), np.zeros(4, dtype=np.uint8))])
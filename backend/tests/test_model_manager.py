@@ -0,0 +1,233 @@
+"""Registre des variantes SAM 3 : chargement unique, échec rapide, rechargement à chaud, éviction LRU"""
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from app.exceptions import ModelNotLoadedException, ModelVariantNotFoundException
+from app.models import model_manager
+from app.models.model_manager import ModelRegistry, parse_variants
+from app.models.sam3.text_embedding_cache import text_embedding_cache
+from config import settings
+
+MB = 1024 ** 2
+
+
+class FakeWrapper:
+    """Modèle factice : seule l'empreinte mémoire et l'état de chargement comptent"""
+
+    def __init__(self, name: str, model_id: str, dtype: str, memory: int):
+        self.name, self.model_id, self.dtype = name, model_id, dtype
+        self.cache_key = f"{model_id}@{dtype}"
+        self.model = object()
+        self.is_loaded = True
+        self._memory = memory
+
+    def memory_bytes(self) -> int:
+        return self._memory
+
+
+class FakeLoader:
+    """Remplace ModelRegistry._build_wrapper ; compte les chargements, peut échouer ou ralentir"""
+
+    def __init__(self, memory: int = 100 * MB):
+        self.memory = memory
+        self.builds = []
+        self.fail = False
+        self.delay = 0.0
+
+    def __call__(self, entry, model_id, dtype):
+        self.builds.append(entry.name)
+        time.sleep(self.delay)
+        if self.fail:
+            raise ModelNotLoadedException(f"Échec du chargement de la variante '{entry.name}' ({model_id})")
+        return FakeWrapper(entry.name, model_id, dtype, self.memory)
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    loader = FakeLoader()
+    monkeypatch.setattr(
+        ModelRegistry, "_build_wrapper", lambda registry, entry, model_id, dtype: loader(entry, model_id, dtype)
+    )
+    monkeypatch.setattr(settings, "SAM3_MODEL_VARIANTS", "base=facebook/sam3,fast=facebook/sam3:bfloat16")
+    monkeypatch.setattr(settings, "SAM3_DEFAULT_VARIANT", "base")
+    monkeypatch.setattr(settings, "MODEL_MEMORY_BUDGET_MB", 0)
+    monkeypatch.setattr(settings, "MODEL_LOAD_RETRY_S", 300)
+    monkeypatch.setattr(settings, "MODEL_DRAIN_TIMEOUT", 5)
+    return loader
+
+
+@pytest.fixture
+def registry(loader):
+    return ModelRegistry()
+
+
+def _wait_eviction(registry):
+    if registry._eviction is not None:
+        registry._eviction.join(timeout=5)
+
+
+def test_parse_variants():
+    assert parse_variants("a=x, b=y:float16,,ignored") == {
+        "a": {"model_id": "x", "dtype": "float32"},
+        "b": {"model_id": "y", "dtype": "float16"},
+    }
+    with pytest.raises(ValueError):
+        parse_variants("a=x:int4")
+
+
+def test_unknown_variant(registry):
+    with pytest.raises(ModelVariantNotFoundException):
+        registry.load("absente")
+
+
+def test_concurrent_loads_build_once(registry, loader):
+    loader.delay = 0.05
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.load())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.builds == ["base"]
+    assert len({id(wrapper) for wrapper in results}) == 1
+    assert registry.is_loaded
+
+
+def test_failed_load_fails_fast_until_backoff_expires(registry, loader):
+    loader.fail = True
+    with pytest.raises(ModelNotLoadedException):
+        registry.load()
+    with pytest.raises(ModelNotLoadedException, match="nouvel essai"):
+        registry.load()
+    assert loader.builds == ["base"]
+    assert registry.list_variants()[0]["error"]
+
+    # Backoff écoulé : une seule nouvelle tentative
+    loader.fail = False
+    registry._entries["base"].failed_at -= settings.MODEL_LOAD_RETRY_S + 1
+    assert registry.load() is not None
+    assert loader.builds == ["base", "base"]
+    assert registry._entries["base"].error is None
+
+
+def test_waiters_fail_with_the_load_they_waited_for(registry, loader):
+    loader.fail = True
+    loader.delay = 0.05
+    errors = []
+
+    def load():
+        try:
+            registry.load()
+        except ModelNotLoadedException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 5
+    assert loader.builds == ["base"]
+
+
+def test_reload_bypasses_backoff(registry, loader):
+    loader.fail = True
+    with pytest.raises(ModelNotLoadedException):
+        registry.load()
+    loader.fail = False
+    wrapper = registry.reload()
+    assert registry.load() is wrapper
+    assert registry._entries["base"].error is None
+
+
+def test_hot_reload_waits_for_in_flight_requests(registry):
+    with registry.acquire() as old:
+        done = threading.Event()
+        reloaded = []
+
+        def reload():
+            reloaded.append(registry.reload(dtype="float16"))
+            done.set()
+
+        thread = threading.Thread(target=reload)
+        thread.start()
+        # Le nouveau modèle sert déjà les nouvelles requêtes...
+        deadline = time.monotonic() + 5
+        while registry._entries["base"].wrapper is old and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with registry.acquire() as new:
+            assert new is not old and new.dtype == "float16"
+        # ...mais l'ancien n'est libéré qu'après la requête en cours
+        assert not done.wait(0.1)
+        assert old.is_loaded
+
+    thread.join(timeout=5)
+    assert done.is_set()
+    assert not old.is_loaded and old.model is None
+    assert reloaded[0] is registry.load()
+
+
+def test_reload_invalidates_text_embeddings_of_the_variant(registry):
+    wrapper = registry.load()
+    other = "facebook/autre@float32"
+    for key in (wrapper.cache_key, other):
+        text_embedding_cache.put(key, "voiture", torch.zeros(1, 2, 4), torch.ones(1, 2, dtype=torch.long))
+    try:
+        registry.reload()
+        assert text_embedding_cache.get(wrapper.cache_key, "voiture") is None
+        assert text_embedding_cache.get(other, "voiture") is not None
+    finally:
+        text_embedding_cache.clear(other)
+
+
+def test_lru_unload_over_budget(registry, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_MEMORY_BUDGET_MB", 150)
+    base = registry.load("base")
+    _wait_eviction(registry)
+    registry.load("fast")
+    _wait_eviction(registry)
+
+    variants = {v["name"]: v for v in registry.list_variants()}
+    assert not variants["base"]["is_loaded"] and variants["fast"]["is_loaded"]
+    assert not base.is_loaded
+
+
+def test_busy_variant_is_not_unloaded(registry, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_MEMORY_BUDGET_MB", 150)
+    with registry.acquire("base"):
+        registry.load("fast")
+        _wait_eviction(registry)
+        assert all(v["is_loaded"] for v in registry.list_variants())
+
+
+def test_load_does_not_wait_for_eviction(registry, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_MEMORY_BUDGET_MB", 150)
+    registry.load("base")
+    _wait_eviction(registry)
+
+    release = threading.Event()
+    unload = registry.unload
+
+    def slow_unload(variant=None):
+        release.wait(5)  # drainage d'une autre variante qui s'éternise
+        unload(variant)
+
+    monkeypatch.setattr(registry, "unload", slow_unload)
+    start = time.monotonic()
+    assert registry.load("fast") is not None
+    assert time.monotonic() - start < 1
+    assert registry._entries["base"].wrapper is not None
+
+    release.set()
+    _wait_eviction(registry)
+    assert registry._entries["base"].wrapper is None
+
+
+def test_module_registry_uses_default_variant():
+    assert model_manager.model_registry.default_variant in model_manager.model_registry._entries
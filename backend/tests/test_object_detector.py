@@ -0,0 +1,155 @@
+"""Étiquetage YOLO : politique par prompt, cache LRU par hash d'image, association par IoU"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.services import object_detector
+from app.services.object_detector import ObjectDetector, should_label
+from config import settings
+
+
+class _Array:
+    """Imite un tenseur ultralytics (.cpu().numpy())"""
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class _Boxes:
+    def __init__(self, xyxy, cls):
+        self.xyxy = _Array(xyxy)
+        self.cls = _Array(cls)
+
+    def __len__(self):
+        return len(self.cls.values)
+
+
+class _Result:
+    def __init__(self, xyxy, cls):
+        self.boxes = _Boxes(xyxy, cls)
+
+
+class FakeYolo:
+    """Modèle YOLO factice : compte les appels et détecte les appels concurrents"""
+
+    names = {0: "person", 2: "car"}
+
+    def __init__(self, xyxy, cls, delay: float = 0.0):
+        self.xyxy, self.cls, self.delay = xyxy, cls, delay
+        self.calls = 0
+        self.active = 0
+        self.overlapped = False
+        self._lock = threading.Lock()
+
+    def __call__(self, image, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.calls += 1
+            self.overlapped |= self.active > 1
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return [_Result(self.xyxy, self.cls)]
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    # Instance neuve du singleton, sans ultralytics
+    monkeypatch.setattr(ObjectDetector, "_instance", None)
+    monkeypatch.setattr(object_detector, "YOLO_AVAILABLE", False)
+    detector = ObjectDetector()
+    detector.model = FakeYolo([[10, 10, 50, 50], [60, 0, 100, 40]], [0, 2])
+    detector.class_names = FakeYolo.names
+    detector.available = True
+    return detector
+
+
+IMAGE = np.zeros((8, 8, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("policy, prompt, expected", [
+    ("off", "objet", False),
+    ("always", "voiture rouge", True),
+    ("generic", "objets", True),
+    ("generic", "  Tous   les OBJETS ", True),
+    ("generic", "voiture rouge", False),
+])
+def test_should_label_policy(policy, prompt, expected):
+    assert should_label(prompt, policy) is expected
+
+
+def test_should_label_defaults_to_settings(monkeypatch):
+    monkeypatch.setattr(settings, "YOLO_LABELING", "always")
+    assert should_label("voiture")
+    monkeypatch.setattr(settings, "YOLO_LABELING", "off")
+    assert not should_label("objet")
+
+
+def test_singleton_reads_configuration(detector):
+    assert ObjectDetector() is detector
+    assert detector.conf == settings.YOLO_CONFIDENCE
+    assert detector.imgsz == settings.YOLO_IMGSZ
+
+
+def test_detect_cache_is_keyed_by_image_hash(detector, monkeypatch):
+    monkeypatch.setattr(settings, "YOLO_CACHE_SIZE", 2)
+    boxes, classes = detector.detect(IMAGE, "a")
+    assert boxes.shape == (2, 4) and classes.tolist() == [0, 2]
+
+    detector.detect(IMAGE, "a")
+    assert detector.model.calls == 1
+    detector.detect(IMAGE)  # sans hash : jamais mis en cache
+    detector.detect(IMAGE)
+    assert detector.model.calls == 3
+
+    detector.detect(IMAGE, "b")
+    detector.detect(IMAGE, "a")  # "a" redevient le plus récent
+    detector.detect(IMAGE, "c")  # évince "b"
+    assert list(detector._cache) == ["a", "c"]
+    detector.detect(IMAGE, "b")
+    assert detector.model.calls == 6
+
+
+def test_detect_serializes_inference(detector):
+    detector.model.delay = 0.02
+    threads = [threading.Thread(target=detector.detect, args=(IMAGE,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert detector.model.calls == 4
+    assert not detector.model.overlapped
+
+
+def test_detect_unavailable_returns_empty(detector):
+    detector.available = False
+    boxes, classes = detector.detect(IMAGE, "a")
+    assert boxes.shape == (0, 4) and classes.shape == (0,)
+    assert detector.model.calls == 0
+
+
+def test_match_labels_by_iou(detector):
+    detections = detector.detect(IMAGE)
+    bboxes = [
+        {"x1": 12, "y1": 12, "x2": 50, "y2": 48},   # recouvre la personne
+        {"x1": 60, "y1": 0, "x2": 95, "y2": 40},    # recouvre la voiture
+        {"x1": 40, "y1": 40, "x2": 70, "y2": 70},   # chevauchement trop faible (IoU < 0.3)
+        {"x1": 200, "y1": 200, "x2": 220, "y2": 220},
+    ]
+    assert detector.match_labels(bboxes, detections) == {
+        0: "person", 1: "car", 2: "unidentified", 3: "unidentified"
+    }
+
+
+def test_match_labels_without_detections(detector):
+    empty = (np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32))
+    bboxes = [{"x1": 0, "y1": 0, "x2": 4, "y2": 4}]
+    assert detector.match_labels(bboxes, empty) == {0: "object"}
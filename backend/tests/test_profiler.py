@@ -0,0 +1,181 @@
+"""Profilage à la demande : armement, réservation d'une capture, régions, export et rotation des artefacts"""
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import profiler as profiler_module
+from app.services.profiler import ProfilingSession
+from config import settings
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    # Échantillonneur Python seul : pas de torch.profiler dans les tests
+    monkeypatch.setattr(profiler_module, "TORCH_PROFILER_AVAILABLE", False)
+    monkeypatch.setattr(settings, "PROFILING_MAX_REQUESTS", 5)
+    monkeypatch.setattr(settings, "PROFILING_MAX_DURATION", 60)
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_INTERVAL_MS", 1)
+    monkeypatch.setattr(settings, "PROFILING_MAX_ARTIFACTS", 60)
+    return ProfilingSession(str(tmp_path / "profiles"))
+
+
+def _busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+def test_arm_is_bounded_by_config_and_exclusive(session):
+    status = session.arm(requests=50, duration_s=3600)
+    assert status["active"] and status["remaining_requests"] == 5
+    assert 0 < status["expires_in_s"] <= 60
+    with pytest.raises(RuntimeError):
+        session.arm()
+
+    status = session.disarm()
+    assert not status["active"] and status["remaining_requests"] is None
+    # Sans paramètre : une seule requête
+    assert session.arm()["remaining_requests"] == 1
+
+
+def test_claim_counts_down_requests(session):
+    session.arm(requests=2)
+    assert session._claim() == 1
+    # Une capture déjà en cours : les requêtes concurrentes ne sont pas profilées
+    assert session._claim() is None
+    session._current = None
+    assert session._claim() == 2
+    session._current = None
+    assert not session.active
+    assert session._claim() is None
+
+
+def test_claim_after_deadline_disarms(session):
+    session.arm(duration_s=10)
+    session.deadline = time.monotonic() - 1
+    assert session._claim() is None
+    assert not session.active
+
+
+def test_capture_exports_speedscope_profile_of_executor_thread(session):
+    session.arm(requests=1)
+
+    def pipeline(capture):
+        with session.track_thread(capture):
+            _busy(0.05)
+
+    async def request():
+        async with session.capture("segment: voiture"):
+            capture = session.current_capture()
+            assert capture is not None
+            await asyncio.get_running_loop().run_in_executor(None, pipeline, capture)
+
+    asyncio.run(request())
+    assert session.current_capture() is None and session._current is None
+    assert not session.active and session.captured == 1
+
+    artifacts = session.list_artifacts()
+    assert artifacts == [f"{session.session_id}_001.speedscope.json"]
+    with open(session.artifact_path(artifacts[0]), encoding="utf-8") as f:
+        profile = json.load(f)
+    assert profile["name"] == "segment: voiture"
+    frames = {frame["name"] for frame in profile["shared"]["frames"]}
+    assert "_busy" in frames
+
+
+def test_request_outside_session_is_not_captured(session):
+    async def request():
+        async with session.capture("segment"):
+            assert session.current_capture() is None
+
+    asyncio.run(request())
+    assert session.list_artifacts() == []
+
+
+class FakeTorchProfiler:
+    """Remplace torch.profiler.profile : seule la propagation du contexte est testée"""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            f.write("{}")
+
+    def key_averages(self):
+        return SimpleNamespace(table=lambda **kwargs: "")
+
+
+def test_region_only_records_in_the_captured_request(session, monkeypatch):
+    monkeypatch.setattr(profiler_module, "TORCH_PROFILER_AVAILABLE", True)
+    monkeypatch.setattr(profiler_module, "profile", FakeTorchProfiler, raising=False)
+    monkeypatch.setattr(profiler_module, "ProfilerActivity", SimpleNamespace(CPU="cpu", CUDA="cuda"), raising=False)
+    monkeypatch.setattr(profiler_module, "torch", SimpleNamespace(cuda=SimpleNamespace(is_available=lambda: False)), raising=False)
+    monkeypatch.setattr(profiler_module, "record_function", lambda name: ("record", name), raising=False)
+    session.arm(requests=1)
+    seen = {}
+
+    async def captured(entered, done):
+        async with session.capture("capturée"):
+            seen["captured"] = session.region("sam3.forward")
+            capture = session.current_capture()
+
+            def pipeline():
+                with session.track_thread(capture):
+                    return session.region("sam3.forward")
+
+            seen["executor"] = await asyncio.get_running_loop().run_in_executor(None, pipeline)
+            entered.set()
+            await done.wait()
+
+    async def concurrent(entered, done):
+        await entered.wait()
+        # Une capture est en cours, mais pas pour cette requête
+        seen["concurrent"] = session.region("sam3.forward")
+        seen["concurrent_executor"] = await asyncio.get_running_loop().run_in_executor(
+            None, session.region, "sam3.forward"
+        )
+        done.set()
+
+    async def run():
+        entered, done = asyncio.Event(), asyncio.Event()
+        await asyncio.gather(captured(entered, done), concurrent(entered, done))
+
+    asyncio.run(run())
+    assert seen["captured"] == ("record", "sam3.forward")
+    assert seen["executor"] == ("record", "sam3.forward")
+    assert seen["concurrent"] is profiler_module._NULL_CONTEXT
+    assert seen["concurrent_executor"] is profiler_module._NULL_CONTEXT
+    assert f"{session.session_id}_001.trace.json" in session.list_artifacts()
+
+
+def test_prune_keeps_most_recent_artifacts(session, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_MAX_ARTIFACTS", 3)
+    os.makedirs(session.output_dir)
+    for i in range(5):
+        path = os.path.join(session.output_dir, f"old_{i}.speedscope.json")
+        with open(path, "w") as f:
+            f.write("{}")
+        os.utime(path, (1000 + i, 1000 + i))
+
+    session._prune()
+    assert session.list_artifacts() == [f"old_{i}.speedscope.json" for i in (2, 3, 4)]
+
+
+def test_artifact_path_refuses_traversal(session):
+    os.makedirs(session.output_dir)
+    with open(os.path.join(session.output_dir, "a.speedscope.json"), "w") as f:
+        f.write("{}")
+    assert session.artifact_path("a.speedscope.json").endswith("a.speedscope.json")
+    assert session.artifact_path("../a.speedscope.json") is None
+    assert session.artifact_path("absent.json") is None
@@ -0,0 +1,40 @@
+"""Routes /upload et /segment : fichiers illisibles refusés (400) avant toute inférence"""
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("cv2")
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import segmentation
+from config import settings
+
+
+@pytest.fixture
+def api():
+    app = FastAPI()
+    app.include_router(segmentation.router)
+    return TestClient(app)
+
+
+def test_segment_rejects_file_that_is_not_an_image(api, tmp_path):
+    fake = tmp_path / "photo.png"
+    fake.write_bytes(b"pas une image")
+    response = api.post("/api/v3/segment", json={"image_path": str(fake), "prompt": "voiture"})
+    assert response.status_code == 400
+    assert "Image illisible" in response.json()["detail"]
+
+
+def test_segment_missing_image_is_404(api, tmp_path):
+    response = api.post("/api/v3/segment", json={"image_path": str(tmp_path / "absente.png"), "prompt": "voiture"})
+    assert response.status_code == 404
+
+
+def test_upload_rejects_file_that_is_not_an_image(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    response = api.post("/api/v3/upload", files={"file": ("photo.png", b"pas une image", "image/png")})
+    assert response.status_code == 400
+    assert list(tmp_path.iterdir()) == []
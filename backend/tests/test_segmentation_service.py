@@ -0,0 +1,21 @@
+"""Pipeline de segmentation : dédoublonnage des prompts avant inférence"""
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("cv2")
+
+from app.services.segmentation_service import unique_prompts
+
+
+def test_unique_prompts_ignores_case_and_spacing():
+    assert unique_prompts("voiture", ["Voiture ", "  VOITURE", "vélo", "Vélo", "camion"]) == [
+        "voiture", "vélo", "camion"
+    ]
+
+
+def test_unique_prompts_drops_empty_prompts_and_keeps_main_first():
+    assert unique_prompts("Boulons  rouillés", [None, "", "   ", "boulons rouillés", "écrous"]) == [
+        "Boulons  rouillés", "écrous"
+    ]
+    assert unique_prompts("voiture") == ["voiture"]
@@ -0,0 +1,134 @@
+"""Cache des embeddings textuels : LRU, persistance sur disque et précalcul par lots équivalent à l'encodage seul"""
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from app.models.sam3 import text_embedding_cache as cache_module
+from app.models.sam3.sam3_wrapper import SAM3Wrapper
+from app.models.sam3.text_embedding_cache import TextEmbeddingCache, normalize_prompt
+
+MODEL = "facebook/sam3@torch.float32"
+
+
+def _embedding(value: float, tokens: int = 3):
+    return torch.full((1, tokens, 4), value), torch.ones(1, tokens, dtype=torch.long)
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Boulons   Rouillés ") == "boulons rouillés"
+
+
+def test_lru_evicts_least_recently_used():
+    cache = TextEmbeddingCache(max_entries=2)
+    cache.put(MODEL, "a", *_embedding(1))
+    cache.put(MODEL, "b", *_embedding(2))
+    assert cache.get(MODEL, "A ") is not None  # "a" redevient le plus récent
+    cache.put(MODEL, "c", *_embedding(3))
+
+    assert cache.get(MODEL, "b") is None
+    assert cache.get(MODEL, "a")[0][0, 0, 0] == 1
+    assert cache.get(MODEL, "c") is not None
+    assert cache.get_stats() == {"entries": 2, "hits": 3, "misses": 1}
+
+
+def test_entries_are_scoped_by_model():
+    cache = TextEmbeddingCache(max_entries=8)
+    cache.put(MODEL, "voiture", *_embedding(1))
+    cache.put("facebook/sam3@torch.float16", "voiture", *_embedding(2))
+    assert cache.missing(MODEL, ["Voiture", "vélo", "vélo", " "]) == ["vélo"]
+
+    assert cache.clear(MODEL) == 1
+    assert cache.get(MODEL, "voiture") is None
+    assert cache.get("facebook/sam3@torch.float16", "voiture") is not None
+
+
+def test_get_or_compute_computes_once():
+    cache = TextEmbeddingCache(max_entries=8)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return _embedding(5)
+
+    first = cache.get_or_compute(MODEL, "voiture", compute)
+    second = cache.get_or_compute(MODEL, "VOITURE", compute)
+    assert len(calls) == 1
+    assert torch.equal(first[0], second[0])
+
+
+def test_persisted_cache_reloads_with_weights_only(tmp_path):
+    path = str(tmp_path / "cache" / "text_embeddings.pt")
+    cache = TextEmbeddingCache(max_entries=8, persist_path=path)
+    cache.put(MODEL, "voiture", *_embedding(1.5, tokens=2))
+    cache.put(MODEL, "vélo", *_embedding(2.5, tokens=3))
+    cache.save()
+
+    # Le fichier ne contient que des tenseurs et types simples : lisible avec weights_only=True
+    data = torch.load(path, map_location="cpu", weights_only=True)
+    assert data["version"] == cache_module.CACHE_FORMAT_VERSION
+
+    restored = TextEmbeddingCache(max_entries=8, persist_path=path)
+    restored.load()
+    embeds, attention_mask = restored.get(MODEL, "vélo")
+    assert embeds.shape == (1, 3, 4) and float(embeds[0, 0, 0]) == 2.5
+    assert attention_mask.dtype == torch.long
+    assert restored.missing(MODEL, ["voiture", "vélo"]) == []
+
+
+def test_persisted_cache_of_another_format_is_ignored(tmp_path):
+    path = str(tmp_path / "text_embeddings.pt")
+    torch.save({"version": 1, "entries": [(MODEL, "voiture", *_embedding(1))]}, path)
+    cache = TextEmbeddingCache(max_entries=8, persist_path=path)
+    cache.load()
+    assert cache.get_stats()["entries"] == 0
+
+    with open(path, "wb") as f:
+        f.write(b"fichier tronque")
+    cache.load()
+    assert cache.get_stats()["entries"] == 0
+
+
+class FakeProcessor:
+    """Un jeton par mot, padding à droite jusqu'au prompt le plus long du lot"""
+
+    def __call__(self, text, padding=True, return_tensors="pt"):
+        tokens = [[len(word) for word in prompt.split()] for prompt in text]
+        width = max(len(t) for t in tokens)
+        input_ids = torch.tensor([t + [0] * (width - len(t)) for t in tokens])
+        attention_mask = torch.tensor([[1] * len(t) + [0] * (width - len(t)) for t in tokens])
+        return transformers.BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask})
+
+
+class FakeTextModel:
+    def get_text_features(self, input_ids, attention_mask):
+        return (input_ids * attention_mask).unsqueeze(-1).float().repeat(1, 1, 4)
+
+
+@pytest.fixture
+def wrapper(monkeypatch):
+    monkeypatch.setattr(cache_module, "text_embedding_cache", TextEmbeddingCache(max_entries=16))
+    monkeypatch.setattr("app.models.sam3.sam3_wrapper.text_embedding_cache", cache_module.text_embedding_cache)
+    wrapper = SAM3Wrapper.__new__(SAM3Wrapper)
+    wrapper.device = "cpu"
+    wrapper.cache_key = MODEL
+    wrapper.processor = FakeProcessor()
+    wrapper.model = FakeTextModel()
+    wrapper.is_loaded = True
+    return wrapper
+
+
+def test_warm_up_matches_single_prompt_encoding(wrapper):
+    prompts = ["boulons rouillés sur acier", "vis"]
+    assert wrapper.warm_up_text(prompts, batch_size=2) == 2
+    warmed = {prompt: cache_module.text_embedding_cache.get(MODEL, prompt) for prompt in prompts}
+
+    cache_module.text_embedding_cache.clear()
+    for prompt in prompts:
+        embeds, attention_mask = wrapper.encode_text(prompt)
+        assert torch.equal(embeds, warmed[prompt][0])
+        assert torch.equal(attention_mask, warmed[prompt][1])
+
+    # Le prompt court n'a pas hérité du padding du lot
+    assert warmed["vis"][0].shape == (1, 1, 4)
+    assert wrapper.warm_up_text(prompts) == 0